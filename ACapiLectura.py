@@ -3,9 +3,20 @@ import requests
 import pandas as pd
 import datetime
 import numpy as np
+import threading
+import time
+import json
 
 app = Flask(__name__)
 
+PROM_BASE_URL = "http://sensor.aireciudadano.com:30000/api/v1"
+# seconds between refreshes of the last_register table
+LATEST_POLL_SECONDS = 30
+# seconds to wait for Prometheus on each refresh
+LATEST_FETCH_TIMEOUT = 10
+# missed refreshes after which last_register answers an error instead of old values
+LATEST_STALE_INTERVALS = 3
+
 # constant
 selected_cols = [        
     "PM25",
@@ -82,6 +93,137 @@ def _wide_table(df, selected_cols):
 
     return df_result
 
+class StaleSnapshotError(Exception):
+    pass
+
+# latest sample per station and metric, refreshed in the background
+class LatestStore:
+    def __init__(self, selected_cols, interval=LATEST_POLL_SECONDS):
+        self.selected_cols = selected_cols
+        self.col_index = {col: i for i, col in enumerate(selected_cols)}
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        # snapshot is replaced as a whole, so readers never see a half-built table
+        self.snapshot = None
+
+    def refresh(self):
+        query = '{job="pushgateway"}'
+        response = requests.get(f"{PROM_BASE_URL}/query?query={query}", timeout=LATEST_FETCH_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()['data']['result']
+
+        station_index = {}
+        rows, cols, values, stamps = [], [], [], {}
+        for result in data:
+            metric = result.get('metric', {})
+            station = metric.get('exported_job')
+            col = self.col_index.get(metric.get('__name__'))
+            if station is None or col is None:
+                continue
+            timestamp, value = result['value']
+            rows.append(station_index.setdefault(station, len(station_index)))
+            cols.append(col)
+            values.append(float(value))
+            stamps[station] = max(stamps.get(station, timestamp), timestamp)
+
+        # compact table: one row per station (sorted like the pivot), one column per metric
+        stations = sorted(station_index)
+        order = np.empty(len(stations), dtype=np.int64)
+        order[[station_index[station] for station in stations]] = np.arange(len(stations))
+        table = np.full((len(stations), len(self.selected_cols)), np.nan)
+        table[order[np.asarray(rows, dtype=np.int64)], np.asarray(cols, dtype=np.int64)] = values
+        for col in ('Latitude', 'Longitude'):
+            column = table[:, self.col_index[col]]
+            column[column == 0] = np.nan
+
+        # same row layout as get_data(...).to_json(orient='records'), formatted once per refresh
+        records = []
+        for i, station in enumerate(stations):
+            moment = datetime.datetime.fromtimestamp(stamps[station], datetime.timezone.utc)
+            record = {
+                'station': station,
+                'date': int(stamps[station] // 86400) * 86400000,
+                'time': moment.time().isoformat(),
+            }
+            for col, value in zip(self.selected_cols, table[i].tolist()):
+                # 10 decimals, like to_json's default double_precision
+                record[col] = None if np.isnan(value) else round(value, 10)
+            records.append(record)
+
+        self.snapshot = {
+            'stations': stations,
+            'table': table,
+            'records': records,
+            'data_json': json.dumps(records, separators=(',', ':')),
+            'updated': time.time(),
+        }
+
+    def _poll(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as error:
+                app.logger.error(f'last_register refresh failed, serving previous table: {error}')
+
+    def get(self):
+        # the first request fills the table and starts the poller
+        with self.lock:
+            if self.snapshot is None:
+                self.refresh()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._poll, daemon=True)
+                self.thread.start()
+        snapshot = self.snapshot
+        age = time.time() - snapshot['updated']
+        if age > self.interval * LATEST_STALE_INTERVALS:
+            app.logger.error(f'last_register table is {age:.0f} s old, refreshes are failing')
+            raise StaleSnapshotError(f'Latest values are out of date (last refresh {age:.0f} s ago). Please try again later.')
+        return snapshot
+
+    def query(self, stations=None, metrics=None, bbox=None):
+        snapshot = self.get()
+        if not (stations or metrics or bbox):
+            return snapshot['data_json']
+
+        table = snapshot['table']
+        mask = np.ones(len(snapshot['stations']), dtype=bool)
+        if stations:
+            # case-insensitive substring match, like station_filter (str.contains(case=False)) in the other apps
+            mask &= [any(name in station.lower() for name in stations) for station in snapshot['stations']]
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            lon = table[:, self.col_index['Longitude']]
+            lat = table[:, self.col_index['Latitude']]
+            mask &= (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+
+        records = [snapshot['records'][i] for i in np.flatnonzero(mask)]
+        if metrics:
+            keys = ['station', 'date', 'time'] + metrics
+            records = [{key: record[key] for key in keys} for record in records]
+        return json.dumps(records, separators=(',', ':'))
+
+latest_store = LatestStore(selected_cols)
+
+# parse the optional last_register filters: comma separated lists and a min_lon,min_lat,max_lon,max_lat box
+def _latest_filters(args):
+    stations = [name.strip().lower() for name in args.get('station', '').split(',') if name.strip()]
+    metrics = [name.strip() for name in args.get('metric', '').split(',') if name.strip()]
+    unknown = [name for name in metrics if name not in selected_cols]
+    if unknown:
+        raise ValueError(f"Unknown metric: {', '.join(unknown)}")
+    bbox = None
+    if args.get('bbox'):
+        bbox = [float(value) for value in args['bbox'].split(',')]
+        if len(bbox) != 4:
+            raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat')
+        if not np.all(np.isfinite(bbox)):
+            raise ValueError('bbox values must be finite numbers')
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError('bbox min_lon/min_lat must not be greater than max_lon/max_lat')
+    return stations, metrics, bbox
+
 # constructor of the step value for time range queries
 def _get_step(number, choice):
     # convert word to code
@@ -126,6 +268,13 @@ def index():
             <label for="ends_hour">End Hour:</label><br>
             <input type="time" id="ends_hour" name="ends_hour" value="00:00"><br><br>
 
+            <label for="station">Station filter (last register):</label><br>
+            <input type="text" id="station" name="station" value=""><br><br>
+            <label for="metric">Metrics, comma separated (last register):</label><br>
+            <input type="text" id="metric" name="metric" value=""><br><br>
+            <label for="bbox">Bounding box min_lon,min_lat,max_lon,max_lat (last register):</label><br>
+            <input type="text" id="bbox" name="bbox" value=""><br><br>
+
             <label for="step_number">Step Number:</label><br>
             <input type="number" id="step_number" name="step_number" value="1"><br><br>
             <label for="step_option">Step Option:</label><br>
@@ -155,22 +304,33 @@ def get_prometheus_data():
     step_number = request.args.get('step_number', default=1, type=int)
     step_option = request.args.get('step_option', default='hours', type=str)
 
+    # last registers selected: served from the in-memory table kept by latest_store
+    if option == 'last_register':
+        try:
+            stations, metrics, bbox = _latest_filters(request.args)
+        except ValueError as error:
+            return jsonify({'status': 'error', 'message': str(error)}), 400
+        try:
+            data_json = latest_store.query(stations, metrics, bbox)
+        except StaleSnapshotError as error:
+            return jsonify({'status': 'error', 'message': str(error)}), 503
+        except Exception as error:
+            return jsonify({'status': 'error', 'message': str(error)}), 500
+        return jsonify({'status': 'success', 'data': data_json}), 200
+
     try:
         # query to get all data
         query = '{job="pushgateway"}'
 
-        # last registers selected
-        if option == 'last_register':
-            url = f"http://sensor.aireciudadano.com:30000/api/v1/query?query={query}"
         # range of time selected
-        elif option == 'time_range':
+        if option == 'time_range':
             # construct start_datetime
             start_datetime = f"{starts_day}T{starts_hour}:00Z"
             # construct end_datetime
             end_datetime = f"{ends_day}T{ends_hour}:00Z"
             # construct step                
             step = _get_step(step_number, step_option)
-            url = f"http://sensor.aireciudadano.com:30000/api/v1/query_range?query={query}&start={start_datetime}&end={end_datetime}&step={step}"
+            url = f"{PROM_BASE_URL}/query_range?query={query}&start={start_datetime}&end={end_datetime}&step={step}"
         
         # get obs from API, using the url created before
         obs = get_data(url, selected_cols)
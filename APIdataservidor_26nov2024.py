@@ -1,6 +1,7 @@
 # Version final APIdata: 5 meses van bien. 26nov2024
 
 from flask import Flask, request, jsonify, render_template_string, send_file, Response
+import os
 import threading
 import requests
 import pandas as pd
@@ -11,11 +12,28 @@ import io
 import zipfile
 import json
 import logging
+from aggregation_common import bucketed_stats
+import re
+
+try:
+    # Con pyarrow los datos van de la respuesta de Prometheus a los archivos en RecordBatch, sin copias de pandas
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None  # Sin pyarrow se usa la ruta pandas de siempre (y no hay salida Parquet)
 
 selected_cols = [
     "PM25", "PM25raw", "PM1", "Humidity", "Temperature",
 ]
 
+# Prometheus (bench_export_vm.py lo apunta a un servidor local de prueba)
+PROM_BASE_URL = "http://sensor.aireciudadano.com:30000/api/v1"
+
+ARROW_BATCH_ROWS = 65536  # Filas por RecordBatch al escribir CSV/JSON/Parquet
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
 
@@ -59,18 +77,7 @@ def process_data_in_chunks(url, variables, start_datetime, end_datetime):
         chunk_data = get_data(url, variables, current_start, current_end, '1m', interval_minutes=60)
 
         # Aplicar promedio horario al chunk
-        chunk_data['date'] = pd.to_datetime(chunk_data['date'], utc=True)
-        chunk_data.set_index(['station', 'date'], inplace=True)
-        chunk_data = chunk_data.apply(pd.to_numeric, errors='coerce')
-
-        hourly_chunks = []
-        for station, group in chunk_data.groupby('station'):
-            hourly_data = group.resample('1h', level='date').mean()
-            hourly_data.index = hourly_data.index + pd.Timedelta(hours=1)
-            hourly_data['station'] = station
-            hourly_chunks.append(hourly_data.reset_index())
-
-        chunk_data = pd.concat(hourly_chunks, ignore_index=True)
+        chunk_data = bucketed_stats(chunk_data)
         all_data.append(chunk_data)
 
         current_start = current_end
@@ -189,6 +196,303 @@ def _wide_table(df, selected_cols):
         raise
 
 
+# ==========================================
+# RUTA ARROW: decode -> promedio -> escritores, todo en RecordBatch
+# ==========================================
+def decode_arrow_batch(data, variables, station_re=None):
+    # Resultado de query_range -> RecordBatch largo (station, metric, time, value), sin json_normalize/explode/apply
+    station_codes = {}
+    codes, metrics, times, values = [], [], [], []
+    for series in data:
+        labels = series.get('metric', {})
+        station = labels.get('exported_job')
+        if station is None or (station_re is not None and not station_re.search(station)):
+            continue
+        points = series.get('values') or ([series['value']] if 'value' in series else [])
+        if not points:
+            continue
+
+        point_times, point_values = zip(*points)
+        series_times = np.array(point_times, dtype=np.float64).astype(np.int64)
+        name = labels.get('__name__')
+        if name in variables:
+            metric = variables.index(name)
+            series_values = np.array(point_values, dtype=np.float64)
+            if name in ('Latitude', 'Longitude'):
+                series_values[series_values == 0] = np.nan
+        else:
+            # Las demás métricas de la estación solo cuentan para el rango de horas con datos (como en el pivot),
+            # así que basta con su primer y último instante
+            metric = -1
+            series_times = np.array([series_times.min(), series_times.max()])
+            series_values = np.full(2, np.nan)
+
+        code = station_codes.setdefault(station, len(station_codes))
+        codes.append(np.full(len(series_times), code, dtype=np.int32))
+        metrics.append(np.full(len(series_times), metric, dtype=np.int16))
+        times.append(series_times)
+        values.append(series_values)
+
+    if not codes:
+        return None
+    station = pa.DictionaryArray.from_arrays(pa.array(np.concatenate(codes)), pa.array(list(station_codes), pa.string()))
+    return pa.RecordBatch.from_arrays(
+        [station, pa.array(np.concatenate(metrics)), pa.array(np.concatenate(times)), pa.array(np.concatenate(values))],
+        names=['station', 'metric', 'time', 'value'])
+
+def fetch_arrow_batches(url, variables, start_datetime, end_datetime, step, station_re=None, interval_minutes=60):
+    # Mismas consultas por hora que get_data, pero cada respuesta se convierte en un RecordBatch
+    current_start_time = start_datetime
+
+    while current_start_time < end_datetime:
+        current_end_time = min(current_start_time + datetime.timedelta(minutes=interval_minutes), end_datetime)
+        current_start_time_1s = current_start_time + pd.Timedelta(seconds=1)
+        query_url = f"{url}&start={current_start_time_1s.isoformat()}Z&end={current_end_time.isoformat()}Z&step={step}"
+
+        app.logger.debug(f"Querying data from {current_start_time_1s} to {current_end_time}")
+
+        try:
+            response = requests.get(query_url)
+            response.raise_for_status()
+            batch = decode_arrow_batch(response.json().get('data', {}).get('result', []), variables, station_re)
+            if batch is None:
+                app.logger.warning(f"No data returned from API for interval {current_start_time} to {current_end_time}")
+            else:
+                yield batch
+        except requests.exceptions.RequestException as e:
+            app.logger.error(f'Network error fetching data chunk: {str(e)}')
+            raise
+        except Exception as e:
+            app.logger.error(f'Error processing data chunk: {str(e)}')
+
+        current_start_time = current_end_time
+
+def arrow_bucketed_mean(batches, variables, interval_minutes=60, label_end=True, window=None):
+    # bucketed_stats (media) directo desde los RecordBatch largos, sin tabla ancha por minuto ni concatenar los batches:
+    # una pasada para el rango de cada estación y otra que acumula sumas y conteos batch por batch.
+    # Devuelve una tabla Arrow date + variables + station, redondeada a 3 decimales y filtrada por window (epoch s)
+    fields = [pa.field('date', pa.timestamp('s', tz='UTC'))] + [pa.field(col, pa.float64()) for col in variables]
+    fields.append(pa.field('station', pa.dictionary(pa.int32(), pa.string())))
+    if not batches:
+        return pa.schema(fields).empty_table()
+
+    # Códigos de estación comunes a todos los batches (cada batch trae su propio diccionario)
+    station_codes = {}
+    batch_codes = []
+    first_ts = np.empty(0, dtype=np.int64)
+    last_ts = np.empty(0, dtype=np.int64)
+    for batch in batches:
+        stations = batch.column('station')
+        lookup = np.array([station_codes.setdefault(name, len(station_codes)) for name in stations.dictionary.to_pylist()],
+                          dtype=np.int32)
+        codes = lookup[stations.indices.to_numpy()]
+        batch_codes.append(codes)
+        new_stations = len(station_codes) - len(first_ts)
+        if new_stations:
+            first_ts = np.concatenate([first_ts, np.full(new_stations, np.iinfo(np.int64).max)])
+            last_ts = np.concatenate([last_ts, np.full(new_stations, np.iinfo(np.int64).min)])
+        timestamps = batch.column('time').to_numpy()
+        np.minimum.at(first_ts, codes, timestamps)
+        np.maximum.at(last_ts, codes, timestamps)
+
+    n_stations = len(station_codes)
+    seconds = np.int64(interval_minutes * 60)
+    names = np.array(list(station_codes), dtype=object)
+    order = np.argsort(names)
+    rank = np.empty(n_stations, dtype=np.int32)
+    rank[order] = np.arange(n_stations, dtype=np.int32)
+    first_ts, last_ts = first_ts[order], last_ts[order]
+
+    # Mismo origen e intervalos que bucketed_stats: medianoche del primer dato de cada estación
+    origin = first_ts - first_ts % 86400
+    first_bucket = (first_ts - origin) // seconds
+    span = (last_ts - origin) // seconds - first_bucket + 1
+    offsets = np.cumsum(span) - span
+    total = int(span.sum())
+    slot_base = offsets - first_bucket  # slot = slot_base[estación] + (ts - origin[estación]) // seconds
+
+    # Una fila de la matriz por variable: cada columna de salida queda contigua y pasa a Arrow sin copia
+    size = len(variables) * total
+    matrix = np.zeros(size)
+    counts = np.zeros(size, dtype=np.int64)
+    for batch, codes in zip(batches, batch_codes):
+        codes = rank[codes]
+        metrics = batch.column('metric').to_numpy()
+        values = batch.column('value').to_numpy()
+        valid = (metrics >= 0) & ~np.isnan(values)
+        codes = codes[valid]
+        cells = (batch.column('time').to_numpy()[valid] - origin[codes]) // seconds
+        cells += slot_base[codes]
+        cells += metrics[valid].astype(np.int64) * total
+        matrix += np.bincount(cells, weights=values[valid], minlength=size)
+        counts += np.bincount(cells, minlength=size)
+    np.divide(matrix, counts, out=matrix, where=counts > 0)
+    matrix[counts == 0] = np.nan
+    np.round(matrix, 3, out=matrix)
+    matrix = matrix.reshape(len(variables), total)
+
+    station_index = np.repeat(np.arange(n_stations, dtype=np.int32), span)
+    bucket_index = np.arange(total) - offsets[station_index] + first_bucket[station_index]
+    labels = origin[station_index] + (bucket_index + (1 if label_end else 0)) * seconds
+
+    keep = slice(None)
+    if window is not None:
+        in_window = (labels >= window[0]) & (labels <= window[1])
+        if not in_window.all():
+            keep = in_window
+
+    arrays = [pa.array(labels[keep], type=pa.timestamp('s', tz='UTC'))]
+    arrays += [pa.array(matrix[i][keep], from_pandas=True) for i in range(len(variables))]  # NaN -> null
+    arrays.append(pa.DictionaryArray.from_arrays(pa.array(station_index[keep]), pa.array(names[order].tolist(), pa.string())))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+def fetch_arrow_chunks(url, variables, start_datetime, end_datetime, station_filter='', window=None):
+    # Bloques de 7 días como process_data_in_chunks: cada uno se promedia apenas llega y solo queda la tabla horaria
+    station_re = re.compile('|'.join(station_filter.split(',')), re.IGNORECASE) if station_filter else None
+    chunk_size = datetime.timedelta(days=7)
+    current_start = start_datetime
+
+    while current_start < end_datetime:
+        current_end = min(current_start + chunk_size, end_datetime)
+        batches = list(fetch_arrow_batches(url, variables, current_start, current_end, '1m', station_re))
+        yield arrow_bucketed_mean(batches, variables, window=window)
+        current_start = current_end
+
+def station_slices(tables):
+    # (estación, tramo) de cada bloque de 7 días, agrupando cada estación a través de los bloques y en orden
+    # de aparición, como el dict de registros de la ruta pandas. Los tramos son vistas: no copian datos
+    parts = {}
+    for table in tables:
+        offset = 0
+        for chunk in table.column('station').chunks:
+            indices = chunk.indices.to_numpy()
+            names = chunk.dictionary.to_pylist()
+            bounds = [0] + (np.flatnonzero(np.diff(indices)) + 1).tolist() + [len(indices)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                parts.setdefault(names[indices[start]], []).append(table.slice(offset + start, end - start))
+            offset += len(indices)
+    for station, slices in parts.items():
+        for part in slices:
+            yield station, part
+
+def iter_station_records(tables):
+    # Registros por estación para la salida en pantalla (jsonify necesita objetos Python; son 7 días como máximo).
+    # Los nulos de Arrow salen como None, igual que el reemplazo de NaN de la ruta pandas
+    for station, part in station_slices(tables):
+        value_names = [name for name in part.column_names if name not in ('date', 'station')]
+        columns = [pc.strftime(part.column('date'), format=DATE_FORMAT).to_pylist()]
+        columns += [part.column(name).to_pylist() for name in value_names]
+        keys = ['date'] + value_names
+        yield station, [dict(zip(keys, row)) for row in zip(*columns)]
+
+def arrow_grouped_records(tables):
+    grouped_data = {}
+    for station, records in iter_station_records(tables):
+        grouped_data.setdefault(station, []).extend(records)
+    return grouped_data
+
+# Texto de cada float igual a repr(), que es lo que escriben df.to_csv y json.dumps; los nulos quedan nulos.
+# El cast de Arrow da el mismo texto salvo que omite el .0 de los enteros, y con exponentes (|v| >= 1e13 o
+# < 1e-4, que tras redondear a 3 decimales no aparecen) elige otro formato: esos lotes se formatean en Python
+def _float_text(array):
+    magnitude = pc.abs(array)
+    if pc.any(pc.or_(pc.greater_equal(magnitude, 1e13), pc.and_(pc.greater(magnitude, 0), pc.less(magnitude, 1e-4)))).as_py():
+        return pa.array([None if value is None else repr(value) for value in array.to_pylist()], pa.string())
+    text = pc.cast(array, pa.string())
+    whole = pc.invert(pc.match_substring_regex(text, '[.eIN]'))
+    return pc.if_else(whole, pc.binary_join_element_wise(text, '.0', ''), text)
+
+# Bytes UTF-8 de un StringArray ya concatenados en su buffer de datos: se escriben sin pasar por objetos Python
+def _text_bytes(array):
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int32, count=len(array) + 1, offset=array.offset * 4)
+    return memoryview(array.buffers()[2])[offsets[0]:offsets[-1]]
+
+def write_json_member(zf, tables, total_records, process_duration):
+    # Mismo texto que json.dumps(result_data, indent=2), escrito estación por estación dentro del ZIP.
+    # Cada registro se arma por columnas con pyarrow.compute y se copia del buffer de Arrow al ZIP
+    with zf.open('data.json', 'w') as out:
+        out.write(f'{{\n  "total_records": {total_records},\n  "data": {{'.encode('utf-8'))
+        current = None
+        for station, part in station_slices(tables):
+            if station != current:
+                if current is not None:
+                    out.write(b'\n    ],')
+                out.write(f'\n    {json.dumps(station)}: [\n'.encode('utf-8'))
+                current = station
+            else:
+                out.write(b',\n')
+            value_names = [name for name in part.column_names if name not in ('date', 'station')]
+            batches = part.to_batches(ARROW_BATCH_ROWS)
+            for i, batch in enumerate(batches):
+                pieces = ['      {\n        "date": "', pc.strftime(batch.column('date'), format=DATE_FORMAT), '"']
+                for name in value_names:
+                    pieces += [f',\n        {json.dumps(name)}: ', pc.fill_null(_float_text(batch.column(name)), 'null')]
+                pieces.append('\n      },\n')
+                records = pc.binary_join_element_wise(*pieces, '')
+                text = _text_bytes(records)
+                out.write(text[:-2] if i == len(batches) - 1 else text)  # Sin el ',\n' del último registro
+        out.write(b'\n    ]\n  }' if current is not None else b'}')
+        out.write(f',\n  "process_duration": {json.dumps(process_duration)}\n}}'.encode('utf-8'))
+
+# Comillas como el csv de pandas (QUOTE_MINIMAL): solo si el texto lleva separador, comillas o saltos de línea
+def _csv_quote(text):
+    quoted = pc.binary_join_element_wise('"', pc.replace_substring(text, '"', '""'), '"', '')
+    return pc.if_else(pc.match_substring_regex(text, '[,"\r\n]'), quoted, text)
+
+def write_csv_member(zf, tables):
+    # Mismo texto que df.to_csv de la ruta pandas (comillas solo donde hacen falta, 12.0 y no 12, nulos vacíos).
+    # El CSVWriter de Arrow siempre pone comillas a los textos, así que cada línea se arma con pyarrow.compute
+    # y se copia del buffer de Arrow al ZIP, de a ARROW_BATCH_ROWS filas
+    with zf.open('data.csv', 'w') as out:
+        header = True
+        for station, part in station_slices(tables):
+            if header:
+                out.write((','.join(part.column_names) + os.linesep).encode('utf-8'))
+                header = False
+            for batch in part.to_batches(ARROW_BATCH_ROWS):
+                columns = []
+                for name in batch.schema.names:
+                    if name == 'date':
+                        columns.append(pc.strftime(batch.column('date'), format=DATE_FORMAT))
+                    elif name == 'station':
+                        # Una vez por valor del diccionario, no por fila
+                        dictionary = batch.column('station')
+                        columns.append(pc.take(_csv_quote(dictionary.dictionary), dictionary.indices))
+                    else:
+                        columns.append(pc.fill_null(_float_text(batch.column(name)), ''))
+                lines = pc.binary_join_element_wise(pc.binary_join_element_wise(*columns, ','), os.linesep, '')
+                out.write(_text_bytes(lines))
+        if header:
+            out.write(pd.DataFrame().to_csv(index=False).encode('utf-8'))  # Sin filas, igual que la ruta pandas
+
+def write_parquet_member(zf, tables):
+    # Parquet ya viene comprimido: se guarda sin deflate dentro del ZIP. Un row group por bloque de 7 días
+    info = zipfile.ZipInfo('data.parquet', date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    with zf.open(info, 'w') as raw_parquet, pq.ParquetWriter(raw_parquet, tables[0].schema, compression='zstd') as writer:
+        for table in tables:
+            writer.write_table(table, row_group_size=max(table.num_rows, 1))
+
+def create_arrow_zip_file(tables, file_format, total_records, process_duration):
+    memory_file = io.BytesIO()
+
+    try:
+        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
+            if file_format == 'json':
+                write_json_member(zf, tables, total_records, process_duration)
+            elif file_format == 'parquet':
+                write_parquet_member(zf, tables)
+            else:  # csv
+                write_csv_member(zf, tables)
+
+        memory_file.seek(0)
+        return memory_file
+
+    except Exception as e:
+        app.logger.error(f'Error creating zip file: {str(e)}')
+        raise
+
+
 @app.route('/getdata')
 def index():
     variables = request.args.getlist('variables') or selected_cols
@@ -230,6 +534,7 @@ def index():
                 <option value="screen">Result in screen</option>
                 <option value="filejson">Result in json ZIP file</option>
                 <option value="filecsv">Result in csv ZIP file</option>
+                {% if parquet %}<option value="fileparquet">Result in parquet ZIP file</option>{% endif %}
             </select><br><br>
 
             <input type="submit" value="Submit">
@@ -243,7 +548,51 @@ def index():
             }
         </script>
     ''', selected_cols=selected_cols, variables=variables, start_date=start_date,
-       start_time=start_time, end_date=end_date, end_time=end_time)
+       start_time=start_time, end_date=end_date, end_time=end_time, parquet=pa is not None)
+
+def pandas_result(base_url, query, variables, start_datetime, end_datetime, station_filter, date_diff):
+    # Ruta sin pyarrow: tabla ancha de pandas y registros agrupados por estación
+    if date_diff.days > 7:
+        all_data = []
+        for progress, chunk_data in process_data_in_chunks(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime):
+            if station_filter:
+                filters = station_filter.split(',')
+                chunk_data = chunk_data[chunk_data['station'].str.contains('|'.join(filters), case=False)]
+            all_data.append(chunk_data)
+        obs = pd.concat(all_data, ignore_index=True)
+    else:
+        obs = get_data(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime, '1m')
+
+        obs = bucketed_stats(obs)
+
+        if station_filter:
+            filters = station_filter.split(',')
+            obs = obs[obs['station'].str.contains('|'.join(filters), case=False)]
+
+    start_datetime = pd.to_datetime(start_datetime).tz_localize('UTC')
+    end_datetime = pd.to_datetime(end_datetime).tz_localize('UTC')
+
+    obs = obs[(obs['date'] >= start_datetime) & (obs['date'] <= end_datetime)]
+
+    obs = obs.round(3)
+
+    total_records = obs.shape[0]
+    obs['date'] = obs['date'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    json_data = obs.to_dict(orient='records')
+
+    for record in json_data:
+        for key, value in record.items():
+            if pd.isna(value):
+                record[key] = None
+
+    grouped_data = {}
+    for record in json_data:
+        station = record.pop('station')
+        if station not in grouped_data:
+            grouped_data[station] = []
+        grouped_data[station].append(record)
+
+    return total_records, grouped_data
 
 @app.route('/dataresult', methods=['POST'])
 def data():
@@ -258,7 +607,7 @@ def data():
     start_time = time.time()
     try:
         variables = request.form.getlist('variables')
-        base_url = "http://sensor.aireciudadano.com:30000/api/v1"
+        base_url = PROM_BASE_URL
         query = '{job%3D"pushgateway"}'
 
         start_date = request.form['start_date']
@@ -282,77 +631,47 @@ def data():
                 'error': 'For time ranges longer than 7 days, please select JSON or CSV file format'
             })
 
-        if date_diff.days > 7:
-            all_data = []
-            for progress, chunk_data in process_data_in_chunks(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime):
-                if station_filter:
-                    filters = station_filter.split(',')
-                    chunk_data = chunk_data[chunk_data['station'].str.contains('|'.join(filters), case=False)]
-                all_data.append(chunk_data)
-            obs = pd.concat(all_data, ignore_index=True)
+        if result_format == 'fileparquet' and pa is None:
+            processing_lock.release()
+            return jsonify({'error': 'Parquet output requires pyarrow on the server'})
+
+        if pa is not None:
+            # Ruta Arrow: el filtro de estaciones se aplica al decodificar y el de fechas dentro del promedio
+            window = (int(start_datetime.replace(tzinfo=datetime.timezone.utc).timestamp()),
+                      int(end_datetime.replace(tzinfo=datetime.timezone.utc).timestamp()))
+            tables = list(fetch_arrow_chunks(f"{base_url}/query_range?query={query}", variables,
+                                             start_datetime, end_datetime, station_filter, window))
+            total_records = sum(table.num_rows for table in tables)
         else:
-            obs = get_data(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime, '1m')
-
-            obs['date'] = pd.to_datetime(obs['date'], utc=True)
-            obs.set_index(['station', 'date'], inplace=True)
-            obs = obs.apply(pd.to_numeric, errors='coerce')
-
-            hourly_obs = []
-            for station, group in obs.groupby('station'):
-                hourly_data = group.resample('1h', level='date').mean()
-                hourly_data.index = hourly_data.index + pd.Timedelta(hours=1)
-                hourly_data['station'] = station
-                hourly_obs.append(hourly_data.reset_index())
-
-            obs = pd.concat(hourly_obs, ignore_index=True)
-
-            if station_filter:
-                filters = station_filter.split(',')
-                obs = obs[obs['station'].str.contains('|'.join(filters), case=False)]
-
-        start_datetime = pd.to_datetime(start_datetime).tz_localize('UTC')
-        end_datetime = pd.to_datetime(end_datetime).tz_localize('UTC')
-
-        obs = obs[(obs['date'] >= start_datetime) & (obs['date'] <= end_datetime)]
-
-        obs = obs.round(3)
-
-        total_records = obs.shape[0]
-        obs['date'] = obs['date'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-        json_data = obs.to_dict(orient='records')
-
-        for record in json_data:
-            for key, value in record.items():
-                if pd.isna(value):
-                    record[key] = None
-
-        grouped_data = {}
-        for record in json_data:
-            station = record.pop('station')
-            if station not in grouped_data:
-                grouped_data[station] = []
-            grouped_data[station].append(record)
+            total_records, grouped_data = pandas_result(base_url, query, variables, start_datetime, end_datetime,
+                                                        station_filter, date_diff)
 
         process_duration = time.time() - start_time
         hours, remainder = divmod(int(process_duration), 3600)
         minutes, seconds = divmod(remainder, 60)
         formatted_duration = f"{hours}:{minutes:02}:{seconds:02}"
 
-        result_data = {
-            'total_records': total_records,
-            'data': grouped_data,
-            'process_duration': formatted_duration
-        }
-
         processing_lock.release()
 
         if result_format == 'screen':
             app.logger.debug(f"Data result in screen")
-            return jsonify(result_data)
+            return jsonify({
+                'total_records': total_records,
+                'data': arrow_grouped_records(tables) if pa is not None else grouped_data,
+                'process_duration': formatted_duration
+            })
         else:
             # Crear y enviar archivo
             try:
-                memory_file = create_zip_file(result_data, 'json' if result_format == 'filejson' else 'csv')
+                file_format = {'filejson': 'json', 'fileparquet': 'parquet'}.get(result_format, 'csv')
+                if pa is not None:
+                    memory_file = create_arrow_zip_file(tables, file_format, total_records, formatted_duration)
+                else:
+                    memory_file = create_zip_file({
+                        'total_records': total_records,
+                        'data': grouped_data,
+                        'process_duration': formatted_duration
+                    }, file_format)
 
                 timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
                 filename = f'data_{start_date}_{end_date}_{timestamp}.zip'
@@ -11,6 +11,8 @@ import io
 import json
 import pytz
 import logging
+from aggregation_common import (AGGREGATION_STATS, stat_column, bucketed_stats, ROLLUP_QUERIES, ROLLUP_MAX_POINTS,
+                                choose_source, rollup_segments)
 
 selected_cols = [
     "PM25", "PM25raw", "Humidity", "Temperature", "ConfigVal", "Latitude", "Longitude", "InOut",
@@ -19,7 +21,15 @@ selected_cols = [
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
 
-def process_data_in_chunks(url, variables, start_datetime, end_datetime, interval_minutes):
+# Categorías PM2.5 (mismos límites que la escala de colores de la animación)
+PM25_BREAKPOINTS = np.array([13, 35, 55, 150, 250])
+PM25_CATEGORY_LABELS = np.array(["Bueno", "Moderado", "Dañino grupos sensibles", "Dañino", "Muy dañino", "Peligroso"])
+
+# Categoría (0-5) de todos los valores PM2.5 en una sola pasada
+def pm25_category(pm25_values):
+    return np.searchsorted(PM25_BREAKPOINTS, np.asarray(pm25_values, dtype=float), side='right')
+
+def process_data_in_chunks(url, variables, start_datetime, end_datetime, interval_minutes, stats=('mean',)):
     chunk_size = datetime.timedelta(days=7)
     current_start = start_datetime
     all_data = []
@@ -27,22 +37,10 @@ def process_data_in_chunks(url, variables, start_datetime, end_datetime, interva
     while current_start < end_datetime:
         current_end = min(current_start + chunk_size, end_datetime)
         # Usar step de 1 minuto
-        chunk_data = get_data(url, variables, current_start, current_end, '1m', interval_minutes=interval_minutes)
-
-        # Aplicar promedio horario al chunk
-        chunk_data['date'] = pd.to_datetime(chunk_data['date'], utc=True)
-        chunk_data.set_index(['station', 'date'], inplace=True)
-        chunk_data = chunk_data.apply(pd.to_numeric, errors='coerce')
-
-        interval_chunks = []
-        for station, group in chunk_data.groupby('station'):
-            interval_str = f'{interval_minutes}T'
-            interval_data = group.resample(interval_str, level='date').mean()
-            interval_data.index = interval_data.index + pd.Timedelta(minutes=interval_minutes)
-            interval_data['station'] = station
-            interval_chunks.append(interval_data.reset_index())
-
-        chunk_data = pd.concat(interval_chunks, ignore_index=True)
+        chunk_data = get_data(url, variables, current_start, current_end, '1m')
+
+        # Aplicar las estadísticas por intervalo al chunk
+        chunk_data = bucketed_stats(chunk_data, interval_minutes, stats=stats)
         all_data.append(chunk_data)
 
         current_start = current_end
@@ -55,13 +53,17 @@ def process_data_in_chunks(url, variables, start_datetime, end_datetime, interva
 
     return all_data
 
+# Ventana de cada consulta por minuto, independiente del intervalo pedido: bucketed_stats agrupa después.
+# 6 h son 360 puntos por serie, lejos del límite de 11000 de Prometheus
+RAW_FETCH_WINDOW_MINUTES = 360
+
 # Get data from API with time intervals
-def get_data(url, selected_cols, start_datetime, end_datetime, step, interval_minutes):
+def get_data(url, selected_cols, start_datetime, end_datetime, step, window_minutes=RAW_FETCH_WINDOW_MINUTES):
     all_results = []
     current_start_time = start_datetime
 
     while current_start_time < end_datetime:
-        current_end_time = min(current_start_time + datetime.timedelta(minutes=interval_minutes), end_datetime)
+        current_end_time = min(current_start_time + datetime.timedelta(minutes=window_minutes), end_datetime)
         current_end_time_1s = current_end_time - pd.Timedelta(seconds=1)
         query_url = f"{url}&start={current_start_time.isoformat()}Z&end={current_end_time_1s.isoformat()}Z&step={step}"
 
@@ -144,6 +146,75 @@ def get_data(url, selected_cols, start_datetime, end_datetime, step, interval_mi
     app.logger.debug(f"Final dataframe shape after concatenation: {final_df.shape}")
     return final_df
 
+def get_rollup_data(base_url, variables, stats, start_datetime, end_datetime, interval_minutes):
+    interval = datetime.timedelta(minutes=interval_minutes)
+    interval_seconds = interval_minutes * 60
+    midnight = datetime.datetime.combine(start_datetime.date(), datetime.time()).replace(tzinfo=datetime.timezone.utc).timestamp()
+    segments = rollup_segments(start_datetime, end_datetime, interval_minutes)
+    stations, dates, columns, values = [], [], [], []
+
+    for variable in variables:
+        selector = f'{{__name__="{variable}",job="pushgateway"}}'
+        for stat in stats:
+            column = stat_column(variable, stat)
+            for first_eval, last_eval, window in segments:
+                query = ROLLUP_QUERIES[stat].format(selector=selector, window=f"{int(window.total_seconds())}s")
+                current_start = first_eval
+                while current_start <= last_eval:
+                    current_end = min(current_start + interval * (ROLLUP_MAX_POINTS - 1), last_eval)
+                    params = {
+                        'query': query,
+                        'start': f"{current_start.isoformat()}Z",
+                        'end': f"{current_end.isoformat()}Z",
+                        'step': f"{interval_seconds}s",
+                    }
+                    app.logger.debug(f"Rollup {column} from {current_start} to {current_end}")
+                    response = requests.get(f"{base_url}/query_range", params=params)
+                    response.raise_for_status()
+                    for series in response.json().get('data', {}).get('result', []):
+                        station = series['metric'].get('exported_job')
+                        if station is None or not series.get('values'):
+                            continue
+                        points = np.array(series['values'], dtype=float)
+                        stations.extend([station] * len(points))
+                        # Etiqueta = fin del intervalo que contiene la evaluación (el tramo final puede acabar antes)
+                        dates.append(midnight + np.ceil((points[:, 0] - midnight) / interval_seconds) * interval_seconds)
+                        columns.extend([column] * len(points))
+                        values.append(points[:, 1])
+                    current_start = current_end + interval
+
+    out_cols = [stat_column(col, stat) for col in variables for stat in stats]
+    if not dates:
+        return pd.DataFrame(columns=['date'] + out_cols + ['station'])
+
+    long_df = pd.DataFrame({
+        'station': stations,
+        'date': pd.to_datetime(np.concatenate(dates), unit='s', utc=True),
+        'column': columns,
+        'value': np.concatenate(values),
+    })
+    wide = long_df.pivot_table(index=['station', 'date'], columns='column', values='value', aggfunc='first').reset_index()
+    for col in out_cols:
+        if col not in wide.columns:
+            wide[col] = np.nan
+    # Igual que get_data: posición 0 es "sin GPS"
+    for variable in ('Latitude', 'Longitude'):
+        for stat in stats:
+            col = stat_column(variable, stat)
+            if stat != 'count' and col in wide.columns:
+                wide[col] = wide[col].replace(0, np.nan)
+    wide.columns.name = None
+    return wide[['date'] + out_cols + ['station']]
+
+def filter_stations(df, station_filter, exclude_stations):
+    if station_filter:
+        filters = station_filter.split(',')
+        df = df[df['station'].str.contains('|'.join(filters), case=False)]
+    if exclude_stations:  # Aplicar exclusión de estaciones
+        excludes = exclude_stations.split(',')
+        df = df[~df['station'].str.contains('|'.join(excludes), case=False)]
+    return df
+
 # Function to get wide table
 def _wide_table(df, selected_cols):
     try:
@@ -192,11 +263,25 @@ def index():
             <label for="end_time"> / </label>
             <input type="time" id="end_time" name="end_time" value="{{ end_time }}" step="60"><br><br>
             <label for="interval_minutes">Interval (minutes):</label>
-            <input type="number" id="interval_minutes" name="interval_minutes" value="{{ interval_minutes }}" min="5"><br><br>
+            <input type="number" id="interval_minutes" name="interval_minutes" value="{{ interval_minutes }}" min="1" list="interval-presets">
+            <datalist id="interval-presets">
+                <option value="1"></option>
+                <option value="5"></option>
+                <option value="15"></option>
+                <option value="60"></option>
+                <option value="1440"></option>
+            </datalist><br><br>
+            <label>Statistics per interval:</label><br>
+            {% for stat in stats_options %}
+                <input type="checkbox" id="stat_{{ stat }}" name="stats" value="{{ stat }}" {% if stat == 'mean' %}checked{% endif %}>
+                <label for="stat_{{ stat }}">{{ stat }}</label>
+            {% endfor %}<br><br>
             <label for="station_filter">Station Filter (include):</label>
             <input type="text" id="station_filter" name="station_filter" value="{{ station_filter }}"><br><br>
             <label for="exclude_stations">Station Filter (exclude):</label>
             <input type="text" id="exclude_stations" name="exclude_stations" value="{{ exclude_stations }}"><br><br>
+            <input type="checkbox" id="pm25_category" name="pm25_category" value="on">
+            <label for="pm25_category">Add PM25 category column</label><br><br>
             <label for="gmt_offset">Select GMT offset:</label>
             <select id="gmt_offset" name="gmt_offset">
                 {% for i in range(-12, 13) %}
@@ -208,7 +293,7 @@ def index():
     ''', selected_cols=selected_cols, variables=variables, start_date=start_date,
        start_time=start_time, end_date=end_date, end_time=end_time,
        interval_minutes=interval_minutes, station_filter=station_filter,
-       exclude_stations=exclude_stations, gmt_offset=gmt_offset)
+       exclude_stations=exclude_stations, gmt_offset=gmt_offset, stats_options=AGGREGATION_STATS)
 
 @app.route('/dataresult', methods=['POST'])
 def data():
@@ -227,50 +312,37 @@ def data():
         exclude_stations = request.form.get('exclude_stations', '')  # Nuevo campo para excluir estaciones
         interval_minutes = int(request.form.get('interval_minutes', 60))
         gmt_offset = int(request.form.get('gmt_offset', 0))  # GMT seleccionado
+        add_pm25_category = request.form.get('pm25_category') == 'on'
+        stats = [stat for stat in AGGREGATION_STATS if stat in request.form.getlist('stats')] or ['mean']
 
-        if interval_minutes < 5:
-            return jsonify({'error': 'Interval must be at least 5 minutes'})
+        if interval_minutes < 1:
+            return jsonify({'error': 'Interval must be at least 1 minute'})
         
         # Ajustar las horas según el GMT seleccionado
         start_datetime = datetime.datetime.fromisoformat(f"{start_date}T{start_time_str}") - datetime.timedelta(hours=gmt_offset)
         end_datetime = datetime.datetime.fromisoformat(f"{end_date}T{end_time}") - datetime.timedelta(hours=gmt_offset)
         date_diff = end_datetime - start_datetime + datetime.timedelta(minutes=60)
 
-        if date_diff.days > 7:
+        source = choose_source(interval_minutes)
+        app.logger.debug(f"Aggregation source: {source}, stats: {stats}")
+
+        if source == 'rollup':
+            obs = get_rollup_data(base_url, variables, stats, start_datetime, end_datetime, interval_minutes)
+            if date_diff.days <= 7:
+                # Mismas etiquetas que la ruta por minuto de rangos cortos: inicio del intervalo
+                obs['date'] = obs['date'] - pd.Timedelta(minutes=interval_minutes)
+            obs = filter_stations(obs, station_filter, exclude_stations)
+        elif date_diff.days > 7:
             all_data = []
-            for progress, chunk_data in process_data_in_chunks(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime, interval_minutes):
-                if station_filter:
-                    filters = station_filter.split(',')
-                    chunk_data = chunk_data[chunk_data['station'].str.contains('|'.join(filters), case=False)]
-                if exclude_stations:  # Aplicar exclusión de estaciones
-                    excludes = exclude_stations.split(',')
-                    chunk_data = chunk_data[~chunk_data['station'].str.contains('|'.join(excludes), case=False)]
-                all_data.append(chunk_data)
+            for progress, chunk_data in process_data_in_chunks(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime, interval_minutes, stats):
+                all_data.append(filter_stations(chunk_data, station_filter, exclude_stations))
             obs = pd.concat(all_data, ignore_index=True)
         else:
-            obs = get_data(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime, '1m', interval_minutes=interval_minutes)
-
-            obs['date'] = pd.to_datetime(obs['date'], utc=True)
-            obs.set_index(['station', 'date'], inplace=True)
-            obs = obs.apply(pd.to_numeric, errors='coerce')
-
-            averaged_data = []
-            for station, group in obs.groupby('station'):
-                averaged = group.resample(f'{interval_minutes}min', level='date').mean()
-                averaged['station'] = station
-                averaged.reset_index(inplace=True)
-                averaged_data.append(averaged)
-
-            obs = pd.concat(averaged_data, ignore_index=True)
-
-            if station_filter:
-                app.logger.debug(f"station_filter routine")
-                filters = station_filter.split(',')
-                obs = obs[obs['station'].str.contains('|'.join(filters), case=False)]
-            if exclude_stations:  # Aplicar exclusión de estaciones
-                app.logger.debug(f"exclude_stations routine")
-                excludes = exclude_stations.split(',')
-                obs = obs[~obs['station'].str.contains('|'.join(excludes), case=False)]
+            obs = get_data(f"{base_url}/query_range?query={query}", variables, start_datetime, end_datetime, '1m')
+
+            # Aquí la etiqueta es el inicio del intervalo, como antes
+            obs = bucketed_stats(obs, interval_minutes, label_end=False, stats=stats)
+            obs = filter_stations(obs, station_filter, exclude_stations)
 
        # Ajustar la fecha/hora a formato UTC y filtrar por rango ajustado
         start_datetime = pd.to_datetime(start_datetime).tz_localize('UTC') + pd.Timedelta(hours=gmt_offset)
@@ -289,6 +361,9 @@ def data():
         
         obs = obs.round(3)
 
+        if add_pm25_category and 'PM25' in obs.columns:
+            categories = PM25_CATEGORY_LABELS[pm25_category(obs['PM25'])]
+            obs['PM25_category'] = np.where(obs['PM25'].notna(), categories, None)
 
         # Ajustar formato de fecha para visualización
         obs['date'] = obs['date'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -0,0 +1,136 @@
+# Capa de agregación común a las exportaciones /dataresult desde Prometheus
+# (APIdatavideo_26nov2024.py con varios estadísticos y fuente automática, APIdataservidor_26nov2024.py con la media)
+
+import datetime
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# ESTADÍSTICAS POR INTERVALO
+# ==========================================
+# Estadísticas por intervalo. La media conserva el nombre de la variable (PM25), el resto lleva sufijo (PM25_p95)
+AGGREGATION_STATS = ['mean', 'min', 'max', 'count', 'median', 'p95']
+STAT_QUANTILES = {'median': 0.5, 'p95': 0.95}
+
+def stat_column(col, stat):
+    return col if stat == 'mean' else f"{col}_{stat}"
+
+# Estadísticas por estación e intervalo en una sola pasada sobre arrays de NumPy (equivale al
+# groupby('station') + resample(...).agg(...) por estación, incluidos los intervalos vacíos intermedios)
+def bucketed_stats(df, interval_minutes=60, label_end=True, stats=('mean',)):
+    value_cols = [col for col in df.columns if col not in ('station', 'date')]
+    out_cols = [stat_column(col, stat) for col in value_cols for stat in stats]
+    if df.empty:
+        return pd.DataFrame(columns=['date'] + out_cols + ['station'])
+
+    seconds = np.int64(interval_minutes * 60)
+    timestamps = pd.to_datetime(df['date'], utc=True).values.astype('datetime64[s]').astype(np.int64)
+    codes, stations = pd.factorize(df['station'], sort=True)
+    n_stations = len(stations)
+
+    # Como resample: los intervalos arrancan en la medianoche del primer dato de cada estación
+    first_ts = np.full(n_stations, np.iinfo(np.int64).max)
+    np.minimum.at(first_ts, codes, timestamps)
+    origin = first_ts - first_ts % 86400
+    buckets = (timestamps - origin[codes]) // seconds
+
+    # Cada estación ocupa un bloque contiguo de intervalos, del primero al último con datos
+    first_bucket = (first_ts - origin) // seconds
+    last_bucket = np.zeros(n_stations, dtype=np.int64)
+    np.maximum.at(last_bucket, codes, buckets)
+    span = last_bucket - first_bucket + 1
+    offsets = np.cumsum(span) - span
+    slots = offsets[codes] + buckets - first_bucket[codes]
+    total = int(span.sum())
+
+    result = {}
+    station_index = np.repeat(np.arange(n_stations), span)
+    bucket_index = np.arange(total) - offsets[station_index] + first_bucket[station_index]
+    labels = origin[station_index] + (bucket_index + (1 if label_end else 0)) * seconds
+    result['date'] = pd.to_datetime(labels * 1_000_000_000, utc=True)
+
+    needs_order = any(stat in ('min', 'max', 'median', 'p95') for stat in stats)
+    for col in value_cols:
+        values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        col_slots, col_values = slots[valid], values[valid]
+        counts = np.bincount(col_slots, minlength=total)
+        if not len(col_values):
+            for stat in stats:
+                result[stat_column(col, stat)] = counts if stat == 'count' else np.full(total, np.nan)
+            continue
+        has_data = counts > 0
+
+        if needs_order:
+            # Valores ordenados por (intervalo, valor): cada intervalo queda en un tramo contiguo
+            order = np.lexsort((col_values, col_slots))
+            sorted_values = col_values[order]
+            starts = np.cumsum(counts) - counts
+            last = np.maximum(counts - 1, 0)
+
+        for stat in stats:
+            name = stat_column(col, stat)
+            if stat == 'mean':
+                sums = np.bincount(col_slots, weights=col_values, minlength=total)
+                result[name] = np.divide(sums, counts, out=np.full(total, np.nan), where=has_data)
+            elif stat == 'count':
+                result[name] = counts
+            elif stat == 'min':
+                result[name] = np.where(has_data, sorted_values[np.minimum(starts, len(sorted_values) - 1)], np.nan)
+            elif stat == 'max':
+                result[name] = np.where(has_data, sorted_values[np.minimum(starts + last, len(sorted_values) - 1)], np.nan)
+            else:
+                # Interpolación lineal entre los dos valores vecinos, como pandas quantile()
+                position = STAT_QUANTILES[stat] * last
+                lower = np.floor(position).astype(np.int64)
+                upper = np.ceil(position).astype(np.int64)
+                top = len(sorted_values) - 1
+                low_values = sorted_values[np.minimum(starts + lower, top)]
+                high_values = sorted_values[np.minimum(starts + upper, top)]
+                result[name] = np.where(has_data, low_values + (high_values - low_values) * (position - lower), np.nan)
+
+    result['station'] = np.asarray(stations)[station_index]
+    return pd.DataFrame(result)
+
+# ==========================================
+# FUENTE: rollups en Prometheus o datos por minuto
+# ==========================================
+# Rollups calculados en Prometheus: un punto por intervalo y serie, en vez de traer cada minuto.
+# Se agregan sobre la subconsulta [ventana:1m], o sea sobre los mismos puntos cada minuto que trae la ruta
+# por minuto (query_range con step=1m) y no sobre las muestras crudas: count y los estadísticos de orden
+# valen lo mismo en las dos fuentes. El rango es (t - ventana, t]; con offset 1ms el punto en t resume
+# [t - ventana, t), el mismo lado cerrado que bucketed_stats. __name__ se pierde en *_over_time, así que
+# va una consulta por variable
+ROLLUP_QUERIES = {
+    'mean': 'avg_over_time({selector}[{window}:1m] offset 1ms)',
+    'min': 'min_over_time({selector}[{window}:1m] offset 1ms)',
+    'max': 'max_over_time({selector}[{window}:1m] offset 1ms)',
+    'count': 'count_over_time({selector}[{window}:1m] offset 1ms)',
+    'median': 'quantile_over_time(0.5, {selector}[{window}:1m] offset 1ms)',
+    'p95': 'quantile_over_time(0.95, {selector}[{window}:1m] offset 1ms)',
+}
+ROLLUP_MIN_MINUTES = 60  # Desde 1h el rollup del servidor es más barato que traer datos por minuto
+ROLLUP_MAX_POINTS = 10000  # Prometheus rechaza más de 11000 puntos por serie en una consulta
+
+def choose_source(interval_minutes):
+    return 'rollup' if interval_minutes >= ROLLUP_MIN_MINUTES else 'raw'
+
+# Tramos de evaluación (primera, última, ventana) con los intervalos anclados a medianoche UTC como en
+# bucketed_stats. Los intervalos parciales del inicio y del final se evalúan aparte con una ventana recortada,
+# para no resumir datos fuera de [start, end)
+def rollup_segments(start_datetime, end_datetime, interval_minutes):
+    interval = datetime.timedelta(minutes=interval_minutes)
+    midnight = datetime.datetime.combine(start_datetime.date(), datetime.time())
+    first = midnight - ((midnight - start_datetime) // interval) * interval  # primer borde >= start
+    last = midnight + ((end_datetime - midnight) // interval) * interval  # último borde <= end
+    if first > last:  # Todo el rango cae dentro de un solo intervalo
+        return [(end_datetime, end_datetime, end_datetime - start_datetime)]
+
+    segments = []
+    if start_datetime < first:
+        segments.append((first, first, first - start_datetime))
+    if first < last:
+        segments.append((first + interval, last, interval))
+    if last < end_datetime:
+        segments.append((end_datetime, end_datetime, end_datetime - last))
+    return segments
@@ -12,11 +12,30 @@ import zipfile
 import json
 import logging
 import urllib.parse
+from vm_export_common import (Metrics, StageTimer, SeriesBuffer, MemoryBudgetExceeded, check_memory_budget,
+                              decode_series, format_dates, JSON_DECODE_BYTES_PER_BYTE)
+from collections import OrderedDict
 
 selected_cols = [
     "PM25_1h", "PM25raw_1h", "PM1_1h", "Humidity_1h", "Temperature_1h",
 ]
 
+# Resolución diaria: rollups calculados en VM sobre las series _1h (un punto por estación y día)
+DAILY_STATS = {
+    'mean': 'avg_over_time',
+    'min': 'min_over_time',
+    'max': 'max_over_time',
+    'count': 'count_over_time',  # Horas con dato en el día (0-24)
+}
+DAILY_CHUNK_DAYS = 366
+# Límites en días para datos diarios (24 veces menos filas que los horarios)
+DAILY_LIMITS = {'screen': 183, 'filejson': 3660, 'filecsv': 3660}
+
+# VictoriaMetrics (bench_export_vm.py lo apunta a un servidor local de prueba)
+VM_BASE_URL = "http://sensor.aireciudadano.com:30001/api/v1"
+# Segundos de espera por cada llamada a query_range (un bloque de 90 días puede tardar)
+VM_TIMEOUT = 120
+
 # Initialize Flask app and set logging level
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
@@ -24,8 +43,92 @@ app.logger.setLevel(logging.DEBUG)
 # Global lock for one-at-a-time processing
 processing_lock = threading.Lock()
 
+# ==========================================
+# MÉTRICAS: tiempos por etapa y /metrics en formato Prometheus (vm_export_common)
+# ==========================================
+metrics = Metrics({
+    'dataapi_upstream_cache_total': ('counter', 'query_range lookups by result: hit (LRU) or miss.'),
+    'dataapi_coalesced_requests_total': ('counter', 'Requests answered with the response of an identical running request, by result.'),
+})
+metrics.inc('dataapi_requests_in_progress', 0)
+
+# ==========================================
+# CACHÉ UPSTREAM: LRU de query_range
+# ==========================================
+# Las peticiones populares (últimos 7 días, todas las variables, sin filtro) llegan en ráfagas con las
+# mismas URLs. El resultado recién decodificado (arrays tipados, no el JSON) se guarda unos segundos, así
+# las peticiones que llegan justo después no vuelven a consultar VM. Las llamadas a VM solo las hace la
+# petición que tiene processing_lock; las idénticas que llegan mientras corre esperan su respuesta
+UPSTREAM_CACHE_SECONDS = 60
+UPSTREAM_CACHE_MB = 256
+# Peticiones idénticas a la que tiene processing_lock que esperan y reciben su misma respuesta en vez de
+# 'busy'. No descargan ni pivotean nada, así MEMORY_BUDGET_MB sigue valiendo para el total del proceso
+MAX_COALESCED_REQUESTS = 2
+# Espera máxima de esas peticiones; pasado este tiempo responden 'busy'
+COALESCE_WAIT_SECONDS = 600
+
+class UpstreamCache:
+    def __init__(self, ttl=UPSTREAM_CACHE_SECONDS, max_bytes=UPSTREAM_CACHE_MB * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # url -> (expira, bytes, series_list), el más reciente al final
+        self.nbytes = 0
+
+    def get(self, url, load):
+        with self.lock:
+            # Las vencidas se sueltan aquí también, no solo al guardar otra entrada
+            self._evict(time.monotonic())
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+                metrics.inc('dataapi_upstream_cache_total', result='hit')
+                return entry[2]
+
+        metrics.inc('dataapi_upstream_cache_total', result='miss')
+        series_list = load()  # Los errores no se guardan: la próxima petición reintenta
+        with self.lock:
+            self._store(url, series_list)
+        return series_list
+
+    def _store(self, url, series_list):
+        size = sum(times.nbytes + values.nbytes for _, _, times, values in series_list)
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(url, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self.entries[url] = (time.monotonic() + self.ttl, size, series_list)
+        self.nbytes += size
+        self._evict(time.monotonic())
+
+    # Fuera todas las vencidas y luego las menos usadas hasta caber en max_bytes
+    def _evict(self, now):
+        for key in [key for key, entry in self.entries.items() if entry[0] <= now]:
+            self.nbytes -= self.entries.pop(key)[1]
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self.entries.popitem(last=False)[1][1]
+
+upstream_cache = UpstreamCache()
+
+def fetch_vm_series(query_url, timer, buffer):
+    def load():
+        with timer.stage('upstream_fetch'):
+            response = requests.get(query_url, timeout=VM_TIMEOUT)
+        if response.status_code == 422:
+            app.logger.error(f"VM Limit Error Detail: {response.text}")
+        response.raise_for_status()
+        # Antes de decodificar: lo ya acumulado en el buffer + el JSON de esta respuesta
+        check_memory_budget('download', buffer, len(response.content) * JSON_DECODE_BYTES_PER_BYTE)
+        with timer.stage('json_decode'):
+            data = response.json().get('data', {}).get('result', [])
+        with timer.stage('pivot'):
+            return decode_series(data)
+    return upstream_cache.get(query_url, load)
+
 # Generador Mágico: Descarga por bloques de 90 días y suelta la memoria
-def fetch_vm_data_generator(base_url, query, selected_cols, start_datetime, end_datetime):
+def fetch_vm_data_generator(base_url, query, selected_cols, start_datetime, end_datetime, timer=None):
+    timer = timer or StageTimer()
     chunk_size = datetime.timedelta(days=90)
     current_start = start_datetime
 
@@ -39,48 +142,69 @@ def fetch_vm_data_generator(base_url, query, selected_cols, start_datetime, end_
         
         app.logger.debug(f"Querying VictoriaMetrics chunk from {start_str} to {end_str}")
         
-        chunk_data = []
+        buffer = SeriesBuffer(selected_cols)
         try:
-            response = requests.get(query_url)
-            if response.status_code == 422:
-                app.logger.error(f"VM Limit Error Detail: {response.text}")
-                
-            response.raise_for_status()
-            data = response.json().get('data', {}).get('result', [])
+            series_list = fetch_vm_series(query_url, timer, buffer)
+            with timer.stage('pivot'):
+                buffer.add_result(series_list)
+            del series_list
 
-            if data:
-                df = pd.json_normalize(data)
-                
-                if 'metric.job' in df.columns and 'values' in df.columns:
-                    df = df.explode('values')
-                    # Mantenemos la fecha como String directamente. Ahorra 90% de CPU
-                    df['date'] = df['values'].apply(lambda x: datetime.datetime.fromtimestamp(x[0], tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
-                    df['value'] = df['values'].apply(lambda x: float(x[1]))
-                    df = df.drop(columns="values")
-
-                    df = df.rename(columns={"metric.__name__": "metric_name", "metric.job": "station"})
-                    df = df[df['station'].notnull()]
-
-                    if not df.empty:
-                        # pivot_table previene errores si un sensor mandó datos dobles
-                        df_result = pd.pivot_table(df, index=['station', 'date'], columns='metric_name', values='value', aggfunc='mean').reset_index()
-                        chunk_data.append(df_result)
-                        
+        except MemoryBudgetExceeded:
+            raise
         except Exception as e:
             app.logger.error(f'Error processing chunk: {str(e)}')
             pass 
 
+        # pivot compacto: evita datos dobles de un sensor y deja la RAM del bloque en arrays tipados.
+        # Su pico se revisa antes de pivotear
+        check_memory_budget('pivot', buffer, buffer.pivot_bytes())
+        with timer.stage('pivot'):
+            final_chunk_df = buffer.to_frame()
+
         # Si hubo datos en este bloque, los "rendimos" (yield) a Flask
-        if chunk_data:
-            final_chunk_df = pd.concat(chunk_data, ignore_index=True)
-            chunk_data.clear() # Limpia la RAM inmediatamente
-            
-            for col in selected_cols:
-                if col not in final_chunk_df.columns:
-                    final_chunk_df[col] = np.nan
-            yield current_start, final_chunk_df
-        else:
-            yield current_start, pd.DataFrame(columns=['station', 'date'] + selected_cols)
+        yield current_start, final_chunk_df
+
+        current_start = current_end
+
+def daily_columns(variables):
+    return [f"{var.removesuffix('_1h')}_{stat}" for var in variables for stat in DAILY_STATS]
+
+# Igual que fetch_vm_data_generator pero con una fila por estación y día, en bloques de 1 año
+def fetch_vm_daily_generator(base_url, query, selected_cols, start_datetime, end_datetime, timer=None):
+    timer = timer or StageTimer()
+    out_cols = daily_columns(selected_cols)
+    one_day = datetime.timedelta(days=1)
+    # Días completos en UTC: el punto en t resume (t - 1d, t], se etiqueta con el día que resume
+    current_start = datetime.datetime.combine(start_datetime.date(), datetime.time())
+    end_day = datetime.datetime.combine(end_datetime.date(), datetime.time()) + one_day
+
+    while current_start < end_day:
+        current_end = min(current_start + datetime.timedelta(days=DAILY_CHUNK_DAYS), end_day)
+        buffer = SeriesBuffer(out_cols)
+
+        for stat, function in DAILY_STATS.items():
+            stat_query = f'{function}({query}[1d]) keep_metric_names'
+            start_str = (current_start + one_day).isoformat() + "Z"
+            end_str = current_end.isoformat() + "Z"
+            query_url = f"{base_url}/query_range?query={urllib.parse.quote(stat_query)}&start={start_str}&end={end_str}&step=1d"
+            app.logger.debug(f"Querying VictoriaMetrics daily {stat} from {start_str} to {end_str}")
+
+            try:
+                series_list = fetch_vm_series(query_url, timer, buffer)
+            except MemoryBudgetExceeded:
+                raise
+            except Exception as e:
+                app.logger.error(f'Error processing daily chunk: {str(e)}')
+                continue
+
+            with timer.stage('pivot'):
+                for station, name, times, values in series_list:
+                    buffer.add(station, f"{name.removesuffix('_1h')}_{stat}", times, values, time_offset=86400)
+
+        check_memory_budget('pivot', buffer, buffer.pivot_bytes())
+        with timer.stage('pivot'):
+            df_result = buffer.to_frame()
+        yield current_start, df_result
 
         current_start = current_end
 
@@ -114,7 +238,7 @@ def index():
             <form id="dataForm" action="/dataresult" method="post">
                 <h2>API AIRECIUDADANO v2.0 (VM - Hourly Averages)</h2>
                 <div class="alert alert-info">
-                    <strong>New!</strong> Download up to 1 year of hourly data instantly using the CSV format. Large JSON downloads will be bundled in 90-day chunks to preserve memory
+                    <strong>New!</strong> Download up to 1 year of hourly data instantly using the CSV format. Large JSON downloads will be bundled in 90-day chunks to preserve memory. For multi-year ranges choose the daily resolution
                 </div>
                 
                 <label><b>Select variables:</b></label><br><br>
@@ -135,6 +259,12 @@ def index():
                 <label>Station Filter (Comma separated):</label>
                 <input type="text" name="station_filter" value="{{ station_filter }}" style="width: 100%;"><br><br>
 
+                <label>Resolution:</label>
+                <select id="resolution" name="resolution">
+                    <option value="hourly">Hourly averages</option>
+                    <option value="daily">Daily mean/min/max/count (screen 6 months, files up to 10 years)</option>
+                </select><br><br>
+
                 <label>Result format:</label>
                 <select id="result_format" name="result_format">
                     <option value="screen">Result in screen (Max 7 days)</option>
@@ -213,15 +343,100 @@ def index():
 
 @app.route('/dataresult', methods=['POST'])
 def data():
-    if not processing_lock.acquire(blocking=False):
+    timer = StageTimer(metrics)
+    result_format = request.form.get('result_format', 'screen')
+    if result_format not in ('screen', 'filejson', 'filecsv'):
+        result_format = 'other'  # Evita etiquetas arbitrarias en /metrics
+    metrics.inc('dataapi_requests_in_progress')
+    start = time.perf_counter()
+    try:
+        response = process_data_request(timer)
+    finally:
+        metrics.inc('dataapi_requests_in_progress', -1)
+    timer.record(result_format, time.perf_counter() - start, response.calculate_content_length() or 0)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Misma clave = misma respuesta (mismas URLs de query_range y mismo formato de salida)
+def coalesce_key(form):
+    return (tuple(form.getlist('variables')), form.get('start_date'), form.get('start_time'), form.get('end_date'),
+            form.get('end_time'), form.get('station_filter', ''), form.get('resolution') == 'daily',
+            form.get('result_format', 'screen'))
+
+# Respuesta de la petición que tiene processing_lock, para las idénticas que la esperan
+class RequestFlight:
+    def __init__(self, key):
+        self.key = key
+        self.done = threading.Event()
+        self.result = None  # (cuerpo, status, headers, estado del timer)
+        self.followers = 0
+
+# Petición que tiene processing_lock (None si no hay ninguna)
+request_slots_lock = threading.Lock()
+running_request = {'flight': None}
+
+# ('leader', flight) si toma processing_lock, ('follower', flight) si es idéntica a la petición en curso y hay
+# cupo, (None, None) = busy. Nunca bloquea
+def acquire_request_slot(request_key):
+    with request_slots_lock:
+        if processing_lock.acquire(blocking=False):
+            running_request['flight'] = RequestFlight(request_key)
+            return 'leader', running_request['flight']
+        flight = running_request['flight']
+        if flight is not None and flight.key == request_key and flight.followers < MAX_COALESCED_REQUESTS:
+            flight.followers += 1
+            return 'follower', flight
+    return None, None
+
+def release_request_slot(role, flight):
+    with request_slots_lock:
+        if role == 'leader':
+            running_request['flight'] = None
+            processing_lock.release()
+            flight.done.set()
+        elif role == 'follower':
+            flight.followers -= 1
+
+# Copia de la respuesta del líder: el cuerpo (bytes) se comparte, no se vuelve a generar
+def shared_response(flight, timer):
+    if not flight.done.wait(COALESCE_WAIT_SECONDS):
+        timer.status = 'busy'
+        metrics.inc('dataapi_coalesced_requests_total', result='timeout')
         return jsonify({
             'error': 'The API is currently processing another request. Please wait and try again shortly.'
         })
-
+    if flight.result is None:
+        timer.status = 'error'
+        metrics.inc('dataapi_coalesced_requests_total', result='error')
+        return jsonify({'error': 'Internal Server Error: the identical request being processed failed.'})
+    body, status, headers, timer.status = flight.result
+    metrics.inc('dataapi_coalesced_requests_total', result='shared')
+    return Response(body, status=status, headers=headers)
+
+def process_data_request(timer):
+    role, flight = acquire_request_slot(coalesce_key(request.form))
+    if role is None:
+        timer.status = 'busy'
+        return jsonify({
+            'error': 'The API is currently processing another request. Please wait and try again shortly.'
+        })
+    try:
+        if role == 'follower':
+            return shared_response(flight, timer)
+        response = build_data_response(timer)
+        flight.result = (response.get_data(), response.status_code, list(response.headers), timer.status)
+        return response
+    finally:
+        release_request_slot(role, flight)
+
+def build_data_response(timer):
     start_time_proc = time.time()
     try:
         variables = request.form.getlist('variables')
-        base_url = "http://sensor.aireciudadano.com:30001/api/v1"
+        base_url = VM_BASE_URL
 
         start_date = request.form['start_date']
         start_time_str = request.form['start_time']
@@ -229,6 +444,7 @@ def data():
         end_time = request.form['end_time']
         station_filter = request.form.get('station_filter', '')
         result_format = request.form.get('result_format', 'screen')
+        resolution = 'daily' if request.form.get('resolution') == 'daily' else 'hourly'
 
         start_datetime = datetime.datetime.fromisoformat(f"{start_date}T{start_time_str}")
         end_datetime = datetime.datetime.fromisoformat(f"{end_date}T{end_time}")
@@ -236,21 +452,27 @@ def data():
         # Validation Limits
         date_diff = end_datetime - start_datetime
         
-        if result_format == 'screen':
+        if resolution == 'daily':
+            if date_diff.days > DAILY_LIMITS.get(result_format, 0):
+                timer.status = 'rejected'
+                return jsonify({
+                    'error': f'For daily data the maximum limit in this format is {DAILY_LIMITS.get(result_format, 0)} days. Please reduce the date range.'
+                })
+        elif result_format == 'screen':
             if date_diff.days > 7:
-                processing_lock.release()
+                timer.status = 'rejected'
                 return jsonify({
                     'error': 'For screen visualization, the maximum limit is 7 days to prevent browser freezing. Please reduce the date range or select JSON/CSV file format.'
                 })
         elif result_format == 'filejson':
             if date_diff.days > 183:
-                processing_lock.release()
+                timer.status = 'rejected'
                 return jsonify({
                     'error': 'For JSON file downloads, the maximum limit is 6 months (183 days) due to data size constraints. Please reduce the date range or select CSV format.'
                 })
         elif result_format == 'filecsv':
             if date_diff.days > 366:
-                processing_lock.release()
+                timer.status = 'rejected'
                 return jsonify({
                     'error': 'The maximum limit for CSV file downloads is 1 full year (365 days). Please reduce the date range.'
                 })
@@ -262,30 +484,41 @@ def data():
         else:
             query = f'{{__name__=~"{metrics_regex}"}}'
 
+        if resolution == 'daily':
+            output_cols = daily_columns(variables)
+            date_format = '%Y-%m-%d'
+            chunks = fetch_vm_daily_generator(base_url, query, variables, start_datetime, end_datetime, timer=timer)
+        else:
+            output_cols = variables
+            date_format = '%Y-%m-%dT%H:%M:%SZ'
+            chunks = fetch_vm_data_generator(base_url, query, variables, start_datetime, end_datetime, timer=timer)
+
         # ==========================================
         # RUTA PANTALLA: Carga completa en RAM
         # ==========================================
         if result_format == 'screen':
-            # Solo permite 7 días, así que podemos cargarlo todo a la vez
-            obs = fetch_vm_data_generator(base_url, query, variables, start_datetime, end_datetime)
+            # Rango limitado (7 días horarios / 6 meses diarios), así que cabe en un solo chunk
+            obs = chunks
             # Extrayendo el único chunk esperado
             for chunk_start, chunk_df in obs:
                 if chunk_df.empty:
-                    processing_lock.release()
+                    timer.status = 'empty'
                     return jsonify({'message': 'No data found for the selected period and stations.'})
                 
-                chunk_df = chunk_df.sort_values(by=['station', 'date'])
-                
-                for col in variables:
-                    if col in chunk_df.columns:
-                        chunk_df[col] = pd.to_numeric(chunk_df[col], errors='coerce').round(3)
-                        
-                chunk_df = chunk_df.replace({np.nan: None})
+                with timer.stage('sort_round'):
+                    chunk_df = format_dates(chunk_df.sort_values(by=['station', 'date']), date_format)
+                    
+                    for col in output_cols:
+                        if col in chunk_df.columns:
+                            chunk_df[col] = pd.to_numeric(chunk_df[col], errors='coerce').astype(np.float64).round(3)
+                            
+                    chunk_df = chunk_df.replace({np.nan: None})
                 
-                grouped_data = {
-                    station: group.drop(columns=['station']).to_dict(orient='records') 
-                    for station, group in chunk_df.groupby('station')
-                }
+                with timer.stage('serialize'):
+                    grouped_data = {
+                        station: group.drop(columns=['station']).to_dict(orient='records') 
+                        for station, group in chunk_df.groupby('station', observed=True)
+                    }
                 
                 process_duration = time.time() - start_time_proc
                 hours, remainder = divmod(int(process_duration), 3600)
@@ -298,8 +531,8 @@ def data():
                     'process_duration': formatted_duration
                 }
                 
-                processing_lock.release()
-                return jsonify(result_data)
+                with timer.stage('serialize'):
+                    return jsonify(result_data)
 
         # ==========================================
         # RUTAS ARCHIVO: Streaming a ZIP por Chunks
@@ -309,45 +542,49 @@ def data():
         
         with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
             
-            for chunk_start, chunk_df in fetch_vm_data_generator(base_url, query, variables, start_datetime, end_datetime):
+            for chunk_start, chunk_df in chunks:
                 
                 if chunk_df.empty:
                     continue
                     
                 data_found_in_any_chunk = True
                 
-                # Nombre del archivo basado en el inicio del chunk de 90 días
+                # Nombre del archivo basado en el inicio del chunk (90 días horarios / 1 año diario)
                 chunk_str = chunk_start.strftime('%Y-%m-%d')
                 
-                chunk_df = chunk_df.sort_values(by=['station', 'date'])
+                with timer.stage('sort_round'):
+                    chunk_df = format_dates(chunk_df.sort_values(by=['station', 'date']), date_format)
 
-                for col in variables:
-                    if col in chunk_df.columns:
-                        chunk_df[col] = pd.to_numeric(chunk_df[col], errors='coerce').round(3)
+                    for col in output_cols:
+                        if col in chunk_df.columns:
+                            # float32 -> float64 antes de redondear, para que CSV/JSON muestren 12.345 y no 12.3450002670
+                            chunk_df[col] = pd.to_numeric(chunk_df[col], errors='coerce').astype(np.float64).round(3)
 
                 total_records = chunk_df.shape[0]
 
                 if result_format == 'filecsv':
-                    csv_buffer = io.StringIO()
-                    chunk_df.to_csv(csv_buffer, index=False)
-                    zf.writestr(f'data_hourly_{chunk_str}.csv', csv_buffer.getvalue())
-                    csv_buffer.close()
+                    # El CSV se escribe directo al miembro del ZIP por bloques: no hay copia completa en un StringIO
+                    with timer.stage('serialize'):
+                        with zf.open(f'data_{resolution}_{chunk_str}.csv', 'w') as raw_csv, io.TextIOWrapper(raw_csv, encoding='utf-8', newline='') as csv_file:
+                            chunk_df.to_csv(csv_file, index=False, chunksize=50000)
                 
                 elif result_format == 'filejson':
-                    with zf.open(f'data_hourly_{chunk_str}.json', 'w') as json_file:
+                    with zf.open(f'data_{resolution}_{chunk_str}.json', 'w') as json_file:
                         json_file.write(f'{{\n  "total_records": {total_records},\n'.encode('utf-8'))
                         json_file.write(f'  "chunk_start": "{chunk_start.isoformat()}Z",\n'.encode('utf-8'))
                         json_file.write(b'  "data": {\n')
                         
                         first_station = True
-                        for station, group in chunk_df.groupby('station'):
+                        for station, group in chunk_df.groupby('station', observed=True):
                             if not first_station:
                                 json_file.write(b',\n')
                             first_station = False
                             
                             json_file.write(f'    "{station}": '.encode('utf-8'))
-                            json_str = group.drop(columns=['station']).to_json(orient='records')
-                            json_file.write(json_str.encode('utf-8'))
+                            with timer.stage('serialize'):
+                                json_str = group.drop(columns=['station']).to_json(orient='records')
+                            with timer.stage('compress'):
+                                json_file.write(json_str.encode('utf-8'))
                         
                         json_file.write(b'\n  }\n}')
                 
@@ -355,15 +592,13 @@ def data():
                 del chunk_df
 
         if not data_found_in_any_chunk:
-            processing_lock.release()
+            timer.status = 'empty'
             return jsonify({'message': 'No data found for the selected period and stations.'})
 
         memory_file.seek(0)
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'data_hourly_{start_date}_to_{end_date}_{timestamp}.zip'
+        filename = f'data_{resolution}_{start_date}_to_{end_date}_{timestamp}.zip'
 
-        processing_lock.release()
-        
         return Response(
             memory_file.getvalue(),
             mimetype='application/zip',
@@ -373,9 +608,13 @@ def data():
             }
         )
 
+    except MemoryBudgetExceeded as e:
+        timer.status = 'rejected'
+        app.logger.error(f'Memory budget exceeded: {str(e)}')
+        return jsonify({'error': str(e)})
+
     except Exception as e:
-        if processing_lock.locked():
-            processing_lock.release()
+        timer.status = 'error'
         app.logger.error(f'Error en endpoint de datos: {str(e)}')
         return jsonify({'error': f'Internal Server Error: {str(e)}'})
 
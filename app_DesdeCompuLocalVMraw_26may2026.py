@@ -12,12 +12,17 @@ import zipfile
 import json
 import logging
 import urllib.parse
+from vm_export_common import (Metrics, StageTimer, SeriesBuffer, MemoryBudgetExceeded, check_memory_budget,
+                              decode_series, format_dates, JSON_DECODE_BYTES_PER_BYTE)
 
 # Variables min
 selected_cols = [
     "PM25", "PM25raw", "PM1", "Humidity", "Temperature",
 ]
 
+# VictoriaMetrics (bench_export_vm.py lo apunta a un servidor local de prueba)
+VM_BASE_URL = "http://sensor.aireciudadano.com:30001/api/v1"
+
 # Initialize Flask app and set logging level
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
@@ -25,8 +30,15 @@ app.logger.setLevel(logging.DEBUG)
 # Global lock for one-at-a-time processing
 processing_lock = threading.Lock()
 
+# ==========================================
+# MÉTRICAS: tiempos por etapa y /metrics en formato Prometheus (vm_export_common)
+# ==========================================
+metrics = Metrics()
+metrics.inc('dataapi_requests_in_progress', 0)
+
 # Generador Mágico: Descarga por horas, agrupa por días y "suelta" la memoria
-def fetch_vm_data_daily_generator(base_url, query, selected_cols, start_datetime, end_datetime):
+def fetch_vm_data_daily_generator(base_url, query, selected_cols, start_datetime, end_datetime, timer=None):
+    timer = timer or StageTimer()
     daily_chunk = datetime.timedelta(days=1)
     current_day = start_datetime
 
@@ -36,7 +48,7 @@ def fetch_vm_data_daily_generator(base_url, query, selected_cols, start_datetime
         # Bloques de 1 hora para proteger VictoriaMetrics
         micro_chunk = datetime.timedelta(hours=1)
         current_micro = current_day
-        daily_data = []
+        buffer = SeriesBuffer(selected_cols)
 
         while current_micro < current_day_end:
             micro_end = min(current_micro + micro_chunk, current_day_end)
@@ -48,44 +60,35 @@ def fetch_vm_data_daily_generator(base_url, query, selected_cols, start_datetime
             app.logger.debug(f"Querying VM chunk: {start_str} to {end_str}")
             
             try:
-                response = requests.get(query_url)
+                with timer.stage('upstream_fetch'):
+                    response = requests.get(query_url)
                 if response.status_code == 422:
                     app.logger.error(f"VM Limit Error Detail: {response.text}")
                     
                 response.raise_for_status()
-                data = response.json().get('data', {}).get('result', [])
+                # Antes de decodificar: lo ya acumulado en el buffer + el JSON de esta respuesta
+                check_memory_budget('download', buffer, len(response.content) * JSON_DECODE_BYTES_PER_BYTE)
+                with timer.stage('json_decode'):
+                    data = response.json().get('data', {}).get('result', [])
 
-                if data:
-                    df = pd.json_normalize(data)
-                    
-                    if 'metric.job' in df.columns and 'values' in df.columns:
-                        df = df.explode('values')
-                        df['date'] = df['values'].apply(lambda x: datetime.datetime.fromtimestamp(x[0], tz=datetime.timezone.utc).isoformat())
-                        df['value'] = df['values'].apply(lambda x: float(x[1]))
-                        df = df.drop(columns="values")
-
-                        df = df.rename(columns={"metric.__name__": "metric_name", "metric.job": "station"})
-                        df = df[df['station'].notnull()]
-
-                        if not df.empty:
-                            df_result = pd.pivot_table(df, index=['station', 'date'], columns='metric_name', values='value', aggfunc='mean').reset_index()
-                            daily_data.append(df_result)
-                            
+                with timer.stage('pivot'):
+                    buffer.add_result(decode_series(data))
+                del data
+
+            except MemoryBudgetExceeded:
+                raise
             except Exception as e:
                 app.logger.error(f'Error processing micro-chunk: {str(e)}')
                 pass 
 
             current_micro = micro_end
 
-        # Si hubo datos en este día, los empacamos y "rendimos" (yield) a Flask
-        if daily_data:
-            final_daily_df = pd.concat(daily_data, ignore_index=True)
-            for col in selected_cols:
-                if col not in final_daily_df.columns:
-                    final_daily_df[col] = np.nan
-            yield current_day, final_daily_df
-        else:
-            yield current_day, pd.DataFrame(columns=['station', 'date'] + selected_cols)
+        # Un solo pivot compacto por día; el minuto repetido entre micro-chunks queda en una fila.
+        # Su pico se revisa antes de pivotear
+        check_memory_budget('pivot', buffer, buffer.pivot_bytes())
+        with timer.stage('pivot'):
+            final_daily_df = buffer.to_frame()
+        yield current_day, final_daily_df
             
         # Al pasar al siguiente ciclo, la RAM del día anterior se limpia sola
         current_day = current_day_end
@@ -213,7 +216,26 @@ def index():
 
 @app.route('/dataresult', methods=['POST'])
 def data():
+    timer = StageTimer(metrics)
+    result_format = request.form.get('result_format', 'filejson')
+    if result_format not in ('filejson', 'filecsv'):
+        result_format = 'other'  # Evita etiquetas arbitrarias en /metrics
+    metrics.inc('dataapi_requests_in_progress')
+    start = time.perf_counter()
+    try:
+        response = process_data_request(timer)
+    finally:
+        metrics.inc('dataapi_requests_in_progress', -1)
+    timer.record(result_format, time.perf_counter() - start, response.calculate_content_length() or 0)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def process_data_request(timer):
     if not processing_lock.acquire(blocking=False):
+        timer.status = 'busy'
         return jsonify({
             'error': 'The API is currently processing another request. Please wait and try again shortly.'
         })
@@ -221,7 +243,7 @@ def data():
     start_time_proc = time.time()
     try:
         variables = request.form.getlist('variables')
-        base_url = "http://sensor.aireciudadano.com:30001/api/v1"
+        base_url = VM_BASE_URL
 
         start_date = request.form['start_date']
         start_time_str = request.form['start_time']
@@ -237,6 +259,7 @@ def data():
         date_diff = end_datetime - start_datetime
         
         if date_diff.days > 7:
+            timer.status = 'rejected'
             processing_lock.release()
             return jsonify({
                 'error': 'The maximum limit for raw minute data downloads is 7 days due to server constraints. Please reduce the date range.'
@@ -256,7 +279,7 @@ def data():
         with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
             
             # EL BUCLE MAGICO: Genera 1 bloque -> Escribe al Zip -> Libera RAM -> Repite
-            for day_start, daily_df in fetch_vm_data_daily_generator(base_url, query, variables, start_datetime, end_datetime):
+            for day_start, daily_df in fetch_vm_data_daily_generator(base_url, query, variables, start_datetime, end_datetime, timer=timer):
                 
                 if daily_df.empty:
                     continue
@@ -268,20 +291,21 @@ def data():
                 day_str = day_start.strftime('%Y-%m-%d_%H%M')
                 
                 # OPTIMIZACIÓN EXTREMA: Ordenamiento alfabético directo de ISO strings
-                daily_df = daily_df.sort_values(by=['station', 'date'])
+                with timer.stage('sort_round'):
+                    daily_df = format_dates(daily_df.sort_values(by=['station', 'date']), '%Y-%m-%dT%H:%M:%S+00:00')
 
-                for col in variables:
-                    if col in daily_df.columns:
-                        daily_df[col] = pd.to_numeric(daily_df[col], errors='coerce').round(3)
+                    for col in variables:
+                        if col in daily_df.columns:
+                            # float32 -> float64 antes de redondear, para que CSV/JSON muestren 12.345 y no 12.3450002670
+                            daily_df[col] = pd.to_numeric(daily_df[col], errors='coerce').astype(np.float64).round(3)
 
                 total_records = daily_df.shape[0]
 
                 if result_format == 'filecsv':
-                    csv_buffer = io.StringIO()
-                    daily_df.to_csv(csv_buffer, index=False)
-                    # Guarda el archivo en el zip con el nombre de su fecha y hora
-                    zf.writestr(f'data_{day_str}.csv', csv_buffer.getvalue())
-                    csv_buffer.close()
+                    # El CSV se escribe directo al miembro del ZIP por bloques: no hay copia completa en un StringIO
+                    with timer.stage('serialize'):
+                        with zf.open(f'data_{day_str}.csv', 'w') as raw_csv, io.TextIOWrapper(raw_csv, encoding='utf-8', newline='') as csv_file:
+                            daily_df.to_csv(csv_file, index=False, chunksize=50000)
                 
                 elif result_format == 'filejson':
                     with zf.open(f'data_{day_str}.json', 'w') as json_file:
@@ -290,15 +314,17 @@ def data():
                         json_file.write(b'  "data": {\n')
                         
                         first_station = True
-                        for station, group in daily_df.groupby('station'):
+                        for station, group in daily_df.groupby('station', observed=True):
                             if not first_station:
                                 json_file.write(b',\n')
                             first_station = False
                             
                             json_file.write(f'    "{station}": '.encode('utf-8'))
                             # to_json elimina NaNs nativamente, sin bloqueos de RAM
-                            json_str = group.drop(columns=['station']).to_json(orient='records')
-                            json_file.write(json_str.encode('utf-8'))
+                            with timer.stage('serialize'):
+                                json_str = group.drop(columns=['station']).to_json(orient='records')
+                            with timer.stage('compress'):
+                                json_file.write(json_str.encode('utf-8'))
                         
                         json_file.write(b'\n  }\n}')
                 
@@ -306,6 +332,7 @@ def data():
                 del daily_df
 
         if not data_found_in_any_day:
+            timer.status = 'empty'
             processing_lock.release()
             return jsonify({'message': 'No data found for the selected period and stations.'})
 
@@ -324,7 +351,15 @@ def data():
             }
         )
 
+    except MemoryBudgetExceeded as e:
+        timer.status = 'rejected'
+        if processing_lock.locked():
+            processing_lock.release()
+        app.logger.error(f'Memory budget exceeded: {str(e)}')
+        return jsonify({'error': str(e)})
+
     except Exception as e:
+        timer.status = 'error'
         if processing_lock.locked():
             processing_lock.release()
         app.logger.error(f'Error en endpoint de datos: {str(e)}')
@@ -0,0 +1,543 @@
+# Benchmark de las exportaciones de VictoriaMetrics (app horaria y app RAW por minuto)
+# y de las apps sobre Prometheus (APIdataservidor con ruta Arrow y pandas, pokzip, pokzip7d)
+#
+# Levanta un servidor HTTP local que responde /api/v1/query_range con datos sintéticos
+# (o con una respuesta grabada, --fixture), apunta VM_BASE_URL / PROM_BASE_URL de cada app a ese
+# servidor y ejecuta /dataresult en un proceso aparte por caso para medir tiempo, RAM pico y bytes.
+# Con --copies mide además cuánta memoria asigna cada etapa, en copias de los puntos descargados.
+#
+# Ejemplos:
+#   python bench_export_vm.py --stations 50 --days 7
+#   python bench_export_vm.py --stations 200 --days 90 --cases hourly:filecsv,hourly:filejson
+#   python bench_export_vm.py --save-baseline bench_baseline.json
+#   python bench_export_vm.py --baseline bench_baseline.json --tolerance 0.15
+#   python bench_export_vm.py --days 2 --copies --cases servidor:filecsv,servidor_pandas:filecsv
+#
+# app@rev corre el archivo de la app tal como estaba en ese commit de git (para comparar contra versiones viejas):
+#   python bench_export_vm.py --days 2 --latency-ms 50 --cases pokzip7d:screen,pokzip7d@70085fb:screen,pokzip@70085fb:screen
+#
+# Una respuesta grabada se obtiene con:
+#   curl -G 'http://sensor.aireciudadano.com:30001/api/v1/query_range' \
+#        --data-urlencode 'query={__name__=~"PM25_1h|PM1_1h"}' \
+#        --data-urlencode 'start=2024-11-01T00:00:00Z' --data-urlencode 'end=2024-11-08T00:00:00Z' \
+#        --data-urlencode 'step=1h' > fixture.json
+
+import argparse
+import contextlib
+import datetime
+import functools
+import importlib
+import tempfile
+import inspect
+import json
+import logging
+import os
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# app -> (módulo, atributos que se reemplazan antes de correr)
+APPS = {
+    'hourly': ('app_DesdeCompuLocalVM_23may2026', {}),
+    'raw': ('app_DesdeCompuLocalVMraw_26may2026', {}),
+    'servidor': ('APIdataservidor_26nov2024', {}),
+    'servidor_pandas': ('APIdataservidor_26nov2024', {'pa': None}),  # Misma app sin pyarrow
+    'pokzip': ('pokzip', {}),
+    'pokzip7d': ('pokzip7d', {}),
+}
+UPSTREAM_URLS = ('http://sensor.aireciudadano.com:30000/api/v1', 'http://sensor.aireciudadano.com:30001/api/v1')
+DEFAULT_CASES = ['hourly:screen', 'hourly:filecsv', 'hourly:filejson', 'raw:filecsv', 'raw:filejson',
+                 'servidor:filecsv', 'servidor:filejson']
+FETCH_FUNCTIONS = ('fetch_vm_data_generator', 'fetch_vm_data_daily_generator', 'fetch_arrow_chunks', 'get_data')
+# Funciones de APIdataservidor medidas con --copies (las apps VM usan su propio StageTimer;
+# Response.json se mide siempre como json_decode)
+STAGE_FUNCTIONS = {
+    'decode_arrow_batch': 'decode',
+    'get_data': 'decode',  # Ruta pandas: json_normalize/explode/apply/pivot de todo el rango en una sola función
+    'arrow_bucketed_mean': 'pivot',
+    'bucketed_stats': 'pivot',
+    'arrow_grouped_records': 'serialize',
+    'create_arrow_zip_file': 'serialize',
+    'create_zip_file': 'serialize',
+}
+POINT_BYTES = 16  # Un punto denso: timestamp int64 + valor float64
+BENCH_START = datetime.datetime(2024, 11, 1)
+STEP_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+MISSING_FRACTION = 0.05  # Huecos de datos por serie, como en las estaciones reales
+
+
+# ==========================================
+# SERVIDOR VM DE PRUEBA
+# ==========================================
+def parse_vm_time(value):
+    if re.fullmatch(r'[0-9.]+', value):
+        return float(value)
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def parse_selector(query):
+    # {__name__=~"A|B", job=~".*(x|y).*"} -> (regex de métricas, regex de estaciones); {job="pushgateway"} -> todo
+    names = re.search(r'__name__=~"([^"]*)"', query)
+    jobs = re.search(r'job=~"([^"]*)"', query)
+    return (re.compile(names.group(1) if names else '.*'),
+            re.compile(jobs.group(1) if jobs else '.*'))
+
+
+class SyntheticVM:
+    def __init__(self, stations, metrics):
+        self.stations = [f"AireCiudadano_Bench_{i:04d}" for i in range(stations)]
+        self.metrics = metrics
+
+    def series(self, metric_re, station_re, start, end, step):
+        timestamps = np.arange(int(start), int(end) + 1, step, dtype=np.int64)
+        for s_index, station in enumerate(self.stations):
+            if not station_re.fullmatch(station):
+                continue
+            for m_index, metric in enumerate(self.metrics):
+                if not metric_re.fullmatch(metric):
+                    continue
+                # Semilla fija por serie y rango: la misma consulta devuelve siempre los mismos datos
+                rng = np.random.default_rng([s_index, m_index, int(start)])
+                keep = rng.random(len(timestamps)) >= MISSING_FRACTION
+                values = 5 + 40 * rng.random(len(timestamps))
+                if keep.any():
+                    yield station, metric, timestamps[keep], values[keep]
+
+
+class RecordedVM:
+    def __init__(self, path):
+        with open(path, 'r') as f:
+            self.result = json.load(f)['data']['result']
+        self.metrics = sorted({s['metric'].get('__name__', '') for s in self.result})
+
+    def series(self, metric_re, station_re, start, end, step):
+        for item in self.result:
+            metric = item['metric'].get('__name__', '')
+            station = item['metric'].get('exported_job', item['metric'].get('job', ''))
+            if not (metric_re.fullmatch(metric) and station_re.fullmatch(station)):
+                continue
+            points = np.array([(float(t), float(v)) for t, v in item['values']])
+            if not len(points):
+                continue
+            window = (points[:, 0] >= start) & (points[:, 0] <= end)
+            if window.any():
+                yield station, metric, points[window, 0].astype(np.int64), points[window, 1]
+
+
+def query_range_body(source, query, start, end, step):
+    metric_re, station_re = parse_selector(query)
+    # Prometheus (pushgateway) lleva la estación en exported_job; VictoriaMetrics en job
+    pushgateway = 'job="pushgateway"' in query
+    result = []
+    points = 0
+    for station, metric, timestamps, values in source.series(metric_re, station_re, start, end, step):
+        values_json = ','.join(f'[{t},"{v:.2f}"]' for t, v in zip(timestamps.tolist(), values.tolist()))
+        if pushgateway:
+            labels = f'"__name__":"{metric}","exported_job":"{station}","job":"pushgateway"'
+        else:
+            labels = f'"__name__":"{metric}","job":"{station}"'
+        result.append(f'{{"metric":{{{labels}}},"values":[{values_json}]}}')
+        points += len(timestamps)
+    body = '{"status":"success","data":{"resultType":"matrix","result":[' + ','.join(result) + ']}}'
+    return body.encode('utf-8'), points
+
+
+def start_stub_server(source, latency=0.0):
+    # Las apps repiten las mismas consultas en cada ejecución; se cachea el cuerpo para no medir al stub
+    @functools.lru_cache(maxsize=512)
+    def cached_body(query, start, end, step):
+        return query_range_body(source, query, start, end, step)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path != '/api/v1/query_range':
+                self.send_error(404)
+                return
+            if latency:
+                time.sleep(latency)  # Ida y vuelta de la red hasta Prometheus/VictoriaMetrics
+            args = urllib.parse.parse_qs(url.query)
+            step = args.get('step', ['1h'])[0]
+            step_seconds = int(step[:-1]) * STEP_SECONDS[step[-1]] if step[-1] in STEP_SECONDS else int(step)
+            body, points = cached_body(args['query'][0], parse_vm_time(args['start'][0]),
+                                       parse_vm_time(args['end'][0]), step_seconds)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-Bench-Points', str(points))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ==========================================
+# EJECUCIÓN DE UN CASO (proceso hijo)
+# ==========================================
+def busy_time(intervals):
+    # Tiempo de reloj con al menos una consulta en vuelo (las apps con descargas en paralelo las solapan)
+    total = 0.0
+    end = float('-inf')
+    for start, stop in sorted(intervals):
+        if stop > end:
+            total += stop - max(start, end)
+            end = stop
+    return total
+
+
+def peak_rss_mb():
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class AllocationProbe:
+    # Pico de memoria de cada etapa por encima de lo que había al entrar: tracemalloc (Python, NumPy, pandas)
+    # + pool de Arrow. Se guarda el mayor pico entre todas las llamadas de la etapa. Las etapas anidadas se
+    # miden por separado y también cuentan dentro de la de afuera
+    def __init__(self):
+        self.peaks = {}
+        self.stack = []
+        self.pools = []  # Los buffers de Arrow guardan un puntero a su pool: no se pueden liberar antes
+        try:
+            import pyarrow
+        except ImportError:
+            pyarrow = None
+        self.pyarrow = pyarrow
+        tracemalloc.start()
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        if self.stack:
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], traced_peak)
+        frame = {'before': tracemalloc.get_traced_memory()[0], 'peak': 0, 'pool': None}
+        if self.pyarrow:
+            frame['parent_pool'] = self.pyarrow.default_memory_pool()
+            frame['pool'] = self.pyarrow.proxy_memory_pool(frame['parent_pool'])
+            self.pools.append(frame['pool'])
+            self.pyarrow.set_memory_pool(frame['pool'])
+        self.stack.append(frame)
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            traced_peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            peak = traced_peak - frame['before']
+            if frame['pool'] is not None:
+                peak += frame['pool'].max_memory()
+                self.pyarrow.set_memory_pool(frame['parent_pool'])
+            self.peaks[stage] = max(self.peaks.get(stage, 0), peak)
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], traced_peak)
+            tracemalloc.reset_peak()
+
+    def wrap(self, function, stage):
+        @functools.wraps(function)
+        def probed(*args, **kwargs):
+            with self.measure(stage):
+                return function(*args, **kwargs)
+        return probed
+
+
+def import_app(app_key, vm_url):
+    # app o app@rev: con @rev se importa el archivo de ese commit desde un directorio temporal
+    app_key, _, rev = app_key.partition('@')
+    module_name, overrides = APPS[app_key]
+    if rev:
+        source = subprocess.run(['git', 'show', f'{rev}:{module_name}.py'], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        for upstream in UPSTREAM_URLS:  # Las versiones viejas no tienen VM_BASE_URL / PROM_BASE_URL
+            source = source.replace(upstream, vm_url)
+        directory = tempfile.mkdtemp(prefix='bench_rev_')
+        with open(os.path.join(directory, f'{module_name}.py'), 'w') as f:
+            f.write(source)
+        sys.path.insert(0, directory)
+    return importlib.import_module(module_name), overrides
+
+
+def run_case(app_key, result_format, days, vm_url, station_filter, copies=False):
+    import requests
+
+    module, overrides = import_app(app_key, vm_url)
+    for name in ('VM_BASE_URL', 'PROM_BASE_URL'):
+        if hasattr(module, name):
+            setattr(module, name, vm_url)
+    for name, value in overrides.items():
+        setattr(module, name, value)
+    module.app.logger.setLevel(logging.WARNING)
+
+    stages = {'fetch_total': 0.0}
+    http_intervals = []
+    points = [0]  # Puntos de la respuesta upstream más grande
+
+    original_get = requests.get
+    def timed_get(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            response = original_get(*args, **kwargs)
+            response.content  # Incluye la descarga del cuerpo
+            points[0] = max(points[0], int(response.headers.get('X-Bench-Points', 0)))
+            return response
+        finally:
+            http_intervals.append((t0, time.perf_counter()))
+    requests.get = timed_get
+
+    probe = None
+    if copies:
+        probe = AllocationProbe()
+        requests.Response.json = probe.wrap(requests.Response.json, 'json_decode')
+        if hasattr(module, 'StageTimer'):
+            original_stage = module.StageTimer.stage
+            @contextlib.contextmanager
+            def probed_stage(self, name):
+                with probe.measure(name), original_stage(self, name):
+                    yield
+            module.StageTimer.stage = probed_stage
+        for name, stage in STAGE_FUNCTIONS.items():
+            if hasattr(module, name):
+                setattr(module, name, probe.wrap(getattr(module, name), stage))
+
+    # Las funciones de descarga se envuelven para separar "traer + pivotear" de "serializar + comprimir"
+    def timed_generator(original_generator):
+        def timed(*args, **kwargs):
+            iterator = original_generator(*args, **kwargs)
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    stages['fetch_total'] += time.perf_counter() - t0
+                    return
+                stages['fetch_total'] += time.perf_counter() - t0
+                yield item
+        return timed
+
+    def timed_function(original_function):
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return original_function(*args, **kwargs)
+            finally:
+                stages['fetch_total'] += time.perf_counter() - t0
+        return timed
+
+    for name in FETCH_FUNCTIONS:
+        if hasattr(module, name):
+            original = getattr(module, name)
+            wrapper = timed_generator if inspect.isgeneratorfunction(original) else timed_function
+            setattr(module, name, wrapper(original))
+
+    end = BENCH_START + datetime.timedelta(days=days)
+    form = {
+        'variables': module.selected_cols,
+        'start_date': BENCH_START.strftime('%Y-%m-%d'),
+        'start_time': BENCH_START.strftime('%H:%M'),
+        'end_date': end.strftime('%Y-%m-%d'),
+        'end_time': end.strftime('%H:%M'),
+        'station_filter': station_filter,
+        'result_format': result_format,
+        # pokzip / pokzip7d: datos por minuto sin promedio horario
+        'aggregation_method': 'step',
+        'step_number': '1',
+        'step_option': 'minutes',
+    }
+
+    rss_before = peak_rss_mb()
+    client = module.app.test_client()
+    t0 = time.perf_counter()
+    response = client.post('/dataresult', data=form)
+    body = response.get_data()
+    wall = time.perf_counter() - t0
+
+    upstream_http = busy_time(http_intervals)
+    result = {
+        'wall_s': wall,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_before,
+        'bytes': len(body),
+        'stages': {
+            'upstream_http': upstream_http,
+            'parse_pivot': max(stages['fetch_total'] - upstream_http, 0.0),
+            'serialize': wall - stages['fetch_total'],
+        },
+    }
+    if probe is not None:
+        # Copias = pico de la etapa / una respuesta upstream (la más grande) guardada en arrays densos.
+        # Una etapa que acumula todo el rango llega a (respuestas x copias por respuesta)
+        dense = max(points[0] * POINT_BYTES, 1)
+        result['points'] = points[0]
+        result['copies'] = {stage: {'peak_mb': peak / 2**20, 'copies': peak / dense}
+                            for stage, peak in probe.peaks.items()}
+    if response.mimetype == 'application/json':
+        payload = json.loads(body)
+        if 'error' in payload or 'message' in payload:
+            result['skipped'] = payload.get('error') or payload.get('message')
+    return result
+
+
+# ==========================================
+# ORQUESTACIÓN Y REPORTE
+# ==========================================
+def case_key(case, stations, days):
+    return f"{case}:{stations}st:{days}d"
+
+
+def run_case_subprocess(case, args, vm_url):
+    command = [sys.executable, os.path.abspath(__file__), '--child', case,
+               '--days', str(args.days), '--vm-url', vm_url, '--station-filter', args.station_filter]
+    if args.copies:
+        command.append('--copies')
+    completed = subprocess.run(command, capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise RuntimeError(f"{case} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    # Mediana del tiempo (y de cada etapa) entre repeticiones; RAM pico = la peor
+    return {
+        'wall_s': statistics.median(r['wall_s'] for r in runs),
+        'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+        'rss_growth_mb': max(r['rss_growth_mb'] for r in runs),
+        'bytes': runs[-1]['bytes'],
+        'stages': {stage: statistics.median(r['stages'][stage] for r in runs) for stage in runs[0]['stages']},
+        **({'copies': runs[-1]['copies']} if 'copies' in runs[-1] else {}),
+    }
+
+
+def print_report(results, baseline, tolerance):
+    regressions = []
+    header = f"{'case':<36}{'wall s':>9}{'http s':>9}{'parse s':>9}{'write s':>9}{'peak MB':>9}{'+MB':>8}{'bytes':>13}"
+    print(header)
+    print('-' * len(header))
+    for key, result in results.items():
+        if 'skipped' in result:
+            print(f"{key:<36}  skipped: {result['skipped']}")
+            continue
+        stages = result['stages']
+        print(f"{key:<36}{result['wall_s']:>9.3f}{stages['upstream_http']:>9.3f}{stages['parse_pivot']:>9.3f}"
+              f"{stages['serialize']:>9.3f}{result['peak_rss_mb']:>9.1f}{result['rss_growth_mb']:>8.1f}{result['bytes']:>13,}")
+
+        base = baseline.get(key)
+        if not base or 'skipped' in base:
+            continue
+        wall_delta = result['wall_s'] / base['wall_s'] - 1
+        rss_delta = result['peak_rss_mb'] / base['peak_rss_mb'] - 1
+        notes = []
+        if wall_delta > tolerance:
+            notes.append('SLOWER')
+        if rss_delta > tolerance:
+            notes.append('MORE RAM')
+        if result['bytes'] != base['bytes']:
+            notes.append(f"OUTPUT SIZE CHANGED ({base['bytes']:,} -> {result['bytes']:,})")
+        print(f"{'  vs baseline':<36}{wall_delta:>+9.1%}{'':>27}{rss_delta:>+9.1%}  {' '.join(notes)}")
+        if notes:
+            regressions.append(key)
+    return regressions
+
+
+def print_copies(results):
+    rows = [(key, stage, value) for key, result in results.items()
+            for stage, value in result.get('copies', {}).items()]
+    if not rows:
+        return
+    print()
+    header = f"{'case':<36}{'stage':<16}{'peak MB':>10}{'copies':>9}"
+    print(header)
+    print('-' * len(header))
+    for key, stage, value in rows:
+        print(f"{key:<36}{stage:<16}{value['peak_mb']:>10.1f}{value['copies']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de las exportaciones de VictoriaMetrics')
+    parser.add_argument('--stations', type=int, default=50, help='Estaciones sintéticas')
+    parser.add_argument('--days', type=int, default=7, help='Rango consultado en días')
+    parser.add_argument('--cases', default=','.join(DEFAULT_CASES), help='app:formato separados por coma')
+    parser.add_argument('--repeat', type=int, default=3, help='Ejecuciones por caso (se reporta la mediana)')
+    parser.add_argument('--fixture', help='Respuesta query_range grabada a reproducir en vez de datos sintéticos')
+    parser.add_argument('--station-filter', default='', help='Filtro de estaciones enviado en el formulario')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Demora del servidor de prueba por consulta')
+    parser.add_argument('--baseline', help='Archivo JSON con resultados previos para comparar')
+    parser.add_argument('--save-baseline', help='Guarda los resultados de esta corrida como baseline')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Regresión tolerada (0.10 = 10%%)')
+    parser.add_argument('--copies', action='store_true',
+                        help='Mide el pico de memoria por etapa con tracemalloc y el pool de Arrow (más lento)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--vm-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        app_key, result_format = args.child.split(':')
+        print(json.dumps(run_case(app_key, result_format, args.days, args.vm_url, args.station_filter, args.copies)))
+        return
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    for case in cases:
+        app_key, _, result_format = case.partition(':')
+        if app_key.partition('@')[0] not in APPS or not result_format:
+            parser.error(f"Unknown case '{case}'. Use app:format with app in {', '.join(APPS)}")
+
+    if args.fixture:
+        source = RecordedVM(args.fixture)
+        stations = 'fixture'
+    else:
+        # Métricas de las dos apps: horarias (_1h) y por minuto
+        metrics = []
+        for case in cases:
+            module = importlib.import_module(APPS[case.split(':')[0].partition('@')[0]][0])
+            metrics.extend(col for col in module.selected_cols if col not in metrics)
+        source = SyntheticVM(args.stations, metrics)
+        stations = args.stations
+
+    server = start_stub_server(source, args.latency_ms / 1000)
+    vm_url = f"http://127.0.0.1:{server.server_address[1]}/api/v1"
+
+    results = {}
+    for case in cases:
+        key = case_key(case, stations, args.days)
+        first = run_case_subprocess(case, args, vm_url)
+        if 'skipped' in first:
+            # Rango por fuera de los límites de la app (p. ej. pantalla > 7 días)
+            results[key] = first
+            continue
+        runs = [first] + [run_case_subprocess(case, args, vm_url) for _ in range(args.repeat - 1)]
+        results[key] = summarize(runs)
+    server.shutdown()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = print_report(results, baseline, args.tolerance)
+    print_copies(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,24 @@
 import json
+import math
+import threading
+import time
 import requests
-from flask import Flask
+from flask import Flask, request, jsonify
 
 app = Flask(__name__)
 
+METRICS_URL = "http://sensor.aireciudadano.com:30991/api/v1/metrics"
+
+# Segundos que vive la copia de estaciones antes de volver a consultar la fuente
+SNAPSHOT_TTL = 60
+# Tamaño de celda (grados) del índice espacial en malla
+GRID_CELL_DEG = 0.5
+EARTH_RADIUS_KM = 6371.0088
+# Radio máximo aceptado por /fixstations/near
+MAX_RADIUS_KM = 1000.0
+# Segundos de espera a la fuente de métricas al refrescar la copia
+METRICS_TIMEOUT = 10
+
 def transform_data(input_json, filter_inout=False):
     output_data = []
 
@@ -83,6 +98,139 @@ def get_measurement_unit(measurement_type):
     }
     return unit_mapping.get(measurement_type, "")
 
+# Índice espacial en malla: agrupa estaciones por celda (lon, lat) de GRID_CELL_DEG grados
+class StationGridIndex:
+    def __init__(self, stations, cell_deg=GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.cells = {}
+        for station in stations:
+            lat = station["decimalLatitude"]
+            lon = station["decimalLongitude"]
+            # Estaciones sin ubicación válida (None, NaN o 0,0) no entran al índice
+            if not valid_lat(lat) or not valid_lon(lon) or (lat == 0 and lon == 0):
+                continue
+            self.cells.setdefault(self._cell(lon, lat), []).append(station)
+
+    def _cell(self, lon, lat):
+        return (math.floor(lon / self.cell_deg), math.floor(lat / self.cell_deg))
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat):
+        min_cx, min_cy = self._cell(min_lon, min_lat)
+        max_cx, max_cy = self._cell(max_lon, max_lat)
+        # Cajas grandes: recorrer solo las celdas ocupadas en vez de todas las de la caja
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self.cells):
+            cells = [cell for cell in self.cells
+                     if min_cx <= cell[0] <= max_cx and min_cy <= cell[1] <= max_cy]
+        else:
+            cells = [(cx, cy) for cx in range(min_cx, max_cx + 1) for cy in range(min_cy, max_cy + 1)]
+        result = []
+        for cell in cells:
+            for station in self.cells.get(cell, ()):
+                if (min_lon <= station["decimalLongitude"] <= max_lon and
+                        min_lat <= station["decimalLatitude"] <= max_lat):
+                    result.append(station)
+        return result
+
+    def near(self, lat, lon, radius_km):
+        # Caja envolvente del círculo y luego distancia exacta (haversine)
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        dlon = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+        min_lat, max_lat = lat - dlat, lat + dlat
+        if dlon >= 180.0 or min_lat <= -90 or max_lat >= 90:
+            # El círculo rodea el planeta o toca un polo: todas las longitudes
+            boxes = [(-180.0, 180.0)]
+        elif lon - dlon < -180.0:
+            # La caja cruza el antimeridiano: se parte en dos a cada lado de ±180
+            boxes = [(lon - dlon + 360.0, 180.0), (-180.0, lon + dlon)]
+        elif lon + dlon > 180.0:
+            boxes = [(lon - dlon, 180.0), (-180.0, lon + dlon - 360.0)]
+        else:
+            boxes = [(lon - dlon, lon + dlon)]
+        candidates = [station for min_lon, max_lon in boxes
+                      for station in self.bbox(min_lon, min_lat, max_lon, max_lat)]
+        result = []
+        for station in candidates:
+            distance = haversine_km(lat, lon, station["decimalLatitude"], station["decimalLongitude"])
+            if distance <= radius_km:
+                result.append((distance, station))
+        result.sort(key=lambda item: item[0])
+        return result
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+# Copia en memoria de las estaciones (solo exteriores) y su índice espacial.
+# snapshot_lock solo protege el cambio de copia; la consulta HTTP va por fuera, bajo refresh_lock
+snapshot_lock = threading.Lock()
+refresh_lock = threading.Lock()
+snapshot = {"stations": [], "index": None, "updated": 0.0}
+
+def get_station_index():
+    with snapshot_lock:
+        index, updated = snapshot["index"], snapshot["updated"]
+    if time.time() - updated < SNAPSHOT_TTL:
+        return index
+
+    # Un solo hilo refresca; mientras tanto los demás sirven la copia vencida (solo esperan si aún no hay ninguna)
+    if not refresh_lock.acquire(blocking=index is None):
+        return index
+    try:
+        with snapshot_lock:
+            index, updated = snapshot["index"], snapshot["updated"]
+        if time.time() - updated < SNAPSHOT_TTL:
+            return index
+        try:
+            response = requests.get(METRICS_URL, timeout=METRICS_TIMEOUT)
+            response.raise_for_status()
+            stations = transform_data(response.json(), filter_inout=True)
+        except Exception as e:
+            # Si ya hay una copia anterior se sirve aunque esté vencida; se reintenta en la próxima petición
+            if index is None:
+                raise
+            app.logger.warning(f"Station refresh failed, serving snapshot from {time.ctime(updated)}: {e}")
+            return index
+        # El índice se reconstruye cada vez que se refresca la copia de estaciones
+        index = StationGridIndex(stations)
+        with snapshot_lock:
+            snapshot["stations"] = stations
+            snapshot["index"] = index
+            snapshot["updated"] = time.time()
+        return index
+    finally:
+        refresh_lock.release()
+
+def valid_lat(value):
+    return value is not None and math.isfinite(value) and -90 <= value <= 90
+
+def valid_lon(value):
+    return value is not None and math.isfinite(value) and -180 <= value <= 180
+
+def to_geojson(stations, distances=None):
+    features = []
+    for i, station in enumerate(stations):
+        properties = {key: value for key, value in station.items()
+                      if key not in ("decimalLatitude", "decimalLongitude")}
+        if distances is not None:
+            properties["distance_km"] = round(distances[i], 3)
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [station["decimalLongitude"], station["decimalLatitude"]]
+            },
+            "properties": properties
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+def geojson_response(data):
+    output_json_dumps = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+    return app.response_class(output_json_dumps, mimetype='application/geo+json')
+
 @app.route('/fixstationall', methods=['GET'])
 def fixstationall():
     # Define la URL del JSON de entrada
@@ -105,5 +253,42 @@ def fixstationall_inout():
     output_json_dumps = json.dumps(output_json, separators=(',', ':'), ensure_ascii=False)
     return output_json_dumps
 
+# Ejemplo: /fixstations/bbox?min_lon=-74.3&min_lat=4.4&max_lon=-73.9&max_lat=4.9
+@app.route('/fixstations/bbox', methods=['GET'])
+def fixstations_bbox():
+    min_lon = request.args.get('min_lon', type=float)
+    min_lat = request.args.get('min_lat', type=float)
+    max_lon = request.args.get('max_lon', type=float)
+    max_lat = request.args.get('max_lat', type=float)
+
+    if None in (min_lon, min_lat, max_lon, max_lat):
+        return jsonify({"error": "min_lon, min_lat, max_lon and max_lat are required"}), 400
+    if not (valid_lon(min_lon) and valid_lon(max_lon) and valid_lat(min_lat) and valid_lat(max_lat)):
+        return jsonify({"error": "Longitudes must be within [-180, 180] and latitudes within [-90, 90]"}), 400
+    if min_lon > max_lon or min_lat > max_lat:
+        return jsonify({"error": "Invalid bounding box"}), 400
+
+    stations = get_station_index().bbox(min_lon, min_lat, max_lon, max_lat)
+    return geojson_response(to_geojson(stations))
+
+# Ejemplo: /fixstations/near?lat=4.62&lon=-74.13&radius_km=5
+@app.route('/fixstations/near', methods=['GET'])
+def fixstations_near():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', 5.0, type=float)
+
+    if lat is None or lon is None:
+        return jsonify({"error": "lat and lon are required"}), 400
+    if not (valid_lat(lat) and valid_lon(lon)):
+        return jsonify({"error": "lat must be within [-90, 90] and lon within [-180, 180]"}), 400
+    if radius_km is None or not 0 < radius_km <= MAX_RADIUS_KM:
+        return jsonify({"error": f"radius_km must be greater than 0 and at most {MAX_RADIUS_KM:g}"}), 400
+
+    matches = get_station_index().near(lat, lon, radius_km)
+    stations = [station for _, station in matches]
+    distances = [distance for distance, _ in matches]
+    return geojson_response(to_geojson(stations, distances))
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8080)
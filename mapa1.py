@@ -3,6 +3,7 @@ import os
 import json
 import pandas as pd
 import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
 from matplotlib.animation import FuncAnimation, FFMpegWriter
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
@@ -17,20 +18,18 @@ OUTPUT_FOLDER = "output"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Escala de colores basada en PM25
-def pm25_to_color(pm25):
-    if pm25 < 13:
-        return "green"
-    elif 13 <= pm25 < 35:
-        return "yellow"
-    elif 35 <= pm25 < 55:
-        return "orange"
-    elif 55 <= pm25 < 150:
-        return "red"
-    elif 150 <= pm25 < 250:
-        return "purple"
-    else:
-        return "brown"
+# Escala de colores PM2.5: límite inferior de cada categoría a partir de "yellow"
+PM25_BREAKPOINTS = np.array([13, 35, 55, 150, 250])
+PM25_COLOR_NAMES = ["green", "yellow", "orange", "red", "purple", "brown"]
+PM25_RGBA = mcolors.to_rgba_array(PM25_COLOR_NAMES)
+
+# Categoría (0-5) de todos los valores PM2.5 en una sola pasada; NaN cae en "brown" igual que antes
+def pm25_category(pm25_values):
+    return np.searchsorted(PM25_BREAKPOINTS, np.asarray(pm25_values, dtype=float), side='right')
+
+# Colores RGBA (N, 4) listos para el scatter
+def pm25_to_rgba(pm25_values):
+    return PM25_RGBA[pm25_category(pm25_values)]
 
 # Crear DataFrame consolidado para animación
 def create_dataframe(json_data):
@@ -84,27 +83,32 @@ def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', zoom
     
     # Preparar los puntos
     scatter = ax.scatter([], [], s=[], c=[], transform=ccrs.PlateCarree(), alpha=1, edgecolor=None, rasterized=False)
+
+    # Preparación única de los frames: fechas ordenadas, estaciones exteriores ordenadas por fecha
+    # y rango [start, end) de filas por frame; cada frame es solo un slice de los arreglos
+    times = pd.DatetimeIndex(df['date'].drop_duplicates().sort_values())
+    outdoor = df[df['InOut'] == 0.0].sort_values('date', kind='stable')
+    outdoor_times = pd.DatetimeIndex(outdoor['date']).asi8
+    starts = np.searchsorted(outdoor_times, times.asi8, side='left')
+    ends = np.searchsorted(outdoor_times, times.asi8, side='right')
+    offsets = np.column_stack((outdoor['Longitude'].to_numpy(dtype=float), outdoor['Latitude'].to_numpy(dtype=float)))
+    sizes = outdoor["PM25"].to_numpy(dtype=float) * size_scale  # Tamaño proporcional al PM2.5
+    colors = pm25_to_rgba(outdoor['PM25'])
     
     # Función de actualización por frame
     def update(frame):
-        # Filtrar datos para el frame actual
-        current_time = sorted(df['date'].unique())[frame]
-        data_frame = df[df['date'] == current_time]
-        
-        # Filtrar puntos con InOut = 0.0
-        data_frame = data_frame[data_frame['InOut'] == 0.0]
+        current_time = times[frame]
+        start, end = starts[frame], ends[frame]
         
-        sizes = data_frame["PM25"] * size_scale  # Tamaño proporcional al PM2.5
-        colors = data_frame["PM25"].apply(pm25_to_color)
-        scatter.set_offsets(data_frame[["Longitude", "Latitude"]])
-        scatter.set_sizes(sizes)
-        scatter.set_color(colors)
+        scatter.set_offsets(offsets[start:end])
+        scatter.set_sizes(sizes[start:end])
+        scatter.set_color(colors[start:end])
         
         # Actualizar el título con la fecha y hora
         ax.set_title(f"PM2.5 Animación - {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Crear la animación
-    total_frames = len(df['date'].unique())
+    total_frames = len(times)
     ani = FuncAnimation(fig, update, frames=total_frames, repeat=False)
     
     # Set up the writer with higher dpi
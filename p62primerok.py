@@ -4,6 +4,7 @@ import pandas as pd
 import datetime
 import numpy as np
 import time
+from urllib.parse import quote
 
 # Constants
 selected_cols = [
@@ -91,6 +92,55 @@ def _get_step(number, choice):
     options = {"minutes": "m", "hours": "h", "days": "d", "weeks": "w", "years": "y"}
     return f"{number}{options[choice]}"
 
+# Average window length from the same step fields of the form
+def _get_window(number, choice):
+    return pd.Timedelta(**{choice: int(number)})
+
+# Trailing-window averages over (t - window, t] for every t from start to end, per group.
+# Rows are sorted once; each window is two searchsorted lookups on the group's timestamps
+# and a difference of cumulative sums, instead of a boolean mask over the group per hour.
+def trailing_window_mean(df, group_cols, value_cols, start, end, window, step=None):
+    step = step or window
+    eval_times = pd.date_range(start, end, freq=step)
+    columns = group_cols + ['date'] + value_cols
+    if df.empty or eval_times.empty:
+        return pd.DataFrame(columns=columns)
+
+    df = df.sort_values(group_cols + ['date'], kind='stable')
+    timestamps = df['date'].values.astype('datetime64[ns]').astype(np.int64)
+    eval_ns = eval_times.values.astype('datetime64[ns]').astype(np.int64)
+    window_ns = pd.Timedelta(window).value
+
+    # Prefix sums with a leading zero: the sum over rows [i, j) is cums[j] - cums[i]
+    sums = {}
+    counts = {}
+    for col in value_cols:
+        values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums[col] = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+        counts[col] = np.concatenate(([0], np.cumsum(valid)))
+
+    groups = df.groupby(group_cols, sort=False).indices
+    blocks = []
+    for key, positions in groups.items():
+        first, last = positions[0], positions[-1] + 1  # Rows of a group are contiguous after the sort
+        group_times = timestamps[first:last]
+        right = first + np.searchsorted(group_times, eval_ns, side='right')
+        left = first + np.searchsorted(group_times, eval_ns - window_ns, side='right')
+
+        block = {}
+        key = key if isinstance(key, tuple) else (key,)
+        for col, value in zip(group_cols, key):
+            block[col] = [value] * len(eval_ns)
+        block['date'] = eval_times.strftime('%Y-%m-%dT%H:%M:%SZ')
+        for col in value_cols:
+            n = counts[col][right] - counts[col][left]
+            total = sums[col][right] - sums[col][left]
+            block[col] = np.divide(total, n, out=np.full(len(eval_ns), np.nan), where=n > 0)
+        blocks.append(pd.DataFrame(block))
+
+    return pd.concat(blocks, ignore_index=True)[columns]
+
 @app.route('/getdata')
 def index():
     variables = request.args.getlist('variables') or selected_cols
@@ -174,7 +224,8 @@ def data():
     end_datetime = pd.to_datetime(f"{end_date}T{end_time}").tz_localize('UTC')
 
     if aggregation_method == 'average':
-        query_start = start_datetime - pd.Timedelta(hours=1, minutes=59, seconds=59)
+        window = _get_window(step_number, step_option)
+        query_start = start_datetime - window
         step = '1m'
     else:
         query_start = start_datetime
@@ -216,22 +267,8 @@ def data():
 
         if aggregation_method == 'average':
             obs['date'] = pd.to_datetime(obs['date'], utc=True)
-            obs.set_index(['station', 'date'], inplace=True)
-
-            obs = obs.apply(pd.to_numeric, errors='coerce')
-            hourly_obs = []
-
-            for station, group in obs.groupby('station'):
-                current_time = start_datetime
-                while current_time <= end_datetime:
-                    mask = (group.index.get_level_values('date') > (current_time - pd.Timedelta(hours=1))) & (group.index.get_level_values('date') <= current_time)
-                    hourly_avg = group.loc[mask].mean()
-                    hourly_avg['station'] = station
-                    hourly_avg['date'] = current_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-                    hourly_obs.append(hourly_avg)
-                    current_time += pd.Timedelta(hours=1)
-
-            obs = pd.DataFrame(hourly_obs).reset_index(drop=True)
+            obs = trailing_window_mean(obs, ['station', 'metric_name'], ['value'],
+                                       start_datetime, end_datetime, window)
 
         total_records = obs.shape[0]
         json_data = obs.to_dict(orient='records')
@@ -6,58 +6,97 @@ import os
 import zipfile
 import time
 import tempfile
+import shutil
 from werkzeug.utils import secure_filename
 import logging
 from collections import defaultdict
 from datetime import timedelta
 import csv
+import math
+from array import array
 
 # Constants
 selected_cols = [
     "PM25", "PM25raw", "PM1", "Humidity", "Temperature",
 ]
+STEP_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
 
 # Flask application
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
 
-def process_chunk_data(data, selected_cols):
-    """Process raw API data without using pandas"""
-    processed_data = defaultdict(list)
+def _get_step(number, choice):
+    # convert word to code
+    options = {
+        "seconds": "s",
+        "minutes": "m",
+        "hours": "h",
+        "days": "d",
+        "weeks": "w",
+        "years": "y",
+    }
     
+    # construct expression for step
+    step = f"{number}{options[choice]}"
+
+    return step
+
+def _step_seconds(step):
+    # Inverse of _get_step: "15m" -> 900.0
+    return float(step[:-1]) * STEP_UNIT_SECONDS[step[-1]]
+
+def process_chunk_data(data, selected_cols, start_time, end_time, step):
+    """Process raw API data without using pandas.
+
+    Prometheus returns samples aligned to start + k*step, so each sample is indexed into an
+    integer slot and stored in a dense array('d') matrix (slot x column) per station; NaN marks
+    an empty cell. Dates are formatted once per occupied slot instead of once per sample.
+    """
+    step_seconds = _step_seconds(step)
+    start_ts = start_time.replace(tzinfo=datetime.timezone.utc).timestamp()
+    n_slots = int((end_time - start_time).total_seconds() // step_seconds) + 1
+    n_cols = len(selected_cols)
+    col_index = {col: i for i, col in enumerate(selected_cols)}
+    
+    # station -> (cells, present); stations keep their first-appearance order
+    matrices = {}
     for result in data['data']['result']:
-        station = result.get('metric', {}).get('exported_job', 'unknown_station')
-        metric_name = result.get('metric', {}).get('__name__')
-        
-        if metric_name not in selected_cols:
+        metric = result.get('metric', {})
+        col = col_index.get(metric.get('__name__'))
+        if col is None:
             continue
-            
+        station = metric.get('exported_job', 'unknown_station')
+        
+        if station not in matrices:
+            matrices[station] = (array('d', [math.nan]) * (n_slots * n_cols), bytearray(n_slots))
+        cells, present = matrices[station]
+        
         for timestamp, value in result.get('values', []):
-            date = datetime.datetime.utcfromtimestamp(timestamp).isoformat()
+            slot = round((timestamp - start_ts) / step_seconds)
+            if not 0 <= slot < n_slots:
+                continue
             try:
                 value = float(value)
             except (ValueError, TypeError):
-                value = None
-                
-            record = {
-                'date': date,
-                metric_name: value
-            }
-            processed_data[station].append((date, metric_name, value))
-    
-    # Consolidate measurements for same timestamps
-    consolidated_data = defaultdict(lambda: defaultdict(dict))
-    for station, measurements in processed_data.items():
-        for date, metric, value in measurements:
-            consolidated_data[station][date][metric] = value
+                value = math.nan
+            cells[slot * n_cols + col] = value
+            present[slot] = 1
     
-    # Convert to list format
+    # Convert to list format, one record per station and occupied slot in time order
+    slot_dates = [None] * n_slots
     final_data = []
-    for station, dates in consolidated_data.items():
-        for date, metrics in dates.items():
+    for station, (cells, present) in matrices.items():
+        for slot, occupied in enumerate(present):
+            if not occupied:
+                continue
+            date = slot_dates[slot]
+            if date is None:
+                date = slot_dates[slot] = (start_time + timedelta(seconds=slot * step_seconds)).isoformat()
             record = {'station': station, 'date': date}
-            for col in selected_cols:
-                record[col] = metrics.get(col)
+            base = slot * n_cols
+            for i, col in enumerate(selected_cols):
+                value = cells[base + i]
+                record[col] = None if value != value else value
             final_data.append(record)
     
     return final_data
@@ -70,14 +109,27 @@ def get_data_chunk(url, selected_cols, start_time, end_time, step):
     response.raise_for_status()
     data = response.json()
     
-    return process_chunk_data(data, selected_cols)
+    return process_chunk_data(data, selected_cols, start_time, end_time, step)
 
-def save_chunk_to_file(data, chunk_num, format_type, temp_dir):
+def save_chunk_to_file(data, chunk_num, format_type, temp_dir, spools=None):
     if format_type == "json":
-        filename = f"chunk_{chunk_num}.json"
-        filepath = os.path.join(temp_dir, filename)
-        with open(filepath, 'w') as f:
-            json.dump(data, f)
+        # Append each station's records to its own spool file (station -> path in spools, in
+        # first-appearance order) so the final JSON is assembled without reloading every chunk
+        station_records = defaultdict(list)
+        for record in data:
+            station = record.pop('station')
+            station_records[station].append(json.dumps(record))
+        for station, records in station_records.items():
+            filepath = spools.get(station)
+            separator = ', '
+            if filepath is None:
+                filepath = os.path.join(temp_dir, f"station_{len(spools)}.json")
+                spools[station] = filepath
+                separator = ''
+            with open(filepath, 'a') as f:
+                f.write(separator)
+                f.write(', '.join(records))
+        return None
     else:  # xlsx (using csv as intermediate format)
         filename = f"chunk_{chunk_num}.csv"
         filepath = os.path.join(temp_dir, filename)
@@ -88,26 +140,23 @@ def save_chunk_to_file(data, chunk_num, format_type, temp_dir):
                 writer.writerows(data)
     return filepath
 
-def create_final_file(temp_files, format_type, temp_dir):
+def create_final_file(temp_files, format_type, temp_dir, spools=None):
     if format_type == "json":
-        # Combine JSON files
-        combined_data = defaultdict(list)
-        for temp_file in temp_files:
-            with open(temp_file, 'r') as f:
-                chunk_data = json.load(f)
-                for record in chunk_data:
-                    combined_data[record['station']].append({
-                        k: v for k, v in record.items() if k != 'station'
-                    })
-        
-        final_json_path = os.path.join(temp_dir, 'final_data.json')
-        with open(final_json_path, 'w') as f:
-            json.dump(dict(combined_data), f)
-        
-        # Create ZIP file
+        # Write the station-grouped JSON straight into the ZIP member, one spool at a time,
+        # so memory stays bounded by the copy buffer instead of the whole dataset
         zip_path = os.path.join(temp_dir, 'dataresult.zip')
         with zipfile.ZipFile(zip_path, 'w') as zipf:
-            zipf.write(final_json_path, 'dataresult.json')
+            # El tamaño no se conoce de antemano: ZIP64 desde el inicio para miembros de más de 2 GiB
+            with zipf.open('dataresult.json', 'w', force_zip64=True) as out:
+                out.write(b'{')
+                for i, (station, spool_path) in enumerate(spools.items()):
+                    if i:
+                        out.write(b', ')
+                    out.write(f"{json.dumps(station)}: [".encode())
+                    with open(spool_path, 'rb') as spool:
+                        shutil.copyfileobj(spool, out)
+                    out.write(b']')
+                out.write(b'}')
         
         return zip_path
     
@@ -217,6 +266,7 @@ def data():
         
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_files = []
+            spools = {}
             
             if time_difference.days > 7:
                 # Process in 7-day chunks
@@ -231,17 +281,18 @@ def data():
                     
                     # Save chunk to temporary file
                     format_type = "json" if result_format == "filejson" else "xlsx"
-                    temp_file = save_chunk_to_file(chunk_data, chunk_num, format_type, temp_dir)
-                    temp_files.append(temp_file)
+                    temp_file = save_chunk_to_file(chunk_data, chunk_num, format_type, temp_dir, spools)
+                    if temp_file:
+                        temp_files.append(temp_file)
                     
                     current_start = chunk_end
                     chunk_num += 1
                 
                 # Create final file
-                final_path = create_final_file(temp_files, format_type, temp_dir)
+                final_path = create_final_file(temp_files, format_type, temp_dir, spools)
                 
-                # Clean up temporary chunk files
-                for temp_file in temp_files:
+                # Clean up temporary chunk and station spool files
+                for temp_file in temp_files + list(spools.values()):
                     try:
                         os.remove(temp_file)
                     except Exception as e:
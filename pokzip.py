@@ -11,79 +11,128 @@ import tempfile
 from werkzeug.utils import secure_filename
 import logging
 from io import StringIO
+import itertools
+from collections import deque
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Constants
 selected_cols = [
     "PM25", "PM25raw", "PM1", "Humidity", "Temperature",
 ]
 
+# Prometheus (bench_export_vm.py lo apunta a un servidor local de prueba)
+PROM_BASE_URL = "http://sensor.aireciudadano.com:30000/api/v1"
+
+# Descargas simultáneas (hilos) y procesos para decodificar y pivotear cada respuesta.
+# Con un solo núcleo no hay pool de procesos: se decodifica en el hilo de la petición
+FETCH_WORKERS = 8
+DECODE_WORKERS = os.cpu_count() or 1
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
 # Flask application
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG) 
 
-# Get data from API with time intervals
-def get_data(url, selected_cols, start_datetime, end_datetime, step, interval_seconds):
-    def data_generator():
-        current_start_time = start_datetime
-        while current_start_time < end_datetime:
-            current_end_time = min(current_start_time + datetime.timedelta(seconds=interval_seconds), end_datetime)
-            query_url = f"{url}&start={current_start_time.isoformat()}Z&end={current_end_time.isoformat()}Z&step={step}"
-
-            app.logger.debug(f"Fetching data from: {query_url}")
-
-            try:
-                response = requests.get(query_url, timeout=30)
-                response.raise_for_status()
-                data = response.json()['data']['result']
-                df = pd.json_normalize(data)
-
-                # Log the columns we received
-                app.logger.debug(f"Data fetched. Shape: {df.shape}")
-
-                if 'values' in df.columns:
-                    df = df.explode('values')
-                    df['date'] = df['values'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat())
-                    df['value'] = df['values'].apply(lambda x: x[1])
-                    df = df.drop(columns="values")
-                elif 'value' in df.columns:
-                    df['date'] = df['value'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat())
-                    df['value'] = df['value'].apply(lambda x: x[1])
-
-                # Rename columns, but check if they exist first
-                rename_dict = {
-                    "metric.__name__": "metric_name",
-                    "metric.exported_job": "station",
-                }
-                df = df.rename(columns={k: v for k, v in rename_dict.items() if k in df.columns})
-
-                # Drop columns containing 'metric.' only if they exist
-                df = df.drop(columns=[col for col in df.columns if 'metric.' in col], errors='ignore')
-
-                # Only filter for non-null 'station' if the column exists
-                if 'station' in df.columns:
-                    df = df[df['station'].notnull()]
-                else:
-                    app.logger.warning("'station' column not found in the data")
+# Descarga (hilos) y decodificación + pivot (pool de procesos) de un intervalo
+def _fetch_interval(query_url):
+    app.logger.debug(f"Fetching data from: {query_url}")
+    response = requests.get(query_url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+def _decode_interval(content, selected_cols):
+    data = json.loads(content)['data']['result']
+    df = pd.json_normalize(data)
+
+    # Log the columns we received
+    app.logger.debug(f"Data fetched. Shape: {df.shape}")
+
+    if 'values' in df.columns:
+        df = df.explode('values')
+        df['date'] = df['values'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat())
+        df['value'] = df['values'].apply(lambda x: x[1])
+        df = df.drop(columns="values")
+    elif 'value' in df.columns:
+        df['date'] = df['value'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat())
+        df['value'] = df['value'].apply(lambda x: x[1])
+
+    # Rename columns, but check if they exist first
+    rename_dict = {
+        "metric.__name__": "metric_name",
+        "metric.exported_job": "station",
+    }
+    df = df.rename(columns={k: v for k, v in rename_dict.items() if k in df.columns})
+
+    # Drop columns containing 'metric.' only if they exist
+    df = df.drop(columns=[col for col in df.columns if 'metric.' in col], errors='ignore')
+
+    # Only filter for non-null 'station' if the column exists
+    if 'station' in df.columns:
+        df = df[df['station'].notnull()]
+    else:
+        app.logger.warning("'station' column not found in the data")
 
-                df_result = _wide_table(df, selected_cols)
+    df_result = _wide_table(df, selected_cols)
 
-                for col in selected_cols:
-                    if col in df_result.columns:
-                        df_result[col] = df_result[col].astype(float)
-                if 'Latitude' in df_result.columns:
-                    df_result['Latitude'].replace(0, np.nan, inplace=True)
-                if 'Longitude' in df_result.columns:
-                    df_result['Longitude'].replace(0, np.nan, inplace=True)
+    for col in selected_cols:
+        if col in df_result.columns:
+            df_result[col] = df_result[col].astype(float)
+    for col in ('Latitude', 'Longitude'):
+        if col in df_result.columns:
+            df_result[col] = df_result[col].replace(0, np.nan)
 
-                yield df_result
+    return df_result
 
-            except Exception as e:
-                app.logger.error(f'Error fetching data chunk: {str(e)}')
-                raise
+def _get_decode_pool():
+    # Se crea desde un hilo de Flask: con fork los hijos podrían heredar locks tomados por otros hilos
+    # (p. ej. el de logging), así que los procesos salen de un forkserver limpio
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None and DECODE_WORKERS > 1:
+            _decode_pool = ProcessPoolExecutor(max_workers=DECODE_WORKERS,
+                                               mp_context=multiprocessing.get_context('forkserver'))
+    return _decode_pool
 
-            current_start_time = current_end_time
+# Get data from API with time intervals
+def get_data(url, selected_cols, start_datetime, end_datetime, step, interval_seconds):
+    query_urls = []
+    current_start_time = start_datetime
+    while current_start_time < end_datetime:
+        current_end_time = min(current_start_time + datetime.timedelta(seconds=interval_seconds), end_datetime)
+        query_urls.append(f"{url}&start={current_start_time.isoformat()}Z&end={current_end_time.isoformat()}Z&step={step}")
+        current_start_time = current_end_time
+
+    # Los hilos descargan por adelantado (como mucho FETCH_WORKERS respuestas en vuelo) mientras cada respuesta,
+    # en el orden de los intervalos, se decodifica en el pool de procesos o aquí mismo si no hay pool
+    decode_pool = _get_decode_pool()
+    pending_urls = iter(query_urls)
+    chunks = []
+    try:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as fetch_pool:
+            fetches = deque(fetch_pool.submit(_fetch_interval, query_url)
+                            for query_url in itertools.islice(pending_urls, FETCH_WORKERS))
+            decodes = deque()
+            while fetches:
+                content = fetches.popleft().result()
+                next_url = next(pending_urls, None)
+                if next_url is not None:
+                    fetches.append(fetch_pool.submit(_fetch_interval, next_url))
+
+                if decode_pool is None:
+                    chunks.append(_decode_interval(content, selected_cols))
+                    continue
+                decodes.append(decode_pool.submit(_decode_interval, content, selected_cols))
+                while len(decodes) > DECODE_WORKERS:
+                    chunks.append(decodes.popleft().result())
+            chunks.extend(decode.result() for decode in decodes)
+    except Exception as e:
+        app.logger.error(f'Error fetching data chunk: {str(e)}')
+        raise
 
-    return pd.concat(data_generator(), ignore_index=True).drop_duplicates(subset=['date', 'station'])
+    return pd.concat(chunks, ignore_index=True).drop_duplicates(subset=['date', 'station'])
 
 # Function to get wide table
 def _wide_table(df, selected_cols):
@@ -198,7 +247,7 @@ def index():
 @app.route('/dataresult', methods=['POST'])
 def data():
     variables = request.form.getlist('variables')
-    base_url = "http://sensor.aireciudadano.com:30000/api/v1"
+    base_url = PROM_BASE_URL
     query = '{job%3D"pushgateway"}'
 
     start_date = request.form['start_date']
@@ -1,10 +1,8 @@
 from flask import Flask, request, jsonify, render_template_string, send_file
 import requests
-import dask
 import datetime
 from datetime import timedelta  # Importación directa de datetime y timedelta
 import pandas as pd
-import dask.dataframe as dd
 import numpy as np
 import json
 import os
@@ -14,91 +12,124 @@ import tempfile
 from werkzeug.utils import secure_filename
 import logging
 from io import StringIO
-
-# Deshabilitar PyArrow para evitar el error con `StringDtype`
-dask.config.set({"dataframe.convert-string": False})
+import itertools
+from collections import deque
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Constants
 selected_cols = [
     "PM25", "PM25raw", "PM1", "Humidity", "Temperature",
 ]
 
+# Prometheus (bench_export_vm.py lo apunta a un servidor local de prueba)
+PROM_BASE_URL = "http://sensor.aireciudadano.com:30000/api/v1"
+
+# Descargas simultáneas (hilos) y procesos para decodificar y pivotear cada respuesta.
+# Con un solo núcleo no hay pool de procesos: se decodifica en el hilo de la petición
+FETCH_WORKERS = 8
+DECODE_WORKERS = os.cpu_count() or 1
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
 # Flask application
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG) 
 
-# Get data from API with time intervals
-def get_data(url, selected_cols, start_datetime, end_datetime, step, interval_seconds):
-    def data_generator():
-        current_start_time = start_datetime
-        while current_start_time < end_datetime:
-            current_end_time = min(current_start_time + datetime.timedelta(seconds=interval_seconds), end_datetime)
-            query_url = f"{url}&start={current_start_time.isoformat()}Z&end={current_end_time.isoformat()}Z&step={step}"
-
-            app.logger.debug(f"Fetching data from: {query_url}")
-
-            try:
-                response = requests.get(query_url, timeout=30)
-                response.raise_for_status()
-                data = response.json()['data']['result']
-                df = dd.from_pandas(pd.json_normalize(data), npartitions=4)
-
-                app.logger.debug(f"Data fetched. Shape: {df.shape}")
-
-                if 'values' in df.columns:
-                    # Conviértelo temporalmente a Pandas solo para ejecutar explode
-                    df = df.map_partitions(lambda df: df.explode('values'), meta=df)  # Usar `map_partitions` para trabajar con Pandas dentro de Dask
-                    df['date'] = df['values'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat(), meta=('date', str))
-                    df['value'] = df['values'].apply(lambda x: x[1], meta=('value', float))
-                    df = df.drop(columns="values")
-                elif 'value' in df.columns:
-                    df['date'] = df['value'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat(), meta=('date', str))
-                    df['value'] = df['value'].apply(lambda x: x[1], meta=('value', float))
-
-                rename_dict = {
-                    "metric.__name__": "metric_name",
-                    "metric.exported_job": "station",
-                }
-                df = df.rename(columns={k: v for k, v in rename_dict.items() if k in df.columns})
-
-                df = df.drop(columns=[col for col in df.columns if 'metric.' in col], errors='ignore')
-
-                if 'station' in df.columns:
-                    df = df[df['station'].notnull()]
-                else:
-                    app.logger.warning("'station' column not found in the data")
-
-                df_result = _wide_table(df, selected_cols)
-
-                for col in selected_cols:
-                    if col in df_result.columns:
-                        df_result[col] = df_result[col].astype(float)
-                if 'Latitude' in df_result.columns:
-                    df_result['Latitude'].replace(0, np.nan, inplace=True)
-                if 'Longitude' in df_result.columns:
-                    df_result['Longitude'].replace(0, np.nan, inplace=True)
+# Descarga (hilos) y decodificación + pivot (pool de procesos) de un intervalo
+def _fetch_interval(query_url):
+    app.logger.debug(f"Fetching data from: {query_url}")
+    response = requests.get(query_url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+def _decode_interval(content, selected_cols):
+    data = json.loads(content)['data']['result']
+    df = pd.json_normalize(data)
+
+    app.logger.debug(f"Data fetched. Shape: {df.shape}")
+
+    if 'values' in df.columns:
+        df = df.explode('values')
+        df['date'] = df['values'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat())
+        df['value'] = df['values'].apply(lambda x: x[1])
+        df = df.drop(columns="values")
+    elif 'value' in df.columns:
+        df['date'] = df['value'].apply(lambda x: datetime.datetime.utcfromtimestamp(x[0]).isoformat())
+        df['value'] = df['value'].apply(lambda x: x[1])
+
+    rename_dict = {
+        "metric.__name__": "metric_name",
+        "metric.exported_job": "station",
+    }
+    df = df.rename(columns={k: v for k, v in rename_dict.items() if k in df.columns})
+
+    df = df.drop(columns=[col for col in df.columns if 'metric.' in col], errors='ignore')
+
+    if 'station' in df.columns:
+        df = df[df['station'].notnull()]
+    else:
+        app.logger.warning("'station' column not found in the data")
 
-                yield df_result.compute()
+    df_result = _wide_table(df, selected_cols)
 
-            except Exception as e:
-                app.logger.error(f'Error fetching data chunk: {str(e)}')
-                raise
+    for col in selected_cols:
+        if col in df_result.columns:
+            df_result[col] = df_result[col].astype(float)
+    for col in ('Latitude', 'Longitude'):
+        if col in df_result.columns:
+            df_result[col] = df_result[col].replace(0, np.nan)
 
-            current_start_time = current_end_time
+    return df_result
 
-    return dd.concat([df for df in data_generator()]).drop_duplicates(subset=['date', 'station']).compute()
+def _get_decode_pool():
+    # Se crea desde un hilo de Flask: con fork los hijos podrían heredar locks tomados por otros hilos
+    # (p. ej. el de logging), así que los procesos salen de un forkserver limpio
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None and DECODE_WORKERS > 1:
+            _decode_pool = ProcessPoolExecutor(max_workers=DECODE_WORKERS,
+                                               mp_context=multiprocessing.get_context('forkserver'))
+    return _decode_pool
 
-# Mover la función fuera de _wide_table
+# Get data from API with time intervals
+def get_data(url, selected_cols, start_datetime, end_datetime, step, interval_seconds):
+    query_urls = []
+    current_start_time = start_datetime
+    while current_start_time < end_datetime:
+        current_end_time = min(current_start_time + datetime.timedelta(seconds=interval_seconds), end_datetime)
+        query_urls.append(f"{url}&start={current_start_time.isoformat()}Z&end={current_end_time.isoformat()}Z&step={step}")
+        current_start_time = current_end_time
+
+    # Los hilos descargan por adelantado (como mucho FETCH_WORKERS respuestas en vuelo) mientras cada respuesta,
+    # en el orden de los intervalos, se decodifica en el pool de procesos o aquí mismo si no hay pool
+    decode_pool = _get_decode_pool()
+    pending_urls = iter(query_urls)
+    chunks = []
+    try:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as fetch_pool:
+            fetches = deque(fetch_pool.submit(_fetch_interval, query_url)
+                            for query_url in itertools.islice(pending_urls, FETCH_WORKERS))
+            decodes = deque()
+            while fetches:
+                content = fetches.popleft().result()
+                next_url = next(pending_urls, None)
+                if next_url is not None:
+                    fetches.append(fetch_pool.submit(_fetch_interval, next_url))
+
+                if decode_pool is None:
+                    chunks.append(_decode_interval(content, selected_cols))
+                    continue
+                decodes.append(decode_pool.submit(_decode_interval, content, selected_cols))
+                while len(decodes) > DECODE_WORKERS:
+                    chunks.append(decodes.popleft().result())
+            chunks.extend(decode.result() for decode in decodes)
+    except Exception as e:
+        app.logger.error(f'Error fetching data chunk: {str(e)}')
+        raise
 
-def remove_duplicates_partition(partition):
-    """
-    Elimina duplicados en cada partición por 'station' y 'date'.
-    """
-    duplicates = partition.duplicated(subset=['station', 'date'], keep=False)
-    if duplicates.any():
-        app.logger.warning(f"Found duplicates in 'station' and 'date' columns. Removing duplicates.")
-        partition = partition.groupby(['station', 'date', 'metric_name'])['value'].mean().reset_index()
-    return partition
+    return pd.concat(chunks, ignore_index=True).drop_duplicates(subset=['date', 'station'])
 
 def _wide_table(df, selected_cols):
     try:
@@ -107,18 +138,9 @@ def _wide_table(df, selected_cols):
             app.logger.warning("'station' column not found, using 'unknown_station' as default")
 
         # Convertimos el tipo de 'value' a numérico
-        df['value'] = dd.to_numeric(df['value'], errors='coerce')
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
 
-        # Forzar todas las columnas de texto a `object` antes de cualquier operación crítica
-        for col in df.columns:
-            if pd.api.types.is_string_dtype(df[col]):
-                df[col] = df[col].astype('object')
-
-        # Eliminar duplicados en cada partición usando la función global
-        df = df.map_partitions(remove_duplicates_partition)
-
-        # Convertir a Pandas temporalmente para usar pivot_table
-        df = df.compute()  # Consolidamos el DataFrame en un solo DataFrame de Pandas
+        # pivot_table promedia los datos repetidos de una estación en la misma fecha
         df_result = df.pivot_table(index=['station', 'date'], columns='metric_name', values='value').reset_index()
 
         all_cols = ['station', 'date'] + selected_cols
@@ -126,8 +148,7 @@ def _wide_table(df, selected_cols):
         for col in missing_cols:
             df_result[col] = np.nan
 
-        # Convertir de vuelta a Dask para procesar en paralelo si es necesario
-        df_result = dd.from_pandas(df_result[all_cols], npartitions=4)
+        df_result = df_result[all_cols].reset_index(drop=True)
         df_result.columns.name = ""
         return df_result
 
@@ -214,7 +235,7 @@ def index():
 @app.route('/dataresult', methods=['POST'])
 def data():
     variables = request.form.getlist('variables')
-    base_url = "http://sensor.aireciudadano.com:30000/api/v1"
+    base_url = PROM_BASE_URL
     query = '{job%3D"pushgateway"}'
 
     start_date = request.form['start_date']
@@ -256,23 +277,17 @@ def data():
                 block_data = get_data(url, variables, current_start, current_end, step, interval_seconds)
 
                 if aggregation_method == 'step':
-                    # Convertir la columna 'date' a datetime en paralelo
-                    block_data['date'] = dd.to_datetime(block_data['date'], utc=True)
-                    
-                    # Aplicar las máscaras en paralelo
+                    block_data['date'] = pd.to_datetime(block_data['date'], utc=True)
                     mask_start = block_data['date'] == pd.to_datetime(current_start, utc=True)
                     mask_step = (block_data['date'] > pd.to_datetime(current_start, utc=True)) & (block_data['date'] <= pd.to_datetime(current_end, utc=True))
                     
-                    # Filtrar los datos usando las máscaras generadas
                     block_data = block_data[mask_start | mask_step]
 
                 elif aggregation_method == 'average':
                     # Convertir la columna 'date' a datetime y establecer un índice compuesto
-                    block_data['date'] = dd.to_datetime(block_data['date'], utc=True)
+                    block_data['date'] = pd.to_datetime(block_data['date'], utc=True)
                     block_data = block_data.set_index(['station', 'date'])
-
-                    # Convertir valores a numérico en cada partición usando `map_partitions`
-                    block_data = block_data.map_partitions(lambda df: df.apply(pd.to_numeric, errors='coerce'))
+                    block_data = block_data.apply(pd.to_numeric, errors='coerce')
 
                     hourly_obs = []
 
@@ -284,7 +299,7 @@ def data():
                             (block_data.index.get_level_values('date') <= current_time)
                         
                         # Calcular el promedio de cada estación en el rango de tiempo
-                        hourly_avg = block_data.loc[mask].groupby('station').mean().compute()
+                        hourly_avg = block_data.loc[mask].groupby('station').mean()
                         hourly_avg['station'] = hourly_avg.index
                         hourly_avg['date'] = current_time.strftime('%Y-%m-%dT%H:%M:%SZ')
                         
@@ -294,15 +309,15 @@ def data():
                         # Incrementar el tiempo para la siguiente iteración
                         current_time += timedelta(hours=1)
 
-                    # Convertir la lista de resultados en un DataFrame de Dask
-                    block_data = dd.from_pandas(pd.DataFrame(hourly_obs), npartitions=4)
+                    # Unir los promedios de cada hora del bloque
+                    block_data = pd.concat(hourly_obs, ignore_index=True)
 
                 # Agregar el bloque de datos procesado a la lista de bloques
                 data_blocks.append(block_data)
                 current_start = current_end
 
-            # Concatenar todos los bloques de datos en un solo DataFrame de Dask
-            obs = dd.concat(data_blocks, ignore_index=True).compute()
+            # Concatenar todos los bloques de datos
+            obs = pd.concat(data_blocks, ignore_index=True)
         else:
             # Procesar los datos normalmente si el rango es menor o igual a 15 días
             if aggregation_method == 'average':
@@ -319,12 +334,12 @@ def data():
             obs = obs[obs['station'].str.contains('|'.join(filters), case=False)]
 
         if aggregation_method == 'step':
-            obs['date'] = dd.to_datetime(obs['date'], utc=True)
+            obs['date'] = pd.to_datetime(obs['date'], utc=True)
             mask_start = obs['date'] == pd.to_datetime(start_datetime, utc=True)
             mask_step = (obs['date'] > pd.to_datetime(start_datetime, utc=True)) & (obs['date'] <= pd.to_datetime(end_datetime, utc=True))
             obs = obs[mask_start | mask_step]
         elif aggregation_method == 'average':
-            obs['date'] = dd.to_datetime(obs['date'], utc=True)
+            obs['date'] = pd.to_datetime(obs['date'], utc=True)
             obs = obs.set_index(['station', 'date'])
 
             hourly_obs = []
@@ -341,10 +356,7 @@ def data():
                     hourly_obs.append(hourly_avg)
                     current_time += pd.Timedelta(hours=1)
 
-            obs = dd.from_pandas(pd.DataFrame(hourly_obs), npartitions=4)
-
-        if isinstance(obs, dd.DataFrame):
-            obs = obs.compute()  # Consolidar el Dask DataFrame a Pandas
+            obs = pd.DataFrame(hourly_obs)
 
         # Ordenar el DataFrame por las columnas 'station' y 'date' para mantener el orden cronológico
         obs = obs.sort_values(by=['station', 'date']).reset_index(drop=True)
@@ -412,7 +424,7 @@ def data():
                 zip_path = os.path.join(temp_dir, zip_filename)
 
                 # Convertir a CSV
-                obs.to_csv(csv_path, index=False)  # Ya es Pandas, así que no necesita `compute()`
+                obs.to_csv(csv_path, index=False)
 
                 # Comprimir archivo CSV a ZIP
                 with zipfile.ZipFile(zip_path, 'w') as zipf:
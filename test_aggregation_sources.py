@@ -0,0 +1,117 @@
+import datetime
+import re
+
+import numpy as np
+import pytest
+
+video = pytest.importorskip("APIdatavideo_26nov2024")
+
+STATIONS = ["st_a", "st_b"]
+METRICS = ["PM25", "Humidity"]
+LOOKBACK = 300  # Prometheus devuelve la última muestra de los 5 minutos anteriores
+
+
+def scrape_times(station_index):
+    # Muestras a deshora: segundo variable, minutos con dos muestras y huecos de más de 5 minutos
+    start = datetime.datetime(2024, 5, 9, tzinfo=datetime.timezone.utc).timestamp()
+    times = []
+    for minute in range(3 * 24 * 60):
+        if (minute // 97 + station_index) % 9 == 0 and minute % 97 < 8:
+            continue
+        times.append(start + minute * 60 + (17 + 13 * minute) % 43)
+        if minute % 5 == station_index:
+            times.append(start + minute * 60 + 51)
+    return np.array(times)
+
+
+SAMPLES = {}
+for si, station in enumerate(STATIONS):
+    times = scrape_times(si)
+    for mi, metric in enumerate(METRICS):
+        SAMPLES[station, metric] = (times, (times // 7 * (mi + 3) + si * 11) % 97 + 0.5)
+
+
+def instant(station, metric, t):
+    times, values = SAMPLES[station, metric]
+    i = np.searchsorted(times, t, side="right") - 1
+    return values[i] if i >= 0 and times[i] > t - LOOKBACK else None
+
+
+def timestamp(text):
+    return datetime.datetime.fromisoformat(text.replace("Z", "")).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def step_seconds(text):
+    return int(text[:-1]) * (60 if text.endswith("m") else 1)
+
+
+class FakeResponse:
+    def __init__(self, result):
+        self.result = result
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"data": {"result": self.result}}
+
+
+def fake_get(url, params=None, timeout=None):
+    if params is None:
+        # Ruta por minuto: query_range con step=1m de todas las métricas
+        args = dict(part.split("=", 1) for part in url.split("?", 1)[1].split("&"))
+        times = np.arange(timestamp(args["start"]), timestamp(args["end"]) + 1, step_seconds(args["step"]))
+        result = []
+        for station in STATIONS:
+            for metric in METRICS:
+                values = [[t, str(v)] for t in times if (v := instant(station, metric, t)) is not None]
+                if values:
+                    result.append({"metric": {"__name__": metric, "exported_job": station}, "values": values})
+        return FakeResponse(result)
+
+    # Rollup: f(selector[ventana:1m] offset 1ms) evaluado en cada paso
+    match = re.fullmatch(r'(\w+)\((?:([\d.]+), )?\{__name__="(\w+)",job="pushgateway"\}\[(\d+)s:1m\] offset 1ms\)',
+                         params["query"])
+    function, quantile, metric, window = match.group(1), match.group(2), match.group(3), int(match.group(4))
+    functions = {
+        "avg_over_time": np.mean, "min_over_time": np.min, "max_over_time": np.max, "count_over_time": len,
+        "quantile_over_time": lambda values: np.quantile(values, float(quantile)),
+    }
+    result = []
+    for station in STATIONS:
+        points = []
+        for t in np.arange(timestamp(params["start"]), timestamp(params["end"]) + 1, step_seconds(params["step"])):
+            # Pasos de la subconsulta: múltiplos de 1m en (t - 1ms - ventana, t - 1ms]
+            steps = np.arange(np.floor((t - 0.001) / 60) * 60, t - 0.001 - window, -60)
+            values = [v for v in (instant(station, metric, s) for s in steps) if v is not None]
+            if values:
+                points.append([t, str(float(functions[function](np.array(values))))])
+        if points:
+            result.append({"metric": {"exported_job": station}, "values": points})
+    return FakeResponse(result)
+
+
+@pytest.mark.parametrize("start, end, interval_minutes", [
+    ("2024-05-09T13:00", "2024-05-10T10:00", 60),
+    ("2024-05-09T13:20", "2024-05-09T18:40", 60),
+    ("2024-05-09T05:10", "2024-05-10T22:00", 90),
+    ("2024-05-09T08:00", "2024-05-11T10:30", 1440),
+])
+def test_rollup_and_raw_sources_agree(monkeypatch, start, end, interval_minutes):
+    monkeypatch.setattr(video.requests, "get", fake_get)
+    start, end = datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end)
+    stats = video.AGGREGATION_STATS
+
+    raw = video.get_data("http://prometheus/api/v1/query_range?query=q", METRICS, start, end, "1m")
+    raw = video.bucketed_stats(raw, interval_minutes, stats=stats)
+    rollup = video.get_rollup_data("http://prometheus/api/v1", METRICS, stats, start, end, interval_minutes)
+
+    # Prometheus no devuelve intervalos vacíos; bucketed_stats sí (con count 0)
+    raw = raw[raw[[video.stat_column(col, "count") for col in METRICS]].sum(axis=1) > 0]
+    merged = raw.merge(rollup, on=["station", "date"], how="outer", suffixes=("_raw", "_rollup"), indicator=True)
+    assert (merged["_merge"] == "both").all()
+    for col in METRICS:
+        for stat in stats:
+            name = video.stat_column(col, stat)
+            np.testing.assert_allclose(merged[f"{name}_rollup"].astype(float), merged[f"{name}_raw"].astype(float),
+                                       rtol=1e-9, err_msg=name)
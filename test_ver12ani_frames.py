@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+ver12ani = pytest.importorskip("ver12ani_26nov2024")
+
+EXTENT = (-75.0, -73.0, 4.0, 5.0)
+
+
+def animation_frame(unit):
+    # Dos estaciones en dos fechas, con la columna date en la unidad que dejan los cargadores
+    dates = pd.to_datetime(["2024-11-26 10:00", "2024-11-26 11:00"]).as_unit(unit)
+    return pd.DataFrame({
+        "date": np.repeat(dates, 2),
+        "station": ["a", "b", "a", "b"],
+        "PM25": [10.0, 20.0, 30.0, 40.0],
+        "Latitude": [4.6, 4.7, 4.6, 4.7],
+        "Longitude": [-74.1, -74.0, -74.1, -74.0],
+        "InOut": [0.0, 0.0, 0.0, 0.0],
+    })
+
+
+@pytest.mark.parametrize("unit", ["s", "us", "ns"])
+def test_interpolated_frame_times_keep_dates(unit):
+    frames = ver12ani.prepare_interpolated_frames(animation_frame(unit), EXTENT, steps=2)
+    assert list(frames["times"].strftime("%Y-%m-%d %H:%M")) == [
+        "2024-11-26 10:00", "2024-11-26 10:30", "2024-11-26 11:00",
+    ]
+    assert list(frames["ends"] - frames["starts"]) == [2, 2, 2]
+
+
+@pytest.mark.parametrize("unit", ["s", "us"])
+def test_prepare_frames_matches_single_step_interpolation(unit):
+    df = animation_frame(unit)
+    plain = ver12ani.prepare_frames(df, EXTENT)
+    interpolated = ver12ani.prepare_interpolated_frames(df, EXTENT, steps=1)
+    assert list(plain["times"]) == list(interpolated["times"])
+    assert list(plain["starts"]) == [0, 2]
+    assert list(plain["ends"]) == [2, 4]
+
+
+def test_idw_grid_matches_dense_weights_within_radius():
+    rng = np.random.default_rng(0)
+    n = 40
+    lon = rng.uniform(-75.1, -72.9, n)
+    lat = rng.uniform(3.9, 5.1, n)
+    radius_km = 20.0
+    weights, (rows, columns) = ver12ani.idw_weights(EXTENT, lon, lat, radius_km, columns=40)
+
+    # Referencia densa: todas las celdas contra todas las estaciones
+    cell_lon = EXTENT[0] + (np.arange(columns) + 0.5) * (EXTENT[1] - EXTENT[0]) / columns
+    cell_lat = EXTENT[2] + (np.arange(rows) + 0.5) * (EXTENT[3] - EXTENT[2]) / rows
+    grid_lon, grid_lat = np.meshgrid(cell_lon, cell_lat)
+    km_per_deg_lon = 111.32 * np.cos(np.radians(0.5 * (EXTENT[2] + EXTENT[3])))
+    distance = np.hypot((grid_lon.reshape(-1, 1) - lon) * km_per_deg_lon, (grid_lat.reshape(-1, 1) - lat) * 110.57)
+    dense = np.where(distance <= radius_km, 1.0 / np.maximum(distance, 0.05) ** 2, 0.0)
+
+    pm25 = rng.uniform(0, 200, n)
+    presence = np.ones(n, dtype=np.float32)
+    grid = ver12ani.idw_grid(weights, (rows, columns), n, np.arange(n), pm25, presence)
+    with np.errstate(invalid="ignore"):
+        expected = (dense @ pm25 / dense.sum(axis=1)).reshape(rows, columns)
+    assert np.array_equal(np.isnan(grid), np.isnan(expected))
+    np.testing.assert_allclose(grid[~np.isnan(grid)], expected[~np.isnan(expected)], rtol=1e-4)
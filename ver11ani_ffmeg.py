@@ -7,11 +7,11 @@ import os
 import json
 import subprocess  # Importar para usar FFmpeg
 from flask import Flask, request, render_template_string, jsonify, send_file
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 from matplotlib import font_manager
-from matplotlib.animation import FuncAnimation, FFMpegWriter
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import contextily as ctx
@@ -24,43 +24,18 @@ OUTPUT_FOLDER = "output"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-def convert_video_to_android_compatible(input_path, output_path):
-    try:
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-loglevel", "warning",
-            "-i", input_path,
-            "-vf", "scale=-1:1440",  # Scale height to 1440p, width adjusts accordingly
-            "-c:v", "libx264",
-            "-profile:v", "baseline",
-            "-level", "3.0",
-            "-pix_fmt", "yuv420p",
-            "-b:v", "1000k",
-            "-movflags", "+faststart",
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-ar", "44100",
-            "-shortest",
-            output_path
-        ], check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        app.logger.error(f"FFmpeg error: {e}")
-        return False
-
-def pm25_to_color(pm25):
-    if pm25 < 13:
-        return "green"
-    elif 13 <= pm25 < 35:
-        return "yellow"
-    elif 35 <= pm25 < 55:
-        return "orange"
-    elif 55 <= pm25 < 150:
-        return "red"
-    elif 150 <= pm25 < 250:
-        return "purple"
-    else:
-        return "brown"
+# Escala de colores PM2.5: límite inferior de cada categoría a partir de "yellow"
+PM25_BREAKPOINTS = np.array([13, 35, 55, 150, 250])
+PM25_COLOR_NAMES = ["green", "yellow", "orange", "red", "purple", "brown"]
+PM25_RGBA = mcolors.to_rgba_array(PM25_COLOR_NAMES)
+
+# Categoría (0-5) de todos los valores PM2.5 en una sola pasada; NaN cae en "brown" igual que antes
+def pm25_category(pm25_values):
+    return np.searchsorted(PM25_BREAKPOINTS, np.asarray(pm25_values, dtype=float), side='right')
+
+# Colores RGBA (N, 4) listos para el scatter
+def pm25_to_rgba(pm25_values):
+    return PM25_RGBA[pm25_category(pm25_values)]
 
 def create_dataframe(json_data):
     records = []
@@ -93,11 +68,9 @@ def create_dataframe(json_data):
     df['date'] = pd.to_datetime(df['date'])
     return df
 
-def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alpha=1.0, zoom=10, zoom_base=12,
+# Crea la figura con las capas estáticas: mapa base, fronteras, costas y leyenda
+def setup_map_figure(size_scale=2, map_style='osm', alpha=1.0, zoom=10, zoom_base=12,
                      aspect_ratio='1:1', center_lat=4.6257, center_lon=-74.1340):
-    df = df.sort_values('date')
-    grouped = df.groupby('date')
-    sorted_df_dates = sorted(df['date'].unique())
     center = [center_lon, center_lat]
     
     # Calculate resolution and extent
@@ -207,6 +180,67 @@ def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alph
     )
     legend.get_title().set_fontproperties(bold_title_font)
 
+    return fig, ax, scatter
+
+# Dibuja una sola vez todo lo estático y guarda el fondo; el scatter y el título se dibujan aparte en cada frame
+def capture_static_background(fig, ax, scatter):
+    scatter.set_animated(True)
+    ax.title.set_animated(True)
+    fig.canvas.draw()
+    return fig.canvas.copy_from_bbox(fig.bbox)
+
+# Restaura el fondo y redibuja solo los artistas que cambian; devuelve el buffer RGBA del frame
+def render_frame(fig, ax, scatter, background, offsets, colors, title):
+    fig.canvas.restore_region(background)
+    scatter.set_offsets(offsets)
+    scatter.set_facecolor(colors)
+    scatter.set_edgecolor(colors)
+    ax.set_title(title, fontsize=24, fontweight="bold")
+    ax.draw_artist(scatter)
+    ax.draw_artist(ax.title)
+    return fig.canvas.buffer_rgba()
+
+# Proceso FFmpeg que recibe los frames crudos (RGBA) por stdin y codifica en una sola pasada
+# con la configuración final compatible con Android (antes era una segunda recodificación)
+def open_ffmpeg_pipe(output_path, width, height, fps):
+    return subprocess.Popen([
+        "ffmpeg", "-y",
+        "-loglevel", "warning",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgba",
+        "-s", f"{width}x{height}",
+        "-r", str(fps),
+        "-i", "-",
+        "-vf", "scale=-2:1440",  # Scale height to 1440p, width adjusts accordingly (and stays even)
+        "-c:v", "libx264",
+        "-profile:v", "baseline",
+        "-level", "3.0",
+        "-pix_fmt", "yuv420p",
+        "-b:v", "1000k",
+        "-movflags", "+faststart",
+        "-metadata", "artist=Me",
+        output_path
+    ], stdin=subprocess.PIPE)
+
+def close_ffmpeg_pipe(process):
+    process.stdin.close()
+    return_code = process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, "ffmpeg")
+
+def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alpha=1.0, zoom=10, zoom_base=12,
+                     aspect_ratio='1:1', center_lat=4.6257, center_lon=-74.1340):
+    df = df.sort_values('date').reset_index(drop=True)
+    grouped = df.groupby('date')
+    sorted_df_dates = sorted(df['date'].unique())
+
+    fig, ax, scatter = setup_map_figure(size_scale=size_scale, map_style=map_style, alpha=alpha, zoom=zoom,
+                                        zoom_base=zoom_base, aspect_ratio=aspect_ratio,
+                                        center_lat=center_lat, center_lon=center_lon)
+    background = capture_static_background(fig, ax, scatter)
+    colors = pm25_to_rgba(df['PM25'])
+    height, width = np.asarray(fig.canvas.buffer_rgba()).shape[:2]
+
     # Función de actualización de los frames
     def update(frame):
         current_time = sorted_df_dates[frame]
@@ -223,25 +257,24 @@ def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alph
             (data_frame['Latitude'] <= extent[3])
         ]
 
-        colors = data_frame["PM25"].apply(pm25_to_color)
-        scatter.set_offsets(data_frame[["Longitude", "Latitude"]])
-        scatter.set_facecolor(colors)
-        scatter.set_edgecolor(colors)
-        ax.set_title(f"Red AireCiudadano - {current_time.strftime('%Y-%m-%d %H:%M:%S')}", fontsize=24, fontweight="bold")
+        frame_colors = colors[data_frame.index.to_numpy()]
+        title = f"Red AireCiudadano - {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
+        return render_frame(fig, ax, scatter, background, data_frame[["Longitude", "Latitude"]], frame_colors, title)
 
     total_frames = len(df['date'].unique())
     extra_time_frames = int(max(2 / fps, 2))
     total_frames_with_extra = total_frames + extra_time_frames
 
-    def extended_update(frame):
-        if frame < total_frames:
-            update(frame)
-        else:
-            update(total_frames - 1)
-
-    ani = FuncAnimation(fig, extended_update, frames=total_frames_with_extra, repeat=False, blit=False)
-    writer = FFMpegWriter(fps=fps, metadata=dict(artist='Me'), bitrate=1800)
-    ani.save(output_path, writer=writer)
+    process = open_ffmpeg_pipe(output_path, width, height, fps)
+    try:
+        for frame in range(total_frames_with_extra):
+            # Los frames extra repiten el último frame ya dibujado en el buffer
+            if frame < total_frames:
+                frame_buffer = update(frame)
+            process.stdin.write(frame_buffer)
+    finally:
+        close_ffmpeg_pipe(process)
+        plt.close(fig)
 
 @app.route('/getdata', methods=['GET', 'POST'])
 def getdata():
@@ -269,19 +302,16 @@ def getdata():
             json_data = json.load(f)
         df = create_dataframe(json_data["data"])
 
-        output_file = os.path.join(OUTPUT_FOLDER, "pm25_animation.mp4")
-        compatible_output_file = os.path.join(OUTPUT_FOLDER, "pm25_animation_android.mp4")
+        output_file = os.path.join(OUTPUT_FOLDER, "pm25_animation_android.mp4")
 
         try:
             create_animation(df, output_file, fps=fps, size_scale=size_scale, map_style=map_style, alpha=alpha,
                              zoom=zoom, zoom_base=zoom_base, aspect_ratio=aspect_ratio,
                              center_lat=center_lat, center_lon=center_lon)
-            if not convert_video_to_android_compatible(output_file, compatible_output_file):
-                return jsonify({"error": "Error converting video for Android compatibility"})
         except Exception as e:
             return jsonify({"error": f"Error generating animation: {e}"})
 
-        return send_file(compatible_output_file, as_attachment=True)
+        return send_file(output_file, as_attachment=True)
 
     return render_template_string('''
     <!DOCTYPE html>
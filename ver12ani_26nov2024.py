@@ -5,13 +5,26 @@
 
 import os
 import json
+import datetime
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import multiprocessing
+from array import array
 import subprocess  # Importar para usar FFmpeg
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import requests
 from flask import Flask, request, render_template_string, jsonify, send_file
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # Render sin pantalla, también en los procesos de render en paralelo
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 from matplotlib import font_manager
-from matplotlib.animation import FuncAnimation, FFMpegWriter
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import contextily as ctx
@@ -19,64 +32,294 @@ import contextily as ctx
 app = Flask(__name__)
 app.logger.setLevel("DEBUG")
 
-UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "output"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+BASEMAP_CACHE_FOLDER = "basemap_cache"
+RENDER_JOBS_FOLDER = "jobs"  # Una carpeta por trabajo: archivo subido, progreso y video
+RENDER_CACHE_FOLDER = "render_cache"  # Videos ya generados, por hash de datos + parámetros
+# Las carpetas se crean al usarlas por primera vez, no al importar el módulo
 
-def convert_video_to_android_compatible(input_path, output_path):
-    try:
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-loglevel", "warning",
-            "-i", input_path,
-            "-vf", "scale=-1:1440",  # Scale height to 1440p, width adjusts accordingly
-            "-c:v", "libx264",
-            "-profile:v", "baseline",
-            "-level", "3.0",
-            "-pix_fmt", "yuv420p",
-            "-b:v", "1000k",
-            "-movflags", "+faststart",
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-ar", "44100",
-            "-shortest",
-            output_path
-        ], check=True)
+# Máximo de videos renderizándose a la vez; los demás esperan en cola
+MAX_RENDER_JOBS = 2
+# Cada cuántos frames se actualiza el archivo de progreso
+PROGRESS_EVERY = 10
+# Segundos que se conserva un trabajo terminado (estado y carpeta) antes de borrarlo
+RENDER_JOB_TTL = 6 * 3600
+# Tamaño máximo de render_cache; se borran primero los videos usados hace más tiempo
+RENDER_CACHE_MAX_MB = 4096
+
+# Capa de calor (IDW): columnas de la malla, potencia de la distancia y opacidad
+HEATMAP_GRID_COLUMNS = 160
+HEATMAP_POWER = 2
+HEATMAP_ALPHA = 0.45
+HEATMAP_MAX_WEIGHTS = 5_000_000  # Pares celda-estación guardados; con muchas estaciones o radio grande se reduce la malla
+
+VM_BASE_URL = "http://sensor.aireciudadano.com:30001/api/v1"
+# Segundos de espera a VictoriaMetrics por cada bloque de 7 días
+VM_TIMEOUT = 60
+# Únicas métricas que necesita el video (PM25raw y ConfigVal para los ajustes de PM25)
+VIDEO_METRICS = ["PM25", "PM25raw", "ConfigVal", "Latitude", "Longitude", "InOut"]
+ESTACIONES_AJUSTE_PM25 = [
+    "AireCiudadano_CO_BO_Hayuelos_6d4d48",
+    "AireCiudadano_Cindesus_17611c",
+    "Abago_EduardoSantos_ce0eb0"
+]
+
+# Ruta en disco del mapa base ya compuesto (tiles + fronteras + costas) para esta configuración
+def basemap_cache_path(map_style, zoom_base, extent, aspect_ratio, dpi, alpha):
+    key = json.dumps([map_style, zoom_base, [round(v, 6) for v in extent], aspect_ratio, dpi, alpha])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(BASEMAP_CACHE_FOLDER, f"basemap_{digest}.png")
+
+# Guarda los píxeles del área del mapa ya dibujada para reutilizarlos en siguientes videos
+def save_basemap_cache(fig, ax, cache_path):
+    fig.canvas.draw()
+    pixels = np.asarray(fig.canvas.buffer_rgba())
+    bbox = ax.get_window_extent()
+    height = pixels.shape[0]
+    x0, x1 = int(round(bbox.x0)), int(round(bbox.x1))
+    y0, y1 = int(round(height - bbox.y1)), int(round(height - bbox.y0))
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp.png"
+    plt.imsave(tmp_path, pixels[y0:y1, x0:x1])
+    os.replace(tmp_path, cache_path)
+
+# Escala de colores PM2.5: límite inferior de cada categoría a partir de "yellow"
+PM25_BREAKPOINTS = np.array([13, 35, 55, 150, 250])
+PM25_COLOR_NAMES = ["green", "yellow", "orange", "red", "purple", "brown"]
+PM25_RGBA = mcolors.to_rgba_array(PM25_COLOR_NAMES)
+PM25_CMAP = mcolors.ListedColormap(PM25_COLOR_NAMES)
+PM25_CMAP.set_bad(alpha=0)  # Celdas sin estaciones cerca quedan transparentes
+PM25_NORM = mcolors.BoundaryNorm(np.concatenate(([-1e6], PM25_BREAKPOINTS, [1e6])), PM25_CMAP.N)
+
+# Categoría (0-5) de todos los valores PM2.5 en una sola pasada; NaN cae en "brown" igual que antes
+def pm25_category(pm25_values):
+    return np.searchsorted(PM25_BREAKPOINTS, np.asarray(pm25_values, dtype=float), side='right')
+
+# Colores RGBA (N, 4) listos para el scatter
+def pm25_to_rgba(pm25_values):
+    return PM25_RGBA[pm25_category(pm25_values)]
+
+# Columnas que usa el render; el resto de cada registro se descarta al leer
+ANIMATION_COLUMNS = ["PM25", "Latitude", "Longitude", "InOut"]
+
+# Lector incremental de JSON: decodifica un valor a la vez desde un buffer que se rellena por bloques
+class JsonStream:
+    def __init__(self, f, block_size=1 << 20):
+        self.f = f
+        self.block_size = block_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        block = self.f.read(self.block_size)
+        if not block:
+            self.eof = True
+            return False
+        # Se descarta lo ya consumido para que el buffer no crezca con el archivo
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
         return True
-    except subprocess.CalledProcessError as e:
-        app.logger.error(f"FFmpeg error: {e}")
-        return False
-
-def pm25_to_color(pm25):
-    if pm25 < 13:
-        return "green"
-    elif 13 <= pm25 < 35:
-        return "yellow"
-    elif 35 <= pm25 < 55:
-        return "orange"
-    elif 55 <= pm25 < 150:
-        return "red"
-    elif 150 <= pm25 < 250:
-        return "purple"
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON file")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Invalid JSON: expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Un número cortado por el borde del bloque ("1." de "1.25") se decodificaría incompleto
+                if self.eof or (end < len(self.buffer) and self.buffer[end] not in '0123456789.eE+-'):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+# Recorre {"data": {estación: [registros]}} entregando (estación, registro) uno a uno
+def iter_json_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = JsonStream(f)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.decode()
+            stream.expect(':')
+            if key != 'data':
+                stream.decode()  # total_records, process_duration, etc.
+            else:
+                stream.expect('{')
+                while stream.peek() != '}':
+                    station = stream.decode()
+                    stream.expect(':')
+                    stream.expect('[')
+                    while stream.peek() != ']':
+                        yield station, stream.decode()
+                        if stream.peek() == ',':
+                            stream.expect(',')
+                    stream.expect(']')
+                    if stream.peek() == ',':
+                        stream.expect(',')
+                stream.expect('}')
+            if stream.peek() == ',':
+                stream.expect(',')
+            else:
+                stream.expect('}')
+                return
+
+# Convierte un valor del registro a float (None o texto no numérico -> NaN)
+def _to_float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+# Carga el JSON exportado llenando buffers tipados por columna, sin una lista de dicts por registro
+def load_animation_json(path):
+    station_names = {}
+    stations = array('i')
+    dates = array('q')  # microsegundos desde epoch, en UTC
+    columns = {col: array('d') for col in ANIMATION_COLUMNS}
+    naive_dates = False
+
+    for station, record in iter_json_records(path):
+        date = datetime.datetime.fromisoformat(record['date'].replace('Z', '+00:00'))
+        if date.tzinfo is None:
+            naive_dates = True
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        stations.append(station_names.setdefault(station, len(station_names)))
+        dates.append(int(date.timestamp() * 1_000_000))
+        for col in ANIMATION_COLUMNS:
+            columns[col].append(_to_float(record.get(col)))
+
+    if not dates:
+        raise ValueError("The uploaded file has no records.")
+
+    # np.frombuffer reutiliza la memoria de los arrays sin copiarla
+    df = pd.DataFrame({col: np.frombuffer(values, dtype=np.float64) for col, values in columns.items()})
+    df.insert(0, 'station', pd.Categorical.from_codes(np.frombuffer(stations, dtype=np.int32),
+                                                       categories=list(station_names)))
+    df.insert(1, 'date', pd.to_datetime(np.frombuffer(dates, dtype=np.int64), unit='us', utc=not naive_dates))
+    return df
+
+# Exportaciones CSV/Parquet: solo se leen las columnas necesarias, con tipos compactos
+def load_animation_table(path):
+    wanted = ['station', 'date'] + ANIMATION_COLUMNS
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq  # Solo hace falta para subir Parquet
+        available = pq.read_schema(path).names
+        df = pd.read_parquet(path, columns=[col for col in wanted if col in available])
     else:
-        return "brown"
-
-def create_dataframe(json_data):
-    records = []
-    for station, entries in json_data.items():
-        for entry in entries:
-            entry["station"] = station
-            records.append(entry)
-    df = pd.DataFrame(records)
+        df = pd.read_csv(path, usecols=lambda col: col in wanted,
+                         dtype={col: 'float64' for col in ANIMATION_COLUMNS})
+
+    missing = {'station', 'date', 'PM25', 'Latitude', 'Longitude'} - set(df.columns)
+    if missing:
+        raise ValueError(f"Missing columns in uploaded file: {', '.join(sorted(missing))}")
+    if 'InOut' not in df.columns:
+        # Exportaciones sin InOut: se asume que todas las estaciones son exteriores
+        df['InOut'] = 0.0
+    df['station'] = df['station'].astype('category')
     df['date'] = pd.to_datetime(df['date'])
     return df
 
-def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alpha=1.0, zoom=10, zoom_base=12,
-                     aspect_ratio='1:1', center_lat=4.6257, center_lon=-74.1340):
-    df = df.sort_values('date')
-    grouped = df.groupby('date')
-    sorted_df_dates = sorted(df['date'].unique())
+def load_animation_file(path):
+    if path.endswith('.json'):
+        return load_animation_json(path)
+    return load_animation_table(path)
+
+# Descarga las métricas del video directo de VictoriaMetrics a arreglos columnares (sin JSON intermedio
+# ni un dict por registro). VM promedia cada intervalo (t - step, t] con avg_over_time
+def fetch_video_data(start_datetime, end_datetime, step_minutes=60, station_filter=''):
+    metrics_regex = "|".join(VIDEO_METRICS)
+    if station_filter:
+        station_regex = station_filter.replace(',', '|')
+        selector = f'{{__name__=~"{metrics_regex}", job=~".*({station_regex}).*"}}'
+    else:
+        selector = f'{{__name__=~"{metrics_regex}"}}'
+    query = f'avg_over_time({selector}[{step_minutes}m]) keep_metric_names'
+
+    station_names = {}
+    station_codes, metric_codes, times, values = [], [], [], []
+    chunk_size = datetime.timedelta(days=7)
+    current_start = start_datetime
+
+    while current_start < end_datetime:
+        current_end = min(current_start + chunk_size, end_datetime)
+        app.logger.debug(f"Querying VictoriaMetrics video chunk from {current_start} to {current_end}")
+        response = requests.get(f"{VM_BASE_URL}/query_range", params={
+            'query': query,
+            'start': current_start.isoformat() + "Z",
+            'end': current_end.isoformat() + "Z",
+            'step': f"{step_minutes}m",
+        }, timeout=VM_TIMEOUT)
+        response.raise_for_status()
+
+        for series in response.json().get('data', {}).get('result', []):
+            station = series['metric'].get('job')
+            metric = series['metric'].get('__name__')
+            if station is None or metric not in VIDEO_METRICS or not series.get('values'):
+                continue
+            samples = np.array(series['values'], dtype=float)
+            station_code = station_names.setdefault(station, len(station_names))
+            station_codes.append(np.full(len(samples), station_code, dtype=np.int32))
+            metric_codes.append(np.full(len(samples), VIDEO_METRICS.index(metric), dtype=np.int8))
+            times.append(samples[:, 0].astype(np.int64))
+            values.append(samples[:, 1])
+
+        current_start = current_end
+
+    if not values:
+        return pd.DataFrame(columns=['station', 'date'] + VIDEO_METRICS)
+
+    long_df = pd.DataFrame({
+        'station': pd.Categorical.from_codes(np.concatenate(station_codes), categories=list(station_names)),
+        'time': np.concatenate(times),
+        'metric': pd.Categorical.from_codes(np.concatenate(metric_codes), categories=VIDEO_METRICS),
+        'value': np.concatenate(values),
+    })
+    # Los bordes de cada bloque de 7 días vienen repetidos; el promedio los une
+    df = long_df.pivot_table(index=['station', 'time'], columns='metric', values='value',
+                             aggfunc='mean', observed=True).reset_index()
+    df.columns.name = None
+    for metric in VIDEO_METRICS:
+        if metric not in df.columns:
+            df[metric] = np.nan
+    df['station'] = df['station'].astype(str)
+    df['date'] = pd.to_datetime(df['time'], unit='s', utc=True)
+    df['Latitude'] = df['Latitude'].replace(0, np.nan)
+    df['Longitude'] = df['Longitude'].replace(0, np.nan)
+    return apply_pm25_adjustments(df.drop(columns='time'))
+
+# Ajustes de PM25 (los que hacía create_dataframe en ver11ani_ffmeg.py) sobre columnas completas;
+# según las notas de arriba van en la capa de datos, por eso solo se aplican en /videodata
+def apply_pm25_adjustments(df):
+    # ConfigVal divisible por 4: usar PM25raw en lugar de PM25
+    use_raw = (df['ConfigVal'] % 4 == 0) & df['PM25raw'].notna()
+    df.loc[use_raw, 'PM25'] = df.loc[use_raw, 'PM25raw']
+
+    # Ajuste de PM25 para estaciones específicas
+    adjusted = df['station'].isin(ESTACIONES_AJUSTE_PM25)
+    df.loc[adjusted, 'PM25'] = ((1207 * df.loc[adjusted, 'PM25']) / 1000) - 1.01
+    return df
+
+# Tamaño de figura y extensión del mapa según zoom, relación de aspecto y centro
+def map_extent(zoom=10, aspect_ratio='1:1', center_lat=4.6257, center_lon=-74.1340):
     center = [center_lon, center_lat]
     
     # Calculate resolution and extent
@@ -99,6 +342,12 @@ def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alph
         center[0] - half_size_lon, center[0] + half_size_lon,
         center[1] - half_size_lat, center[1] + half_size_lat
     ]
+    return fig_size, extent
+
+# Crea la figura con las capas estáticas: mapa base, fronteras, costas y leyenda
+def setup_map_figure(size_scale=2, map_style='osm', alpha=1.0, zoom=10, zoom_base=12,
+                     aspect_ratio='1:1', center_lat=4.6257, center_lon=-74.1340):
+    fig_size, extent = map_extent(zoom=zoom, aspect_ratio=aspect_ratio, center_lat=center_lat, center_lon=center_lon)
 
     # Fuentes de mapas gratuitas y sin API key
     tile_sources = {
@@ -143,8 +392,6 @@ def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alph
     # Remove the problematic aspect ratio setting
     # ax.set_aspect(fig_size[1] / fig_size[0])  # Remove this line
 
-    ctx.add_basemap(ax, source=tile_source, crs=ccrs.PlateCarree(), zoom=zoom_base, alpha=alpha)
-
     # Adjust subplot parameters based on aspect ratio
     if aspect_ratio == '16:9':
         plt.subplots_adjust(left=0.02, right=0.98, top=0.95, bottom=0.05)
@@ -153,9 +400,24 @@ def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alph
     else:  # 1:1
         plt.subplots_adjust(left=0.02, right=0.99, top=0.95, bottom=0.02)
 
-    # Rest of your existing code remains the same
-    ax.add_feature(cfeature.BORDERS, linestyle=':', edgecolor='black')
-    ax.add_feature(cfeature.COASTLINE, edgecolor='black')
+    # Mapa base en caché: sin descarga de tiles ni rasterizado de fronteras/costas
+    basemap_path = basemap_cache_path(map_style, zoom_base, extent, aspect_ratio, base_dpi, alpha)
+    if os.path.exists(basemap_path):
+        app.logger.debug(f"Usando mapa base en caché: {basemap_path}")
+        ax.imshow(plt.imread(basemap_path), extent=extent, transform=ccrs.PlateCarree(),
+                  origin='upper', interpolation='none', zorder=0)
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+    else:
+        ctx.add_basemap(ax, source=tile_source, crs=ccrs.PlateCarree(), zoom=zoom_base, alpha=alpha)
+
+        # Rest of your existing code remains the same
+        ax.add_feature(cfeature.BORDERS, linestyle=':', edgecolor='black')
+        ax.add_feature(cfeature.COASTLINE, edgecolor='black')
+
+        try:
+            save_basemap_cache(fig, ax, basemap_path)
+        except Exception as e:
+            app.logger.warning(f"No se pudo guardar el mapa base en caché: {e}")
 
     scatter = ax.scatter(
         [], [], s=10 * size_scale, transform=ccrs.PlateCarree(),
@@ -186,83 +448,651 @@ def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alph
     )
     legend.get_title().set_fontproperties(bold_title_font)
 
-    # Función de actualización de los frames
-    def update(frame):
-        current_time = sorted_df_dates[frame]
-        app.logger.debug(f"Actualizando frame para la fecha: {current_time}")
-        data_frame = grouped.get_group(current_time)
-        data_frame = data_frame[data_frame['InOut'] == 0.0]
-
-        # Spatial filtering based on map extent
-        extent = ax.get_extent()
-        data_frame = data_frame[
-            (data_frame['Longitude'] >= extent[0]) &
-            (data_frame['Longitude'] <= extent[1]) &
-            (data_frame['Latitude'] >= extent[2]) &
-            (data_frame['Latitude'] <= extent[3])
-        ]
-
-        colors = data_frame["PM25"].apply(pm25_to_color)
-        scatter.set_offsets(data_frame[["Longitude", "Latitude"]])
-        scatter.set_facecolor(colors)
-        scatter.set_edgecolor(colors)
-        ax.set_title(f"Red AireCiudadano - {current_time.strftime('%Y-%m-%d %H:%M:%S')}", fontsize=24, fontweight="bold")
-
-    total_frames = len(df['date'].unique())
+    return fig, ax, scatter
+
+# Dibuja una sola vez todo lo estático y guarda el fondo; el scatter y el título se dibujan aparte en cada frame
+def capture_static_background(fig, ax, scatter):
+    scatter.set_animated(True)
+    ax.title.set_animated(True)
+    fig.canvas.draw()
+    return fig.canvas.copy_from_bbox(fig.bbox)
+
+# Restaura el fondo y redibuja solo los artistas que cambian; devuelve el buffer RGBA del frame
+def render_frame(fig, ax, scatter, background, offsets, colors, title, heatmap=None, grid=None):
+    fig.canvas.restore_region(background)
+    if heatmap is not None:
+        heatmap.set_data(grid)
+        ax.draw_artist(heatmap)
+    scatter.set_offsets(offsets)
+    scatter.set_facecolor(colors)
+    scatter.set_edgecolor(colors)
+    ax.set_title(title, fontsize=24, fontweight="bold")
+    ax.draw_artist(scatter)
+    ax.draw_artist(ax.title)
+    return fig.canvas.buffer_rgba()
+
+# Proceso FFmpeg que recibe los frames crudos (RGBA) por stdin y codifica en una sola pasada
+# con la configuración final compatible con Android (antes era una segunda recodificación)
+def open_ffmpeg_pipe(output_path, width, height, fps):
+    return subprocess.Popen([
+        "ffmpeg", "-y",
+        "-loglevel", "warning",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgba",
+        "-s", f"{width}x{height}",
+        "-r", str(fps),
+        "-i", "-",
+        "-vf", "scale=-2:1440",  # Scale height to 1440p, width adjusts accordingly (and stays even)
+        "-c:v", "libx264",
+        "-profile:v", "baseline",
+        "-level", "3.0",
+        "-pix_fmt", "yuv420p",
+        "-b:v", "1000k",
+        "-movflags", "+faststart",
+        "-metadata", "artist=Me",
+        output_path
+    ], stdin=subprocess.PIPE)
+
+def close_ffmpeg_pipe(process):
+    process.stdin.close()
+    return_code = process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, "ffmpeg")
+
+# Matriz de pesos IDW (celdas x estaciones), calculada una sola vez porque las estaciones casi no se mueven.
+# Cada frame es entonces un producto matriz-vector. Más allá de radius_km una estación no aporta
+def idw_weights(extent, station_lon, station_lat, radius_km, columns=HEATMAP_GRID_COLUMNS, power=HEATMAP_POWER):
+    lon_span = extent[1] - extent[0]
+    lat_span = extent[3] - extent[2]
+    # Distancia aproximada en km (equirectangular), suficiente a escala de ciudad
+    km_per_deg_lon = 111.32 * np.cos(np.radians(0.5 * (extent[2] + extent[3])))
+    km_per_deg_lat = 110.57
+
+    # Cada estación solo cubre el recuadro de celdas a menos de radius_km: si el total de pares
+    # celda-estación pasa de HEATMAP_MAX_WEIGHTS se usa una malla más gruesa
+    while True:
+        rows = max(1, int(round(columns * lat_span / lon_span)))
+        box_columns = min(columns, 2 * radius_km / km_per_deg_lon / (lon_span / columns) + 3)
+        box_rows = min(rows, 2 * radius_km / km_per_deg_lat / (lat_span / rows) + 3)
+        if columns <= 16 or len(station_lon) * box_columns * box_rows <= HEATMAP_MAX_WEIGHTS:
+            break
+        columns = columns // 2
+    cell_lon = extent[0] + (np.arange(columns) + 0.5) * lon_span / columns
+    cell_lat = extent[2] + (np.arange(rows) + 0.5) * lat_span / rows
+
+    # Pesos dispersos (celda, estación, peso) en float32; más allá del radio el peso es 0 y no se guarda
+    cells, owners, weights = [], [], []
+    for station, (lon, lat) in enumerate(zip(station_lon, station_lat)):
+        if not (np.isfinite(lon) and np.isfinite(lat)):
+            continue
+        c0 = max(np.searchsorted(cell_lon, lon - radius_km / km_per_deg_lon) - 1, 0)
+        c1 = np.searchsorted(cell_lon, lon + radius_km / km_per_deg_lon, side='right') + 1
+        r0 = max(np.searchsorted(cell_lat, lat - radius_km / km_per_deg_lat) - 1, 0)
+        r1 = np.searchsorted(cell_lat, lat + radius_km / km_per_deg_lat, side='right') + 1
+        dx = (cell_lon[c0:c1] - lon) * km_per_deg_lon
+        dy = (cell_lat[r0:r1] - lat) * km_per_deg_lat
+        distance = np.hypot(dx.reshape(1, -1), dy.reshape(-1, 1)).astype(np.float32)
+        row, column = np.nonzero(distance <= radius_km)
+        cells.append(((row + r0) * columns + column + c0).astype(np.int32))
+        owners.append(np.full(len(row), station, dtype=np.int32))
+        weights.append(1.0 / np.maximum(distance[row, column], np.float32(0.05)) ** power)
+
+    if not cells:
+        return (np.zeros(0, np.int32), np.zeros(0, np.int32), np.zeros(0, np.float32)), (rows, columns)
+    return (np.concatenate(cells), np.concatenate(owners), np.concatenate(weights)), (rows, columns)
+
+# Malla PM2.5 de un frame: promedio ponderado de las estaciones presentes (presencia = alpha del punto)
+def idw_grid(weights, grid_shape, n_stations, station_rows, pm25_rows, presence_rows):
+    presence = np.zeros(n_stations, dtype=np.float32)
+    values = np.zeros(n_stations, dtype=np.float32)
+    valid = ~np.isnan(pm25_rows)
+    presence[station_rows[valid]] = presence_rows[valid]
+    values[station_rows[valid]] = pm25_rows[valid] * presence_rows[valid]
+
+    cells, owners, cell_weights = weights
+    n_cells = grid_shape[0] * grid_shape[1]
+    numerator = np.bincount(cells, weights=cell_weights * values[owners], minlength=n_cells)
+    denominator = np.bincount(cells, weights=cell_weights * presence[owners], minlength=n_cells)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid = (numerator / denominator).astype(np.float32)
+    grid[denominator == 0] = np.nan
+    return grid.reshape(grid_shape)
+
+# Posición fija de cada estación (mediana), para la matriz de pesos IDW
+def station_positions(station_codes, n_stations, lon, lat):
+    positions = pd.DataFrame({'code': station_codes, 'lon': lon, 'lat': lat}).groupby('code').median()
+    positions = positions.reindex(range(n_stations))
+    return positions['lon'].to_numpy(), positions['lat'].to_numpy()
+
+# Estaciones exteriores dentro de la extensión del mapa
+def visible_rows(df, extent):
+    return df[
+        (df['InOut'] == 0.0) &
+        (df['Longitude'] >= extent[0]) &
+        (df['Longitude'] <= extent[1]) &
+        (df['Latitude'] >= extent[2]) &
+        (df['Latitude'] <= extent[3])
+    ]
+
+# Prepara los frames una sola vez: filtra estaciones exteriores y extensión, ordena por fecha y
+# calcula el rango [start, end) de filas de cada frame, así cada frame es un slice de los arreglos
+def prepare_frames(df, extent):
+    # Todas las fechas generan frame, aunque no tengan estaciones visibles.
+    # asi8 depende de la unidad del índice (s, us o ns según el origen de los datos): se fija en ns
+    times = pd.DatetimeIndex(df['date'].drop_duplicates().sort_values()).as_unit('ns')
+
+    visible = visible_rows(df, extent).sort_values('date', kind='stable')
+    visible_times = pd.DatetimeIndex(visible['date']).as_unit('ns').asi8
+    station_codes, stations = pd.factorize(visible['station'])
+    lon = visible['Longitude'].to_numpy(dtype=float)
+    lat = visible['Latitude'].to_numpy(dtype=float)
+    station_lon, station_lat = station_positions(station_codes, len(stations), lon, lat)
+
+    return {
+        'times': times,
+        'starts': np.searchsorted(visible_times, times.asi8, side='left'),
+        'ends': np.searchsorted(visible_times, times.asi8, side='right'),
+        'offsets': np.column_stack((lon, lat)),
+        'colors': pm25_to_rgba(visible['PM25']),
+        # Para la capa de calor: estación y PM2.5 de cada fila, y posición fija de cada estación
+        'station': station_codes,
+        'pm25': visible['PM25'].to_numpy(dtype=float),
+        'station_lon': station_lon,
+        'station_lat': station_lat,
+    }
+
+# Igual que prepare_frames pero con `steps` frames por cada par de fechas consecutivas: PM2.5 y
+# posición se interpolan linealmente por estación, y las estaciones que aparecen o desaparecen
+# entran o salen con un fundido (alpha). steps=1 da los mismos frames que prepare_frames
+def prepare_interpolated_frames(df, extent, steps):
+    # En ns para que asi8 coincida con unit='ns' al reconstruir las fechas de los frames
+    times = pd.DatetimeIndex(df['date'].drop_duplicates().sort_values()).as_unit('ns')
+    visible = visible_rows(df, extent)
+
+    # Matrices densas (fecha x estación)
+    station_codes, stations = pd.factorize(visible['station'])
+    time_codes = times.get_indexer(visible['date'])
+    shape = (len(times), len(stations))
+    present = np.zeros(shape, dtype=bool)
+    pm25 = np.full(shape, np.nan)
+    lon = np.full(shape, np.nan)
+    lat = np.full(shape, np.nan)
+    present[time_codes, station_codes] = True
+    pm25[time_codes, station_codes] = visible['PM25'].to_numpy(dtype=float)
+    lon[time_codes, station_codes] = visible['Longitude'].to_numpy(dtype=float)
+    lat[time_codes, station_codes] = visible['Latitude'].to_numpy(dtype=float)
+
+    fractions = (np.arange(steps) / steps)[:, None]  # (steps, 1): fracción de cada frame intermedio
+    time_values = times.asi8
+    frame_times, counts, offsets, colors, frame_stations, frame_pm25 = [], [], [], [], [], []
+
+    for i in range(len(times)):
+        if i == len(times) - 1:
+            # Última fecha: un solo frame, sin interpolación
+            f = np.zeros((1, 1))
+            a, b = i, i
+        else:
+            f = fractions
+            a, b = i, i + 1
+        both = present[a] & present[b]
+        only_a = present[a] & ~present[b]
+        only_b = ~present[a] & present[b]
+
+        def blend(values):
+            mixed = (1 - f) * values[a] + f * values[b]
+            return np.where(both, mixed, np.where(only_a, values[a], values[b]))
+
+        alpha = np.where(both, 1.0, np.where(only_a, 1 - f, np.where(only_b, f, 0.0)))
+        shown = alpha > 0  # (frames, estaciones), recorrido por filas = orden de los frames
+
+        shown_pm25 = blend(pm25)[shown]
+        frame_colors = pm25_to_rgba(shown_pm25)
+        frame_colors[:, 3] *= alpha[shown]
+        frame_stations.append(np.nonzero(shown)[1])
+        frame_pm25.append(shown_pm25)
+        frame_times.append(time_values[a] + (f[:, 0] * (time_values[b] - time_values[a])).astype(np.int64))
+        counts.append(shown.sum(axis=1))
+        offsets.append(np.column_stack((blend(lon)[shown], blend(lat)[shown])))
+        colors.append(frame_colors)
+
+    # asi8 está en UTC; se recupera la zona horaria original para los títulos
+    frame_times = pd.DatetimeIndex(pd.to_datetime(np.concatenate(frame_times), unit='ns'))
+    if times.tz is not None:
+        frame_times = frame_times.tz_localize('UTC').tz_convert(times.tz)
+    counts = np.concatenate(counts)
+    ends = np.cumsum(counts)
+    station_lon, station_lat = station_positions(station_codes, len(stations),
+                                                 visible['Longitude'].to_numpy(dtype=float),
+                                                 visible['Latitude'].to_numpy(dtype=float))
+    return {
+        'times': frame_times,
+        'starts': ends - counts,
+        'ends': ends,
+        'offsets': np.concatenate(offsets),
+        'colors': np.concatenate(colors),
+        'station': np.concatenate(frame_stations),
+        'pm25': np.concatenate(frame_pm25),
+        'station_lon': station_lon,
+        'station_lat': station_lat,
+    }
+
+# Sub-conjunto de frames [first, last) con sus filas, para enviarlo a un proceso de render
+def slice_frames(frames, first, last):
+    row_start = frames['starts'][first]
+    row_end = frames['ends'][last - 1]
+    return {
+        'times': frames['times'][first:last],
+        'starts': frames['starts'][first:last] - row_start,
+        'ends': frames['ends'][first:last] - row_start,
+        'offsets': frames['offsets'][row_start:row_end],
+        'colors': frames['colors'][row_start:row_end],
+        'station': frames['station'][row_start:row_end],
+        'pm25': frames['pm25'][row_start:row_end],
+        'station_lon': frames['station_lon'],
+        'station_lat': frames['station_lat'],
+    }
+
+# Renderiza un rango de frames en su propia figura y lo codifica como un video (o segmento) independiente
+def render_segment(frames, hold_frames, output_path, fps, map_params, progress_path=None, heatmap_radius_km=None):
+    fig, ax, scatter = setup_map_figure(**map_params)
+
+    # Capa de calor opcional: pesos IDW una sola vez, imshow animado debajo de los puntos
+    heatmap = None
+    if heatmap_radius_km:
+        _, extent = map_extent(zoom=map_params['zoom'], aspect_ratio=map_params['aspect_ratio'],
+                               center_lat=map_params['center_lat'], center_lon=map_params['center_lon'])
+        n_stations = len(frames['station_lon'])
+        weights, grid_shape = idw_weights(extent, frames['station_lon'], frames['station_lat'], heatmap_radius_km)
+        heatmap = ax.imshow(np.full(grid_shape, np.nan), extent=extent, transform=ccrs.PlateCarree(),
+                            origin='lower', cmap=PM25_CMAP, norm=PM25_NORM, alpha=HEATMAP_ALPHA,
+                            interpolation='bilinear', zorder=1, animated=True)
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+    background = capture_static_background(fig, ax, scatter)
+    height, width = np.asarray(fig.canvas.buffer_rgba()).shape[:2]
+
+    total_frames = len(frames['times'])
+    process = open_ffmpeg_pipe(output_path, width, height, fps)
+    try:
+        for frame, (current_time, start, end) in enumerate(zip(frames['times'], frames['starts'], frames['ends'])):
+            app.logger.debug(f"Actualizando frame para la fecha: {current_time}")
+            title = f"Red AireCiudadano - {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
+            grid = None
+            if heatmap is not None:
+                grid = idw_grid(weights, grid_shape, n_stations, frames['station'][start:end],
+                                frames['pm25'][start:end], frames['colors'][start:end, 3])
+            frame_buffer = render_frame(fig, ax, scatter, background, frames['offsets'][start:end],
+                                        frames['colors'][start:end], title, heatmap, grid)
+            process.stdin.write(frame_buffer)
+            if progress_path and (frame + 1) % PROGRESS_EVERY == 0:
+                write_progress(progress_path, frame + 1, total_frames)
+
+        # Los frames extra repiten el último frame ya dibujado en el buffer
+        for _ in range(hold_frames):
+            process.stdin.write(frame_buffer)
+    finally:
+        close_ffmpeg_pipe(process)
+        plt.close(fig)
+
+    if progress_path:
+        write_progress(progress_path, total_frames, total_frames)
+    return output_path
+
+# Progreso "<frames hechos> <frames totales>" de un segmento, escrito de forma atómica
+def write_progress(progress_path, frames_done, total_frames):
+    tmp_path = f"{progress_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(f"{frames_done} {total_frames}")
+    os.replace(tmp_path, progress_path)
+
+# Suma el progreso de todos los segmentos de un trabajo
+def read_progress(job_dir):
+    frames_done, total_frames = 0, 0
+    for name in os.listdir(job_dir):
+        if name.startswith("progress_") and name.endswith(".txt"):
+            try:
+                with open(os.path.join(job_dir, name)) as f:
+                    done, total = f.read().split()
+                frames_done += int(done)
+                total_frames += int(total)
+            except (OSError, ValueError):
+                continue
+    return frames_done, total_frames
+
+# Une los segmentos sin recodificar (concat demuxer de FFmpeg)
+def concat_segments(segment_paths, list_path, output_path):
+    with open(list_path, 'w') as f:
+        for segment_path in segment_paths:
+            f.write(f"file '{os.path.abspath(segment_path)}'\n")
+    subprocess.run([
+        "ffmpeg", "-y",
+        "-loglevel", "warning",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", list_path,
+        "-c", "copy",
+        "-movflags", "+faststart",
+        output_path
+    ], check=True)
+
+def create_animation(df, output_path, fps=2, size_scale=2, map_style='osm', alpha=1.0, zoom=10, zoom_base=12,
+                     aspect_ratio='1:1', center_lat=4.6257, center_lon=-74.1340, workers=1, interpolation_steps=1,
+                     heatmap_radius_km=None, progress_dir=None):
+    map_params = dict(size_scale=size_scale, map_style=map_style, alpha=alpha, zoom=zoom, zoom_base=zoom_base,
+                      aspect_ratio=aspect_ratio, center_lat=center_lat, center_lon=center_lon)
+    _, extent = map_extent(zoom=zoom, aspect_ratio=aspect_ratio, center_lat=center_lat, center_lon=center_lon)
+    if interpolation_steps > 1:
+        frames = prepare_interpolated_frames(df, extent, interpolation_steps)
+    else:
+        frames = prepare_frames(df, extent)
+
+    total_frames = len(frames['times'])
     extra_time_frames = int(max(2 / fps, 2))
-    total_frames_with_extra = total_frames + extra_time_frames
+    workers = max(1, min(workers, os.cpu_count() or 1, total_frames))
+
+    def progress_path(i):
+        return os.path.join(progress_dir, f"progress_{i:04d}.txt") if progress_dir else None
+
+    if workers == 1:
+        if progress_dir:
+            write_progress(progress_path(0), 0, total_frames)
+        render_segment(frames, extra_time_frames, output_path, fps, map_params, progress_path(0), heatmap_radius_km)
+        return
+
+    # Se prepara el mapa base en caché una sola vez para que los procesos no descarguen tiles
+    fig, _, _ = setup_map_figure(**map_params)
+    plt.close(fig)
+
+    # Cada proceso recibe un rango contiguo de frames y solo las filas que necesita
+    frame_size = -(-total_frames // workers)
+    parent_dir = os.path.dirname(output_path) or OUTPUT_FOLDER
+    os.makedirs(parent_dir, exist_ok=True)
+    segment_dir = tempfile.mkdtemp(prefix="segments_", dir=parent_dir)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for i, first in enumerate(range(0, total_frames, frame_size)):
+                last = min(first + frame_size, total_frames)
+                is_last = last == total_frames
+                segment_path = os.path.join(segment_dir, f"segment_{i:04d}.mp4")
+                if progress_dir:
+                    write_progress(progress_path(i), 0, last - first)
+                futures.append(executor.submit(render_segment, slice_frames(frames, first, last),
+                                               extra_time_frames if is_last else 0,
+                                               segment_path, fps, map_params, progress_path(i),
+                                               heatmap_radius_km))
+            segment_paths = [future.result() for future in futures]
+
+        concat_segments(segment_paths, os.path.join(segment_dir, "segments.txt"), output_path)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+# Parámetros del video comunes a /getdata y /videodata
+def read_animation_params(form):
+    return dict(
+        fps=form.get('fps', 2, type=float),
+        size_scale=form.get('size_scale', 5, type=int),
+        map_style=form.get('map_style', 'osm'),
+        alpha=form.get('alpha', 1.0, type=float),
+        aspect_ratio=form.get('aspect_ratio', '1:1'),
+        zoom=form.get('zoom', 10, type=int),
+        zoom_base=form.get('zoom_base', 12, type=int),
+        center_lat=form.get('center_lat', 4.6257, type=float),
+        center_lon=form.get('center_lon', -74.15, type=float),
+        workers=form.get('workers', 1, type=int),
+        interpolation_steps=max(1, form.get('interpolation_steps', 1, type=int)),
+        heatmap_radius_km=form.get('heatmap_radius_km', 3.0, type=float) if form.get('heatmap') == 'on' else None,
+    )
+
+# ==========================================
+# GESTOR DE TRABAJOS DE RENDER
+# ==========================================
+# Cada trabajo tiene su carpeta y corre en un proceso propio; un pool de hilos limita cuántos corren a la vez
+render_jobs = {}
+render_jobs_lock = threading.Lock()
+render_executor = ThreadPoolExecutor(max_workers=MAX_RENDER_JOBS)
+
+# Hash de los datos de entrada + parámetros del video: videos iguales se sirven desde la caché.
+# workers solo cambia cómo se reparte el render, no el video
+def render_cache_key(source, source_args, params, data_path=None):
+    video_params = {key: value for key, value in params.items() if key != 'workers'}
+    digest = hashlib.sha256()
+    digest.update(json.dumps([source, source_args, video_params], sort_keys=True, default=str).encode('utf-8'))
+    if data_path:
+        with open(data_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
 
-    def extended_update(frame):
-        if frame < total_frames:
-            update(frame)
+# Corre en un proceso aparte: carga los datos y genera el video dentro de la carpeta del trabajo
+def run_render_job(job_dir, source, source_args, params, output_path):
+    try:
+        if source == 'file':
+            df = load_animation_file(source_args['data_path'])
+            if df.empty:
+                raise ValueError("The uploaded file has no records.")
+        else:
+            df = fetch_video_data(datetime.datetime.fromisoformat(source_args['start']),
+                                  datetime.datetime.fromisoformat(source_args['end']),
+                                  source_args['step_minutes'], source_args['station_filter'])
+            if df.empty:
+                raise ValueError("No data found for the selected period and stations.")
+        create_animation(df, output_path, progress_dir=job_dir, **params)
+    except requests.exceptions.RequestException as e:
+        # Llega al cliente como el "error" del JSON de /jobs/<job_id>
+        with open(os.path.join(job_dir, "error.txt"), 'w') as f:
+            f.write(f"Error fetching data from VictoriaMetrics: {e}")
+        raise SystemExit(1)
+    except Exception as e:
+        with open(os.path.join(job_dir, "error.txt"), 'w') as f:
+            f.write(str(e))
+        raise SystemExit(1)
+
+# Borra los trabajos terminados hace más de RENDER_JOB_TTL y las carpetas huérfanas de ejecuciones anteriores
+def prune_render_jobs():
+    now = time.time()
+    with render_jobs_lock:
+        expired = [job_id for job_id, job in render_jobs.items()
+                   if job['finished'] is not None and now - job['finished'] > RENDER_JOB_TTL]
+        for job_id in expired:
+            del render_jobs[job_id]
+        live = set(render_jobs)
+    for job_id in (os.listdir(RENDER_JOBS_FOLDER) if os.path.isdir(RENDER_JOBS_FOLDER) else []):
+        job_dir = os.path.join(RENDER_JOBS_FOLDER, job_id)
+        if job_id in expired or (job_id not in live and now - os.path.getmtime(job_dir) > RENDER_JOB_TTL):
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+# LRU por fecha de modificación (los aciertos la renuevan con os.utime)
+def prune_render_cache():
+    entries = []
+    for name in (os.listdir(RENDER_CACHE_FOLDER) if os.path.isdir(RENDER_CACHE_FOLDER) else []):
+        path = os.path.join(RENDER_CACHE_FOLDER, name)
+        if name.endswith('.mp4'):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= RENDER_CACHE_MAX_MB * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def execute_render_job(job_id):
+    job = render_jobs[job_id]
+    job['status'] = 'running'
+    try:
+        # Este hilo es de un pool dentro del servidor Flask: con fork el hijo podría heredar locks tomados por
+        # otros hilos (logging, urllib3, matplotlib), así que el proceso sale de un forkserver limpio
+        process = multiprocessing.get_context('forkserver').Process(target=run_render_job, args=(
+            job['dir'], job['source'], job['source_args'], job['params'], job['output']))
+        process.start()
+        process.join()
+
+        if process.exitcode == 0 and os.path.exists(job['output']):
+            if job['cache_path']:
+                # El video se mueve a la caché (sin copia) y el trabajo lo sirve desde ahí
+                os.makedirs(RENDER_CACHE_FOLDER, exist_ok=True)
+                os.replace(job['output'], job['cache_path'])
+                job['output'] = job['cache_path']
+                prune_render_cache()
+            job['status'] = 'done'
         else:
-            update(total_frames - 1)
+            error_path = os.path.join(job['dir'], "error.txt")
+            error = "Render process failed"
+            if os.path.exists(error_path):
+                with open(error_path) as f:
+                    error = f.read()
+            app.logger.error(f"Render job {job_id} failed: {error}")
+            job['error'] = error
+            job['status'] = 'error'
+    except Exception as e:
+        app.logger.error(f"Render job {job_id} failed: {e}")
+        job['error'] = str(e)
+        job['status'] = 'error'
+    job['finished'] = time.time()
+
+    # El archivo subido ya no hace falta
+    data_path = job['source_args'].get('data_path')
+    if data_path and os.path.exists(data_path):
+        os.remove(data_path)
+
+def submit_render_job(job_id, job_dir, source, source_args, params, cache_key):
+    cache_path = os.path.join(RENDER_CACHE_FOLDER, f"{cache_key}.mp4") if cache_key else None
+    job = {
+        'dir': job_dir,
+        'source': source,
+        'source_args': source_args,
+        'params': params,
+        'output': os.path.join(job_dir, "pm25_animation_android.mp4"),
+        'cache_path': cache_path,
+        'status': 'queued',
+        'error': None,
+        'finished': None,
+    }
+    prune_render_jobs()
+    with render_jobs_lock:
+        render_jobs[job_id] = job
+
+    if cache_path and os.path.exists(cache_path):
+        # Mismos datos y parámetros que un video anterior: respuesta inmediata
+        app.logger.debug(f"Render job {job_id} served from cache {cache_path}")
+        os.utime(cache_path)
+        job['output'] = cache_path
+        job['status'] = 'done'
+        job['finished'] = time.time()
+        data_path = source_args.get('data_path')
+        if data_path and os.path.exists(data_path):
+            os.remove(data_path)
+    else:
+        render_executor.submit(execute_render_job, job_id)
+
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "video_url": f"/jobs/{job_id}/video",
+    })
+
+def new_job_dir():
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(RENDER_JOBS_FOLDER, job_id)
+    os.makedirs(job_dir)
+    return job_id, job_dir
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = render_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
 
-    ani = FuncAnimation(fig, extended_update, frames=total_frames_with_extra, repeat=False, blit=False)
-    writer = FFMpegWriter(fps=fps, metadata=dict(artist='Me'), bitrate=1800)
-    ani.save(output_path, writer=writer)
+    frames_done, total_frames = read_progress(job['dir']) if job['status'] == 'running' else (0, 0)
+    if job['status'] == 'done':
+        progress_percentage = 100
+    elif total_frames:
+        progress_percentage = round(100 * frames_done / total_frames, 1)
+    else:
+        progress_percentage = 0
+
+    return jsonify({
+        "job_id": job_id,
+        "status": job['status'],
+        "frames_done": frames_done,
+        "total_frames": total_frames,
+        "progress_percentage": progress_percentage,
+        "error": job['error'],
+    })
+
+@app.route('/jobs/<job_id>/video', methods=['GET'])
+def job_video(job_id):
+    job = render_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job['status'] != 'done':
+        return jsonify({"error": f"Video not ready (status: {job['status']})"}), 409
+    if not os.path.exists(job['output']):
+        return jsonify({"error": "Video expired from the render cache, please submit it again"}), 410
+    return send_file(job['output'], as_attachment=True, download_name="pm25_animation_android.mp4")
 
 @app.route('/getdata', methods=['GET', 'POST'])
 def getdata():
     if request.method == 'POST':
         file = request.files.get('file')
-        fps = request.form.get('fps', 2, type=float)
-        size_scale = request.form.get('size_scale', 5, type=int)
-        map_style = request.form.get('map_style', 'osm')
-        alpha = request.form.get('alpha', 1.0, type=float)
-        aspect_ratio = request.form.get('aspect_ratio', '1:1')
-        zoom = request.form.get('zoom', 10, type=int)
-        zoom_base = request.form.get('zoom_base', 12, type=int)
-        center_lat = request.form.get('center_lat', 4.6257, type=float)
-        center_lon = request.form.get('center_lon', -74.15, type=float)
+        params = read_animation_params(request.form)
 
         if not file:
             return jsonify({"error": "No file uploaded"})
-        if not file.filename.endswith('.json'):
-            return jsonify({"error": "Only JSON files are allowed"})
+        extension = os.path.splitext(file.filename)[1].lower()
+        if extension not in ('.json', '.csv', '.parquet'):
+            return jsonify({"error": "Only JSON, CSV or Parquet files are allowed"})
 
-        save_path = os.path.join(UPLOAD_FOLDER, file.filename)
+        job_id, job_dir = new_job_dir()
+        save_path = os.path.join(job_dir, f"upload{extension}")
         file.save(save_path)
 
-        with open(save_path, 'r') as f:
-            json_data = json.load(f)
-        df = create_dataframe(json_data["data"])
+        source_args = {'data_path': save_path}
+        cache_key = render_cache_key('file', {}, params, data_path=save_path)
+        return submit_render_job(job_id, job_dir, 'file', source_args, params, cache_key)
+
+    return render_template_string(ANIMATION_FORM, source='file')
 
-        output_file = os.path.join(OUTPUT_FOLDER, "pm25_animation.mp4")
-        compatible_output_file = os.path.join(OUTPUT_FOLDER, "pm25_animation_android.mp4")
+# Video directo desde VictoriaMetrics, sin exportar ni subir un JSON
+@app.route('/videodata', methods=['GET', 'POST'])
+def videodata():
+    if request.method == 'POST':
+        params = read_animation_params(request.form)
+        station_filter = request.form.get('station_filter', '')
+        step_minutes = request.form.get('step_minutes', 60, type=int)
 
         try:
-            create_animation(df, output_file, fps=fps, size_scale=size_scale, map_style=map_style, alpha=alpha,
-                             zoom=zoom, zoom_base=zoom_base, aspect_ratio=aspect_ratio,
-                             center_lat=center_lat, center_lon=center_lon)
-            if not convert_video_to_android_compatible(output_file, compatible_output_file):
-                return jsonify({"error": "Error converting video for Android compatibility"})
-        except Exception as e:
-            return jsonify({"error": f"Error generating animation: {e}"})
+            start_datetime = datetime.datetime.fromisoformat(f"{request.form['start_date']}T{request.form['start_time']}")
+            end_datetime = datetime.datetime.fromisoformat(f"{request.form['end_date']}T{request.form['end_time']}")
+        except (KeyError, ValueError):
+            return jsonify({"error": "Invalid start or end date/time"})
+        if end_datetime <= start_datetime:
+            return jsonify({"error": "End date/time must be after start date/time"})
+        if step_minutes < 1:
+            return jsonify({"error": "Interval must be at least 1 minute"})
 
-        return send_file(compatible_output_file, as_attachment=True)
+        source_args = {
+            'start': start_datetime.isoformat(),
+            'end': end_datetime.isoformat(),
+            'step_minutes': step_minutes,
+            'station_filter': station_filter,
+        }
+        # Solo se cachean rangos ya cerrados; si el rango llega al presente los datos aún cambian
+        closed_range = end_datetime < datetime.datetime.utcnow() - datetime.timedelta(minutes=step_minutes)
+        cache_key = render_cache_key('api', source_args, params) if closed_range else None
+        job_id, job_dir = new_job_dir()
+        return submit_render_job(job_id, job_dir, 'api', source_args, params, cache_key)
 
-    return render_template_string('''
+    now = datetime.datetime.utcnow()
+    return render_template_string(ANIMATION_FORM, source='api',
+                                  start_date=(now - datetime.timedelta(days=1)).strftime('%Y-%m-%d'),
+                                  end_date=now.strftime('%Y-%m-%d'))
+
+ANIMATION_FORM = '''
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -271,10 +1101,28 @@ def getdata():
         <title>PM2.5 Animation Data Upload</title>
     </head>
     <body>
-        <h2>Sube tu archivo JSON para animación de PM2.5</h2>
-        <form action="/getdata" method="post" enctype="multipart/form-data">
-            <label for="file">Seleccionar archivo JSON:</label><br>
-            <input type="file" id="file" name="file" accept=".json" required><br><br>
+        {% if source == 'api' %}
+        <h2>Animación de PM2.5 directo desde los datos de AireCiudadano</h2>
+        <form id="animationForm" action="/videodata" method="post">
+            <label>Fecha/hora inicial (UTC):</label><br>
+            <input type="date" name="start_date" value="{{ start_date }}" required>
+            <input type="time" name="start_time" value="00:00" required><br><br>
+
+            <label>Fecha/hora final (UTC):</label><br>
+            <input type="date" name="end_date" value="{{ end_date }}" required>
+            <input type="time" name="end_time" value="00:00" required><br><br>
+
+            <label for="step_minutes">Intervalo entre frames (minutos):</label><br>
+            <input type="number" id="step_minutes" name="step_minutes" value="60" min="1" required><br><br>
+
+            <label for="station_filter">Filtro de estaciones (separadas por coma):</label><br>
+            <input type="text" id="station_filter" name="station_filter" value=""><br><br>
+        {% else %}
+        <h2>Sube tu archivo (JSON, CSV o Parquet) para animación de PM2.5</h2>
+        <form id="animationForm" action="/getdata" method="post" enctype="multipart/form-data">
+            <label for="file">Seleccionar archivo JSON, CSV o Parquet:</label><br>
+            <input type="file" id="file" name="file" accept=".json,.csv,.parquet" required><br><br>
+        {% endif %}
             
             <label for="fps">Velocidad de animación (FPS):</label><br>
             <input type="number" id="fps" name="fps" value="2" step="0.1" min="0.1" max="60" required><br><br>
@@ -319,12 +1167,59 @@ def getdata():
             
             <label for="center_lon">Longitud central (Por defecto: Bogotá):</label><br>
             <input type="number" id="center_lon" name="center_lon" value="-74.15" step="0.0001" required><br><br>
+
+            <label for="interpolation_steps">Frames interpolados por cada dato horario (1 = sin interpolación, ej. 24 a 24 FPS):</label><br>
+            <input type="number" id="interpolation_steps" name="interpolation_steps" value="1" min="1" max="120" required><br><br>
+
+            <input type="checkbox" id="heatmap" name="heatmap" value="on">
+            <label for="heatmap">Capa de calor PM2.5 interpolada (IDW)</label><br>
+            <label for="heatmap_radius_km">Radio de influencia de cada estación (km):</label><br>
+            <input type="number" id="heatmap_radius_km" name="heatmap_radius_km" value="3" step="0.5" min="0.5" max="50"><br><br>
+
+            <label for="workers">Procesos de render en paralelo (1 = sin paralelo):</label><br>
+            <input type="number" id="workers" name="workers" value="1" min="1" max="32" required><br><br>
             
-            <button type="submit">Subir archivo y generar animación</button>
+            <button type="submit">{% if source == 'api' %}Generar animación{% else %}Subir archivo y generar animación{% endif %}</button>
+
+            <div id="status_message"></div>
         </form>
+
+        <script>
+            // El video se genera en segundo plano: se consulta el estado del trabajo hasta que esté listo
+            document.getElementById('animationForm').addEventListener('submit', function(event) {
+                event.preventDefault();
+                const statusDiv = document.getElementById('status_message');
+                statusDiv.innerHTML = '<b>Enviando...</b>';
+
+                fetch(event.target.action, { method: 'POST', body: new FormData(event.target) })
+                    .then(response => response.json())
+                    .then(job => {
+                        if (job.error) {
+                            statusDiv.innerHTML = '<span style="color: red;"><b>Error:</b> ' + job.error + '</span>';
+                            return;
+                        }
+                        const poll = () => fetch(job.status_url).then(response => response.json()).then(status => {
+                            if (status.status === 'done') {
+                                statusDiv.innerHTML = '<a href="' + job.video_url + '"><b>Descargar video</b></a>';
+                                window.location = job.video_url;
+                            } else if (status.status === 'error') {
+                                statusDiv.innerHTML = '<span style="color: red;"><b>Error:</b> ' + status.error + '</span>';
+                            } else {
+                                statusDiv.innerHTML = '<b>Generando video (' + status.status + ')... ' +
+                                    status.frames_done + ' / ' + status.total_frames + ' frames</b>';
+                                setTimeout(poll, 1000);
+                            }
+                        });
+                        poll();
+                    })
+                    .catch(err => {
+                        statusDiv.innerHTML = '<span style="color: red;"><b>Error de red:</b> ' + err.message + '</span>';
+                    });
+            });
+        </script>
     </body>
     </html>
-    ''')
+    '''
 
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=8084)
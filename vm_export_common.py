@@ -0,0 +1,238 @@
+# Piezas compartidas por las apps de exportación desde VictoriaMetrics
+# (app_DesdeCompuLocalVM_23may2026.py horaria y app_DesdeCompuLocalVMraw_26may2026.py por minuto)
+
+import threading
+import time
+import bisect
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# MÉTRICAS: tiempos por etapa y /metrics en formato Prometheus
+# ==========================================
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Métricas comunes; cada app puede sumar las suyas al crear su Metrics
+METRIC_HELP = {
+    'dataapi_stage_duration_seconds': ('histogram', 'Time spent per request in each processing stage.'),
+    'dataapi_request_duration_seconds': ('histogram', 'Total /dataresult request time.'),
+    'dataapi_requests_total': ('counter', 'Finished /dataresult requests by format and status.'),
+    'dataapi_response_bytes_total': ('counter', 'Bytes returned by /dataresult.'),
+    'dataapi_requests_in_progress': ('gauge', 'Requests currently inside /dataresult, including rejected ones.'),
+}
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self, extra_help=None):
+        self.help = dict(METRIC_HELP, **(extra_help or {}))
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.values = {}  # counters y gauges
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.histograms.setdefault(key, Histogram()).observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in self.help.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'histogram':
+                    for (key_name, labels), hist in sorted(self.histograms.items()):
+                        if key_name != name:
+                            continue
+                        cumulative = 0
+                        for bound, count in zip(hist.buckets, hist.counts):
+                            cumulative += count
+                            lines.append(f'{name}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+                        lines.append(f'{name}_bucket{label_text(labels, [("le", "+Inf")])} {hist.count}')
+                        lines.append(f'{name}_sum{label_text(labels)} {hist.sum}')
+                        lines.append(f'{name}_count{label_text(labels)} {hist.count}')
+                else:
+                    for (key_name, labels), value in sorted(self.values.items()):
+                        if key_name == name:
+                            lines.append(f'{name}{label_text(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+# Acumula los tiempos de una petición (varios chunks suman en la misma etapa)
+class StageTimer:
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.totals = {}
+        self.status = 'ok'
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - t0
+
+    def record(self, result_format, elapsed, response_bytes):
+        if self.metrics is None:
+            return
+        for stage, seconds in self.totals.items():
+            self.metrics.observe('dataapi_stage_duration_seconds', seconds, format=result_format, stage=stage)
+        self.metrics.observe('dataapi_request_duration_seconds', elapsed, format=result_format, status=self.status)
+        self.metrics.inc('dataapi_requests_total', format=result_format, status=self.status)
+        self.metrics.inc('dataapi_response_bytes_total', response_bytes, format=result_format)
+
+# ==========================================
+# TABLAS COMPACTAS Y PRESUPUESTO DE MEMORIA
+# ==========================================
+# Las tablas intermedias llevan station categórica, date en segundos epoch (int64) y métricas float32
+# con NaN; las fechas solo se formatean como texto al serializar cada bloque
+MEMORY_BUDGET_MB = 1024
+# El presupuesto se revisa antes de gastar la memoria, con estos tamaños medidos (tracemalloc):
+# json.loads de query_range ocupa ~8 bytes por byte de texto, más el texto mismo
+JSON_DECODE_BYTES_PER_BYTE = 9
+# Pico de SeriesBuffer.to_frame por punto, además del propio buffer (claves, factorize, celdas, bincount)
+PIVOT_BYTES_PER_POINT = 64
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+def check_memory_budget(stage, *objects):
+    used = 0
+    for obj in objects:
+        if isinstance(obj, pd.DataFrame):
+            used += int(obj.memory_usage(deep=True).sum())
+        elif hasattr(obj, 'nbytes'):
+            used += obj.nbytes
+        elif isinstance(obj, int):
+            used += obj  # Tamaño ya medido, p. ej. posición de un buffer de texto
+        else:
+            used += len(obj)
+    if used > MEMORY_BUDGET_MB * 1024 * 1024:
+        raise MemoryBudgetExceeded(
+            f'The {stage} stage needs {used / 1048576:.0f} MB, over the {MEMORY_BUDGET_MB} MB budget. '
+            'Please reduce the date range or filter stations.'
+        )
+    return used
+
+# Acumula los puntos de query_range como arrays tipados (18 bytes por punto) en vez de filas de pandas
+class SeriesBuffer:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.column_index = {name: i for i, name in enumerate(self.columns)}
+        self.station_codes = {}
+        self.codes, self.times, self.metrics, self.values = [], [], [], []
+
+    @property
+    def points(self):
+        return sum(len(codes) for codes in self.codes)
+
+    # Memoria que necesitará to_frame, para revisarla antes de pivotear
+    def pivot_bytes(self):
+        return self.points * PIVOT_BYTES_PER_POINT
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for arrays in (self.codes, self.times, self.metrics, self.values) for array in arrays)
+
+    # times/values pueden venir de upstream_cache y compartirse entre peticiones: no se modifican
+    def add(self, station, column, times, values, time_offset=0):
+        metric = self.column_index.get(column)
+        if station is None or metric is None or not len(times):
+            return
+        code = self.station_codes.setdefault(station, len(self.station_codes))
+        self.codes.append(np.full(len(times), code, dtype=np.int32))
+        self.times.append(times - time_offset if time_offset else times)
+        self.metrics.append(np.full(len(times), metric, dtype=np.int16))
+        self.values.append(values)
+
+    def add_result(self, series_list):
+        for station, name, times, values in series_list:
+            self.add(station, name, times, values)
+
+    # Equivale a pivot_table(index=['station', 'date'], columns=metric, aggfunc='mean') ordenado por estación y fecha
+    def to_frame(self):
+        if not self.codes:
+            return pd.DataFrame(columns=['station', 'date'] + self.columns)
+
+        names = list(self.station_codes)
+        rank = np.empty(len(names), dtype=np.int64)
+        rank[np.argsort(names)] = np.arange(len(names))
+
+        # Una clave int64 por fila: estación en los bits altos, segundos epoch en los 32 bajos.
+        # factorize (hash) en vez de np.unique: no ordena ni copia todos los puntos, solo las filas únicas
+        keys = rank[np.concatenate(self.codes)] << 32
+        keys |= np.concatenate(self.times)
+        self.codes, self.times = [], []
+        rows, row_keys = pd.factorize(keys)
+        del keys
+        order = np.argsort(row_keys)
+        unique_keys = row_keys[order]
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+
+        cells = position[rows]
+        del rows, position
+        cells *= len(self.columns)
+        cells += np.concatenate(self.metrics)
+        values = np.concatenate(self.values)
+        self.metrics, self.values = [], []
+        valid = ~np.isnan(values)
+        if not valid.all():
+            cells, values = cells[valid], values[valid]
+
+        # Promedia los datos dobles de un sensor, igual que el pivot_table anterior
+        n_cells = len(unique_keys) * len(self.columns)
+        matrix = np.bincount(cells, weights=values, minlength=n_cells)
+        counts = np.bincount(cells, minlength=n_cells)
+        del cells, values
+        np.divide(matrix, counts, out=matrix, where=counts > 0)
+        matrix[counts == 0] = np.nan
+        del counts
+
+        frame = pd.DataFrame(matrix.astype(np.float32).reshape(len(unique_keys), len(self.columns)), columns=self.columns)
+        frame.insert(0, 'station', pd.Categorical.from_codes((unique_keys >> 32).astype(np.int32), categories=sorted(names)))
+        frame.insert(1, 'date', unique_keys & 0xFFFFFFFF)
+        return frame
+
+# Respuesta de query_range -> [(job, __name__, times int64, values float32)] por serie
+def decode_series(data):
+    series_list = []
+    for series in data:
+        points = series.get('values')
+        if not points:
+            continue
+        metric = series.get('metric', {})
+        times, values = zip(*points)
+        series_list.append((metric.get('job'), metric.get('__name__') or '',
+                            np.asarray(times, dtype=np.float64).astype(np.int64),
+                            np.asarray(values, dtype=np.float32)))
+    return series_list
+
+def format_dates(df, date_format):
+    df['date'] = pd.to_datetime(df['date'], unit='s').dt.strftime(date_format)
+    return df